@@ -0,0 +1,258 @@
+"""Accuracy versus speed of two pipeline variants run on the same inputs.
+
+A variant is a list of processing steps and an input scale. Rectangles are matched across variants by IoU in original
+image coordinates; synthetic inputs are also scored against their ground truth. Run from the repository root:
+
+    python -m benchmarks.accuracy_benchmark --candidate EC,US,TH,BL,ED
+    python -m benchmarks.accuracy_benchmark --candidate EC,US,TH,US,BL,ED --candidate_scale 0.5 --input assets
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import multiprocessing
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from benchmarks.pipeline_benchmark import RESULT_FORMAT_VERSION, environment
+from benchmarks.synthetic_plans import DEFAULT_DPI, DEFAULT_SHELVES, generate_floor_plan
+from src.config_generator import FAVORITE_CONFIGS
+from src.file_utils import iter_images
+from src.geometry import Node, Rectangle
+from src.instrumentation import peak_rss
+
+DEFAULT_IMAGES = 4
+DEFAULT_IOU_THRESHOLD = 0.5
+STEP_SEPARATOR = ','
+NO_COMPONENT = -1
+
+
+def run_variant(variant: dict, inputs: List[Tuple[np.ndarray, str]]) -> dict:
+    """Detect rectangles, lines and nodes on every input with one variant, timing each image.
+    Runs in a fresh process so peak memory belongs to this variant alone."""
+    from src import clustering, image_processing
+    from src.graph_simplifier import GraphSimplifier
+    from src.line_generator import LineGenerator
+    from src.node_generator import NodeGenerator
+    from src.rectangle_detection import RectangleDetector
+
+    clustering.warm_up()
+    image_processing.warm_up()
+    config = {'steps': variant['steps']}
+    images, seconds = [], []
+    for image, name in inputs:
+        with contextlib.redirect_stdout(io.StringIO()):  # The clustering backends print their progress
+            start = time.perf_counter()
+            if variant['scale'] != 1:
+                image = cv2.resize(image, None, fx=variant['scale'], fy=variant['scale'], interpolation=cv2.INTER_AREA)
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            edge_img, rects, upscale_factor = RectangleDetector(gray, image, config).detect()
+            lines = LineGenerator(edge_img, rects, upscale_factor).generate()
+            nodes = GraphSimplifier(NodeGenerator(rects, lines).generate(), upscale_factor).simplify()
+            seconds.append(time.perf_counter() - start)
+        to_original = 1 / (upscale_factor * variant['scale'])
+        images.append({
+            'name': name,
+            'rects': [[rect.x * to_original, rect.y * to_original, rect.w * to_original, rect.h * to_original]
+                      for rect in rects],
+            'components': _rect_components(rects, nodes),
+            'lines': len(lines),
+            'nodes': len(nodes),
+        })
+    return {'variant': variant, 'images': images, 'seconds': seconds, 'peak_rss': peak_rss()}
+
+
+def _rect_components(rects: List[Rectangle], nodes: List[Node]) -> List[int]:
+    """Label each rectangle with the connected component of its terminal node in the node graph."""
+    parent = {node.id: node.id for node in nodes}
+
+    def find(node_id: int) -> int:
+        while parent[node_id] != node_id:
+            parent[node_id] = parent[parent[node_id]]
+            node_id = parent[node_id]
+        return node_id
+
+    for node in nodes:
+        for other_id in node.links:
+            if other_id in parent:
+                parent[find(node.id)] = find(other_id)
+    terminals = {node.connection: find(node.id) for node in nodes if node.connection}
+    return [terminals.get(rect.identifier(), NO_COMPONENT) for rect in rects]
+
+
+def match_rectangles(reference: List[List[float]], candidate: List[List[float]],
+                     threshold=DEFAULT_IOU_THRESHOLD) -> List[Tuple[int, int, float]]:
+    """Greedily pair rectangles by descending IoU, each at most once, and return (reference, candidate, IoU)."""
+    if not reference or not candidate:
+        return []
+    a, b = np.asarray(reference, dtype=np.float64), np.asarray(candidate, dtype=np.float64)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2])
+    y2 = np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - intersection
+    iou = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+    matches, used_reference, used_candidate = [], set(), set()
+    for flat_index in np.argsort(-iou, axis=None):
+        i, j = np.unravel_index(flat_index, iou.shape)
+        if iou[i, j] < threshold:
+            break
+        if i not in used_reference and j not in used_candidate:
+            matches.append((int(i), int(j), float(iou[i, j])))
+            used_reference.add(i)
+            used_candidate.add(j)
+    return matches
+
+
+def detection_scores(truth: List[List[float]], detected: List[List[float]], threshold=DEFAULT_IOU_THRESHOLD) -> dict:
+    matches = match_rectangles(truth, detected, threshold)
+    return {'matched': len(matches), 'truth': len(truth), 'detected': len(detected),
+            'precision': len(matches) / len(detected) if detected else 1.0,
+            'recall': len(matches) / len(truth) if truth else 1.0,
+            'mean_iou': float(np.mean([iou for _, _, iou in matches])) if matches else None}
+
+
+def connectivity(components: List[int]) -> float:
+    """Fraction of rectangle pairs joined by the node graph."""
+    num_rects = len(components)
+    if num_rects < 2:
+        return 1.0
+    sizes: Dict[int, int] = {}
+    for component in components:
+        if component != NO_COMPONENT:
+            sizes[component] = sizes.get(component, 0) + 1
+    return sum(size * (size - 1) for size in sizes.values()) / (num_rects * (num_rects - 1))
+
+
+def connectivity_agreement(reference: List[int], candidate: List[int], matches: List[Tuple[int, int, float]]) -> float:
+    """Fraction of matched rectangle pairs that both variants agree are, or are not, joined by the node graph."""
+    agreed = total = 0
+    for k, (i1, j1, _) in enumerate(matches):
+        for i2, j2, _ in matches[k + 1:]:
+            joined_reference = reference[i1] != NO_COMPONENT and reference[i1] == reference[i2]
+            joined_candidate = candidate[j1] != NO_COMPONENT and candidate[j1] == candidate[j2]
+            agreed += joined_reference == joined_candidate
+            total += 1
+    return agreed / total if total else 1.0
+
+
+def compare(reference: dict, candidate: dict, truths: Optional[List[List[List[float]]]],
+            threshold=DEFAULT_IOU_THRESHOLD) -> dict:
+    images = []
+    for k, (ref, cand) in enumerate(zip(reference['images'], candidate['images'])):
+        matches = match_rectangles(ref['rects'], cand['rects'], threshold)
+        image = {
+            'name': ref['name'],
+            'against_reference': detection_scores(ref['rects'], cand['rects'], threshold),
+            'lines': [ref['lines'], cand['lines']],
+            'nodes': [ref['nodes'], cand['nodes']],
+            'connectivity': [connectivity(ref['components']), connectivity(cand['components'])],
+            'connectivity_agreement': connectivity_agreement(ref['components'], cand['components'], matches),
+            'seconds': [reference['seconds'][k], candidate['seconds'][k]],
+        }
+        if truths is not None:
+            image['against_truth'] = [detection_scores(truths[k], ref['rects'], threshold),
+                                      detection_scores(truths[k], cand['rects'], threshold)]
+        images.append(image)
+
+    summary = {
+        'precision_vs_reference': _mean(image['against_reference']['precision'] for image in images),
+        'recall_vs_reference': _mean(image['against_reference']['recall'] for image in images),
+        'lines': [_mean(image['lines'][v] for image in images) for v in (0, 1)],
+        'nodes': [_mean(image['nodes'][v] for image in images) for v in (0, 1)],
+        'connectivity': [_mean(image['connectivity'][v] for image in images) for v in (0, 1)],
+        'connectivity_agreement': _mean(image['connectivity_agreement'] for image in images),
+        'seconds_per_image': [_mean(variant['seconds']) for variant in (reference, candidate)],
+        'speedup': sum(reference['seconds']) / sum(candidate['seconds']),
+        'memory_ratio': candidate['peak_rss'] / reference['peak_rss']
+        if reference['peak_rss'] and candidate['peak_rss'] else None,
+    }
+    if truths is not None:
+        for metric in ('precision', 'recall'):
+            values = [_mean(image['against_truth'][v][metric] for image in images) for v in (0, 1)]
+            summary[f'{metric}_vs_truth'] = values
+            summary[f'{metric}_delta'] = values[1] - values[0]
+    return {'summary': summary, 'images': images}
+
+
+def _mean(values) -> float:
+    return float(np.mean(list(values)))
+
+
+def parse_variant(steps: str, scale: float) -> dict:
+    return {'name': f"{'->'.join(steps.split(STEP_SEPARATOR))}@{scale:g}", 'steps': steps.split(STEP_SEPARATOR),
+            'scale': scale}
+
+
+def load_inputs(args: argparse.Namespace) -> Tuple[List[Tuple[np.ndarray, str]], Optional[List[List[List[float]]]]]:
+    """Load real inputs from a folder, or generate synthetic plans along with their ground-truth shelves."""
+    if args.input:
+        return list(iter_images(args.input, num_files=args.images)), None
+    inputs, truths = [], []
+    for i in range(args.images):
+        image, rects = generate_floor_plan(dpi=args.dpi, shelves=args.shelves, seed=i)
+        inputs.append((image, f'plan_{i}'))
+        truths.append([[rect.x, rect.y, rect.w, rect.h] for rect in rects])
+    return inputs, truths
+
+
+def print_summary(reference: dict, candidate: dict, summary: dict):
+    print(f"\nReference: {reference['name']}\nCandidate: {candidate['name']}\n")
+    rows = [('Seconds per image', *summary['seconds_per_image']), ('Lines per image', *summary['lines']),
+            ('Nodes per image', *summary['nodes']), ('Connected rect pairs', *summary['connectivity'])]
+    if 'precision_vs_truth' in summary:
+        rows += [('Precision vs truth', *summary['precision_vs_truth']),
+                 ('Recall vs truth', *summary['recall_vs_truth'])]
+    print(f"{'Metric':<24} {'Reference':>10} {'Candidate':>10} {'Delta':>10}")
+    for name, ref, cand in rows:
+        print(f"{name:<24} {ref:>10.3f} {cand:>10.3f} {cand - ref:>+10.3f}")
+    print(f"\nPrecision / recall against the reference: {summary['precision_vs_reference']:.3f} / "
+          f"{summary['recall_vs_reference']:.3f}")
+    print(f"Connectivity agreement on matched pairs: {summary['connectivity_agreement']:.3f}")
+    memory = f"{summary['memory_ratio']:.2f}x" if summary['memory_ratio'] else 'unknown'
+    print(f"Speedup: {summary['speedup']:.2f}x, memory ratio: {memory}")
+
+
+def main_cli(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Compare accuracy and speed of two pipeline variants.')
+    parser.add_argument('--reference', default=STEP_SEPARATOR.join(FAVORITE_CONFIGS[2]),
+                        help='Comma separated processing steps of the reference variant')
+    parser.add_argument('--reference_scale', type=float, default=1.0, help='Input scale of the reference variant')
+    parser.add_argument('--candidate', required=True, help='Comma separated processing steps of the candidate variant')
+    parser.add_argument('--candidate_scale', type=float, default=1.0, help='Input scale of the candidate variant')
+    parser.add_argument('-i', '--input', default=None,
+                        help='Folder of real inputs, synthetic plans with ground truth are used when omitted')
+    parser.add_argument('--images', type=int, default=DEFAULT_IMAGES, help='Number of inputs')
+    parser.add_argument('--dpi', type=int, default=DEFAULT_DPI, help='DPI of synthetic plans')
+    parser.add_argument('--shelves', type=int, default=DEFAULT_SHELVES, help='Shelves per synthetic plan')
+    parser.add_argument('--iou', type=float, default=DEFAULT_IOU_THRESHOLD, help='IoU needed to match rectangles')
+    parser.add_argument('-o', '--output', default='accuracy_results.json', help='JSON file to write results to')
+    args = parser.parse_args(argv)
+
+    inputs, truths = load_inputs(args)
+    variants = [parse_variant(args.reference, args.reference_scale), parse_variant(args.candidate,
+                                                                                  args.candidate_scale)]
+    runs = []
+    for variant in variants:
+        print(f"Running variant {variant['name']} ...", file=sys.stderr)
+        # A fresh spawned process per variant keeps peak memory and warm caches apart
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            runs.append(executor.submit(run_variant, variant, inputs).result())
+
+    comparison = compare(runs[0], runs[1], truths, args.iou)
+    report = {'format_version': RESULT_FORMAT_VERSION, 'environment': environment(), 'variants': variants,
+              'iou_threshold': args.iou, **comparison}
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print_summary(*variants, comparison['summary'])
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main_cli()
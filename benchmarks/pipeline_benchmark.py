@@ -0,0 +1,184 @@
+"""Throughput benchmark of the image pipeline on synthetic floor plans.
+
+Run from the repository root, for example:
+
+    python -m benchmarks.pipeline_benchmark --dpi 100 150 --shelves 20 40 -o bench.json
+    python -m benchmarks.pipeline_benchmark --baseline bench.json -o bench_new.json
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.synthetic_plans import DEFAULT_AISLE_RATIO, DEFAULT_GRAIN, DEFAULT_NOISE, generate_floor_plan, \
+    save_floor_plan
+from src.config_generator import generate_configs
+from src.file_utils import PNG_EXTENSION, PDF_EXTENSION, iter_images
+from src.image_pipeline import process_image
+from src.instrumentation import TRACE_FILE, RSS_UNIT, peak_rss
+from src.scheduler import BACKENDS, PROCESS_BACKEND, TaskScheduler
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_DPIS = (150,)
+DEFAULT_SHELF_COUNTS = (20,)
+DEFAULT_IMAGES = 4
+DEFAULT_FORMATS = ('png',)
+RESULT_FORMAT_VERSION = 1
+
+
+def run_scenario(scenario: dict) -> dict:
+    """Generate the inputs of a scenario and time both the in-memory pipeline and the full CLI flow over them.
+    Runs in a fresh process so peak memory belongs to this scenario alone."""
+    import main  # Repository root module, imported here so only scenario processes pay for it
+
+    with tempfile.TemporaryDirectory(prefix='layroad_bench_') as work_dir:
+        input_dir = os.path.join(work_dir, 'inputs')
+        images, expected = [], 0
+        for i in range(scenario['images']):
+            image, rects = generate_floor_plan(dpi=scenario['dpi'], shelves=scenario['shelves'],
+                                               aisle_ratio=scenario['aisle_ratio'], noise=scenario['noise'],
+                                               grain=scenario['grain'], seed=i)
+            extension = PDF_EXTENSION if scenario['format'] == 'pdf' else PNG_EXTENSION
+            save_floor_plan(image, os.path.join(input_dir, f'plan_{i}{extension}'), dpi=scenario['dpi'])
+            images.append((image, f'plan_{i}{extension}'))
+            expected += len(rects)
+
+        # In-memory pipeline, decoded images straight into process_image
+        configs = generate_configs()
+        scheduler = TaskScheduler(backend=scenario['backend'], persistent=True)
+        scheduler.warm_up()
+        records, detected = [], 0
+        start = time.perf_counter()
+        for image_with_name in images:
+            _, results = process_image(image_with_name, configs, scheduler=scheduler)
+            detected += results[0].num_rects
+            for result in results:
+                records.extend(result.records)
+                result.release()
+        pipeline_seconds = time.perf_counter() - start
+        scheduler.shutdown()
+        del images
+
+        # Full CLI flow: load from disk, process, save shapes, layouts and previews
+        output_dir = os.path.join(work_dir, 'outputs')
+        start = time.perf_counter()
+        main.process_images(iter_images(input_dir, num_files=scenario['images'], cache_dir=None), output_dir,
+                            max_images=1, backend=scenario['backend'], trace=True)
+        cli_seconds = time.perf_counter() - start
+        with open(os.path.join(output_dir, TRACE_FILE)) as file:
+            cli_events = json.load(file)['traceEvents']
+
+    num_images = scenario['images']
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * RSS_UNIT if resource else None
+    return {
+        'scenario': scenario,
+        'pipeline': {
+            'seconds': pipeline_seconds,
+            'images_per_second': num_images / pipeline_seconds,
+            'stage_seconds_per_image': _stage_seconds(((r.name, r.wall) for r in records), num_images),
+            'detected_rects': detected,
+            'expected_rects': expected,
+        },
+        'cli': {
+            'seconds': cli_seconds,
+            'images_per_second': num_images / cli_seconds,
+            'stage_seconds_per_image': _stage_seconds(((e['name'], e['dur'] / 1e6) for e in cli_events), num_images),
+        },
+        'peak_rss_mb': _megabytes(peak_rss()),
+        'peak_worker_rss_mb': _megabytes(children_rss),
+    }
+
+
+def _stage_seconds(stages, num_images: int) -> Dict[str, float]:
+    totals: Dict[str, float] = {}
+    for name, seconds in stages:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return {name: total / num_images for name, total in sorted(totals.items())}
+
+
+def _megabytes(num_bytes: Optional[int]) -> Optional[float]:
+    return None if num_bytes is None else round(num_bytes / 1024 ** 2, 1)
+
+
+def build_scenarios(args: argparse.Namespace) -> List[dict]:
+    return [{'name': f"{file_format}_dpi{dpi}_shelves{shelves}", 'format': file_format, 'dpi': dpi,
+             'shelves': shelves, 'aisle_ratio': args.aisle_ratio, 'noise': args.noise, 'grain': args.grain,
+             'images': args.images, 'backend': args.backend}
+            for file_format, dpi, shelves in itertools.product(args.formats, args.dpi, args.shelves)]
+
+
+def environment() -> dict:
+    """Describe the machine and commit so results can be compared between runs."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpu_count': os.cpu_count(), 'timestamp': time.time()}
+
+
+def print_summary(results: List[dict], baseline: Optional[dict] = None):
+    previous = {result['scenario']['name']: result for result in (baseline or {}).get('results', [])}
+    print(f"\n{'Scenario':<32} {'Pipeline img/s':>15} {'CLI img/s':>10} {'Rects':>9} {'Peak RSS (MB)':>14}"
+          f"{' Speedup':>9}" * bool(previous))
+    for result in results:
+        name = result['scenario']['name']
+        pipeline, cli = result['pipeline'], result['cli']
+        rects = f"{pipeline['detected_rects']}/{pipeline['expected_rects']}"
+        rss = max(filter(None, (result['peak_rss_mb'], result['peak_worker_rss_mb'])), default=0)
+        line = f"{name:<32} {pipeline['images_per_second']:>15.2f} {cli['images_per_second']:>10.2f} {rects:>9} " \
+               f"{rss:>14.1f}"
+        if name in previous:
+            line += f" {pipeline['images_per_second'] / previous[name]['pipeline']['images_per_second']:>8.2f}x"
+        print(line)
+
+
+def main_cli(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Benchmark the image pipeline on synthetic floor plans.')
+    parser.add_argument('--dpi', type=int, nargs='+', default=list(DEFAULT_DPIS), help='Rendering DPIs to sweep')
+    parser.add_argument('--shelves', type=int, nargs='+', default=list(DEFAULT_SHELF_COUNTS),
+                        help='Shelf counts to sweep')
+    parser.add_argument('--formats', nargs='+', default=list(DEFAULT_FORMATS), choices=('png', 'pdf'),
+                        help='Input file formats, PDF inputs need poppler')
+    parser.add_argument('--aisle_ratio', type=float, default=DEFAULT_AISLE_RATIO, help='Aisle width / shelf size')
+    parser.add_argument('--noise', type=float, default=DEFAULT_NOISE, help='Fraction of speck pixels')
+    parser.add_argument('--grain', type=float, default=DEFAULT_GRAIN, help='Gaussian noise in intensity levels')
+    parser.add_argument('--images', type=int, default=DEFAULT_IMAGES, help='Images per scenario')
+    parser.add_argument('-b', '--backend', default=PROCESS_BACKEND, choices=BACKENDS, help='Execution backend')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='JSON file to write results to')
+    parser.add_argument('--baseline', default=None, help='Earlier results JSON to report speedups against')
+    args = parser.parse_args(argv)
+
+    results = []
+    for scenario in build_scenarios(args):
+        print(f"Running scenario {scenario['name']} ...", file=sys.stderr)
+        # A fresh spawned process per scenario keeps peak memory and warm caches from leaking between scenarios
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results.append(executor.submit(run_scenario, scenario).result())
+
+    report = {'format_version': RESULT_FORMAT_VERSION, 'environment': environment(), 'results': results}
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_summary(results, baseline)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,298 @@
+"""Routing scalability benchmark: the grid Dijkstra POC against RoutingGraph on a sparse travel network.
+
+Run from the repository root, for example:
+
+    python -m benchmarks.routing_benchmark --grid 50 100 200 --rects 50 200 --picks 5 8 20 -o routing
+"""
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import math
+import random
+import sys
+import time
+import tracemalloc
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from src.geometry import Rectangle
+from src.layout_io import Layout
+from src.routing import RoutingGraph
+from tests.pathfinding import Pathfinding
+from tests.tsp_solver import calculate_tsp_path
+
+DEFAULT_GRID_SIZES = (50, 100)
+DEFAULT_RECT_COUNTS = (20, 50)
+DEFAULT_OBSTACLE_DENSITIES = (0.05,)
+DEFAULT_PICK_LENGTHS = (4, 8)
+DEFAULT_ORDERS = 5
+DEFAULT_LATTICE_STRIDE = 4
+POC_TSP_MAX_STOPS = 8  # Brute force over (N-1)! permutations, beyond this a single order takes minutes
+DEFAULT_MAX_POC_PAIRS = 5_000
+MAX_PLACEMENT_ATTEMPTS = 10_000
+DIAGONAL_COST = math.sqrt(2)
+POC_ENGINE = 'poc'
+GRAPH_ENGINE = 'routing_graph'
+CSV_FIELDS = ('grid_size', 'rectangles', 'obstacle_density', 'obstacles', 'engine', 'graph_nodes', 'graph_edges',
+              'build_seconds', 'build_expansions', 'build_peak_mb', 'pick_length', 'orders', 'tsp_ms_mean',
+              'path_ms_mean', 'tour_length_mean', 'distance_error_mean', 'skipped')
+
+
+def generate_layout(grid_size: int, num_rects: int, obstacle_density: float,
+                    seed=0) -> Tuple[List[Rectangle], List[Rectangle]]:
+    """Place non-touching rectangles and obstacles like tests.grid_manager, with shape sizes scaled to the grid.
+    Rectangle 1 is the depot in the top left corner; ids start at 1 because the POC grid marks free cells with 0."""
+    rng = random.Random(seed)
+    min_side, max_side = max(2, grid_size // 40), max(3, grid_size // 13)
+    num_obstacles = round(obstacle_density * grid_size ** 2 / ((min_side + max_side) / 2) ** 2)
+    depot = Rectangle(0, 0, min_side, min_side)
+    shapes = [depot]
+    for _ in range(num_rects - 1 + num_obstacles):
+        for _ in range(MAX_PLACEMENT_ATTEMPTS):
+            w, h = rng.randint(min_side, max_side), rng.randint(min_side, max_side)
+            candidate = Rectangle(rng.randint(0, grid_size - w), rng.randint(0, grid_size - h), w, h)
+            if not any(_touches(candidate, shape) for shape in shapes):
+                shapes.append(candidate)
+                break
+        else:
+            raise ValueError(f"Cannot place {num_rects} rectangles and {num_obstacles} obstacles on a "
+                             f"{grid_size}x{grid_size} grid")
+    for shape_id, shape in enumerate(shapes, start=1):
+        shape.id = shape_id
+    return shapes[:num_rects], shapes[num_rects:]
+
+
+def _touches(a: Rectangle, b: Rectangle) -> bool:
+    return a.x <= b.x + b.w and a.x + a.w >= b.x and a.y <= b.y + b.h and a.y + a.h >= b.y
+
+
+def create_grid(grid_size: int, shapes: List[Rectangle]) -> np.ndarray:
+    """Vectorized equivalent of tests.grid_manager.create_grid."""
+    grid = np.zeros((grid_size, grid_size), dtype=int)
+    for shape in shapes:
+        grid[shape.y:shape.y + shape.h, shape.x:shape.x + shape.w] = shape.id
+    return grid
+
+
+def build_travel_layout(grid: np.ndarray, rects: List[Rectangle], stride: int) -> Layout:
+    """Build a sparse travel network: free cells on a lattice linked to their 8 lattice neighbours by clear straight
+    segments, plus one terminal node per rectangle at the POC terminal point (its centre), linked to nearby lattice
+    nodes. Edge weights are octile distances, like the moves of the grid Dijkstra."""
+    grid_size = len(grid)
+    node_ids: Dict[Tuple[int, int], int] = {}
+    for y, x in itertools.product(range(0, grid_size, stride), repeat=2):
+        if grid[y, x] == 0:
+            node_ids[(x, y)] = len(node_ids)
+    edges = {}
+    for (x, y), u in node_ids.items():
+        for dx, dy in ((stride, 0), (0, stride), (stride, stride), (stride, -stride)):
+            v = node_ids.get((x + dx, y + dy))
+            if v is not None and _segment_clear(grid, (x, y), (x + dx, y + dy), 0):
+                edges[(u, v)] = _octile((x, y), (x + dx, y + dy))
+    connections = [-1] * len(node_ids)
+    positions = list(node_ids)
+    for rect in rects:
+        centre = (rect.x + rect.w // 2, rect.y + rect.h // 2)
+        terminal = len(positions)
+        positions.append(centre)
+        connections.append(rect.id)
+        x0, x1 = (rect.x - stride) // stride * stride, rect.x + rect.w + stride
+        y0, y1 = (rect.y - stride) // stride * stride, rect.y + rect.h + stride
+        for x, y in itertools.product(range(max(0, x0), x1 + 1, stride), range(max(0, y0), y1 + 1, stride)):
+            v = node_ids.get((x, y))
+            if v is not None and _segment_clear(grid, centre, (x, y), rect.id):
+                edges[(terminal, v)] = _octile(centre, (x, y))
+    nodes = np.array([(i, x, y) for i, (x, y) in enumerate(positions)], dtype=np.int32).reshape(-1, 3)
+    return Layout(np.zeros((0, 6), dtype=np.int32), np.zeros((0, 5), dtype=np.int32), nodes,
+                  np.array(connections, dtype=np.int32), np.array(list(edges), dtype=np.int32).reshape(-1, 2),
+                  np.array(list(edges.values()), dtype=np.float64))
+
+
+def _segment_clear(grid: np.ndarray, start: Tuple[int, int], end: Tuple[int, int], own_id: int) -> bool:
+    """Check that every cell on the segment is free or belongs to the shape the segment starts from."""
+    steps = max(abs(end[0] - start[0]), abs(end[1] - start[1])) + 1
+    xs = np.rint(np.linspace(start[0], end[0], steps)).astype(int)
+    ys = np.rint(np.linspace(start[1], end[1], steps)).astype(int)
+    cells = grid[ys, xs]
+    return bool(np.all((cells == 0) | (cells == own_id)))
+
+
+def _octile(a: Tuple[int, int], b: Tuple[int, int]) -> float:
+    dx, dy = abs(a[0] - b[0]), abs(a[1] - b[1])
+    return max(dx, dy) + (DIAGONAL_COST - 1) * min(dx, dy)
+
+
+@contextlib.contextmanager
+def count_poc_expansions() -> Iterator[List[int]]:
+    """Count nodes expanded by the POC Dijkstra, which asks for the neighbours of every node it settles."""
+    counter = [0]
+    original = Pathfinding._get_neighbors
+
+    def counting_get_neighbors(position, grid_size, directions):
+        counter[0] += 1
+        return original(position, grid_size, directions)
+
+    Pathfinding._get_neighbors = staticmethod(counting_get_neighbors)
+    try:
+        yield counter
+    finally:
+        Pathfinding._get_neighbors = staticmethod(original)
+
+
+def measure_peak_memory(function) -> float:
+    """Run the function again under tracemalloc and return its peak allocation in MB.
+    Kept apart from the timed run because tracing slows Python code down several times."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    finally:
+        tracemalloc.stop()
+
+
+def run_layout(grid_size: int, num_rects: int, obstacle_density: float, pick_lengths: List[int], orders: int,
+               stride: int, max_poc_pairs: int, measure_memory: bool, seed: int) -> List[dict]:
+    rects, obstacles = generate_layout(grid_size, num_rects, obstacle_density, seed)
+    grid = create_grid(grid_size, rects + obstacles)
+    base = {'grid_size': grid_size, 'rectangles': num_rects, 'obstacle_density': obstacle_density,
+            'obstacles': len(obstacles)}
+    rng = random.Random(seed)
+    rows = []
+
+    # Graph engine: sparse travel network, all-pairs matrices built once, every order is then a lookup and a tour
+    layout = build_travel_layout(grid, rects, stride)
+    start = time.perf_counter()
+    graph = RoutingGraph.from_layout(layout).build()
+    graph_build = time.perf_counter() - start
+    graph_memory = measure_peak_memory(lambda: RoutingGraph.from_layout(layout).build()) if measure_memory else None
+    terminal_nodes = {rect.id: graph.terminal_node(rect.id) for rect in rects}
+    reachable = [rect.id for rect in rects[1:] if math.isfinite(graph.distance(terminal_nodes[rects[0].id],
+                                                                                terminal_nodes[rect.id]))]
+
+    # POC engine: one grid Dijkstra per rectangle pair
+    num_pairs = num_rects * (num_rects - 1) // 2
+    poc_distances = poc_paths = None
+    poc_row = {**base, 'engine': POC_ENGINE, 'graph_nodes': int((grid == 0).sum()) + num_rects}
+    if num_pairs > max_poc_pairs:
+        poc_row['skipped'] = f"{num_pairs} pairs > --max_poc_pairs {max_poc_pairs}"
+    else:
+        with count_poc_expansions() as expansions, contextlib.redirect_stdout(sys.stderr):
+            start = time.perf_counter()
+            poc_distances, poc_paths = Pathfinding.calculate_all_distances(rects, grid)
+            poc_row['build_seconds'] = time.perf_counter() - start
+        poc_row['build_expansions'] = expansions[0]
+        if measure_memory:
+            with contextlib.redirect_stdout(sys.stderr):
+                poc_row['build_peak_mb'] = measure_peak_memory(
+                    lambda: Pathfinding.calculate_all_distances(rects, grid))
+        reachable = [rect_id for rect_id in reachable if (rects[0].id, rect_id) in poc_distances]
+
+    graph_row = {**base, 'engine': GRAPH_ENGINE, 'graph_nodes': len(graph.node_ids),
+                 'graph_edges': len(layout.edges), 'build_seconds': graph_build, 'build_expansions': graph.expansions,
+                 'build_peak_mb': graph_memory}
+    if poc_distances:
+        errors = [graph.distance(terminal_nodes[a], terminal_nodes[b]) / poc_distances[(a, b)] - 1
+                  for (a, b) in poc_distances if a < b and poc_distances[(a, b)] > 0]
+        graph_row['distance_error_mean'] = float(np.mean(errors)) if errors else None
+
+    for pick_length in pick_lengths:
+        picks = [[rects[0].id] + rng.sample(reachable, min(pick_length, len(reachable))) for _ in range(orders)]
+        rows.append({**graph_row, 'pick_length': pick_length, 'orders': orders, **_time_graph_orders(graph, picks)})
+        if poc_distances is None:
+            rows.append({**poc_row, 'pick_length': pick_length, 'orders': orders})
+        elif pick_length > POC_TSP_MAX_STOPS:
+            rows.append({**poc_row, 'pick_length': pick_length, 'orders': orders,
+                         'skipped': f"brute force TSP limited to {POC_TSP_MAX_STOPS} stops"})
+        else:
+            rows.append({**poc_row, 'pick_length': pick_length, 'orders': orders,
+                         **_time_poc_orders(poc_distances, poc_paths, picks)})
+    return rows
+
+
+def _time_graph_orders(graph: RoutingGraph, picks: List[List[int]]) -> dict:
+    tsp_seconds, lengths = [], []
+    for pick in picks:
+        start = time.perf_counter()
+        _, length, _ = graph.route(pick)  # Tour and full node path in one call
+        tsp_seconds.append(time.perf_counter() - start)
+        lengths.append(length)
+    return {'tsp_ms_mean': float(np.mean(tsp_seconds)) * 1000, 'tour_length_mean': float(np.mean(lengths))}
+
+
+def _time_poc_orders(distances: dict, paths: dict, picks: List[List[int]]) -> dict:
+    tsp_seconds, path_seconds, lengths = [], [], []
+    for pick in picks:
+        start = time.perf_counter()
+        tour, length = calculate_tsp_path(distances, pick, pick[0])
+        tsp_seconds.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        cells = [cell for a, b in zip(tour, tour[1:]) for cell in paths[(a, b)]]
+        path_seconds.append(time.perf_counter() - start)
+        lengths.append(length)
+        del cells
+    return {'tsp_ms_mean': float(np.mean(tsp_seconds)) * 1000, 'path_ms_mean': float(np.mean(path_seconds)) * 1000,
+            'tour_length_mean': float(np.mean(lengths))}
+
+
+def write_results(rows: List[dict], output_prefix: str):
+    with open(f'{output_prefix}.json', 'w') as file:
+        json.dump(rows, file, indent=2)
+    with open(f'{output_prefix}.csv', 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_summary(rows: List[dict]):
+    print(f"\n{'G':>5} {'N':>5} {'Obst':>5} {'Engine':<14} {'Build (s)':>10} {'Expansions':>11} {'Peak (MB)':>10} "
+          f"{'Picks':>6} {'TSP (ms)':>10} {'Tour':>9}  Note")
+    for row in rows:
+        cells = [_format_cell(row.get(key), width, digits) for key, width, digits in (
+            ('build_seconds', 10, 3), ('build_expansions', 11, 0), ('build_peak_mb', 10, 2), ('pick_length', 6, 0),
+            ('tsp_ms_mean', 10, 3), ('tour_length_mean', 9, 1))]
+        print(f"{row['grid_size']:>5} {row['rectangles']:>5} {row['obstacle_density']:>5} {row.get('engine', '-'):<14} "
+              f"{' '.join(cells)}  {row.get('skipped') or ''}")
+
+
+def _format_cell(value, width: int, digits: int) -> str:
+    return f"{'-':>{width}}" if value is None else f"{value:>{width}.{digits}f}"
+
+
+def main_cli(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Benchmark routing engines across layout size and pick length.')
+    parser.add_argument('--grid', type=int, nargs='+', default=list(DEFAULT_GRID_SIZES), help='Grid sizes (G)')
+    parser.add_argument('--rects', type=int, nargs='+', default=list(DEFAULT_RECT_COUNTS),
+                        help='Rectangle counts (N), including the depot')
+    parser.add_argument('--obstacles', type=float, nargs='+', default=list(DEFAULT_OBSTACLE_DENSITIES),
+                        help='Fractions of the grid covered by obstacles')
+    parser.add_argument('--picks', type=int, nargs='+', default=list(DEFAULT_PICK_LENGTHS),
+                        help='Pick-list lengths, excluding the depot')
+    parser.add_argument('--orders', type=int, default=DEFAULT_ORDERS, help='Random orders per pick-list length')
+    parser.add_argument('--stride', type=int, default=DEFAULT_LATTICE_STRIDE,
+                        help='Lattice spacing of the sparse travel network in cells')
+    parser.add_argument('--max_poc_pairs', type=int, default=DEFAULT_MAX_POC_PAIRS,
+                        help='Skip the POC engine when it would run more pairwise searches than this')
+    parser.add_argument('--no_memory', action='store_true', help='Skip the traced memory runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='routing_benchmark', help='Output path prefix for .json and .csv')
+    args = parser.parse_args(argv)
+
+    rows = []
+    for grid_size, num_rects, density in itertools.product(args.grid, args.rects, args.obstacles):
+        print(f"Layout G={grid_size} N={num_rects} obstacles={density} ...", file=sys.stderr)
+        try:
+            rows.extend(run_layout(grid_size, num_rects, density, args.picks, args.orders, args.stride,
+                                   args.max_poc_pairs, not args.no_memory, args.seed))
+        except ValueError as e:
+            rows.append({'grid_size': grid_size, 'rectangles': num_rects, 'obstacle_density': density,
+                         'skipped': str(e)})
+    write_results(rows, args.output)
+    print_summary(rows)
+    print(f"\nResults written to {args.output}.json and {args.output}.csv")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,147 @@
+"""Correctness check of the incremental all-pairs repair in RoutingGraph.
+
+Applies random edge insertions, removals, reweightings and obstacles to a built graph and compares its distance and
+predecessor matrices after every change with a RoutingGraph built from scratch over the same edges. Run from the
+repository root, for example:
+
+    python -m benchmarks.routing_check --nodes 40 80 --operations 300 --seeds 5
+"""
+import argparse
+import itertools
+import random
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.geometry import Rectangle
+from src.layout_io import Layout
+from src.routing import DISTANCE_EPSILON, NO_PREDECESSOR, RoutingGraph
+
+DEFAULT_NODE_COUNTS = (30, 60)
+DEFAULT_OPERATIONS = 200
+DEFAULT_SEEDS = 3
+PLANE_SIZE = 100
+NEIGHBOURS = 4  # Each node is linked to this many of its nearest nodes at first, most graphs start connected
+MAX_OBSTACLES = 3
+ADD_EDGE, REMOVE_EDGE, REWEIGHT_EDGE, ADD_OBSTACLE, REMOVE_OBSTACLE = 'add', 'remove', 'reweight', 'block', 'unblock'
+OPERATIONS = (ADD_EDGE, ADD_EDGE, REMOVE_EDGE, REMOVE_EDGE, REWEIGHT_EDGE, ADD_OBSTACLE, REMOVE_OBSTACLE)
+
+Edge = Tuple[int, int]
+
+
+def random_layout(num_nodes: int, rng: random.Random) -> Layout:
+    """Scatter nodes on integer positions and link each to its nearest nodes by Manhattan distance.
+    Integer weights make equally short paths common, the case where predecessors are easiest to get wrong."""
+    positions = rng.sample(list(itertools.product(range(PLANE_SIZE), repeat=2)), num_nodes)
+    edges = {}
+    for u, (x, y) in enumerate(positions):
+        nearest = sorted(range(num_nodes), key=lambda v: abs(positions[v][0] - x) + abs(positions[v][1] - y))
+        for v in nearest[1:NEIGHBOURS + 1]:
+            edges[(min(u, v), max(u, v))] = float(abs(positions[v][0] - x) + abs(positions[v][1] - y))
+    nodes = np.array([(i, x, y) for i, (x, y) in enumerate(positions)], dtype=np.int32).reshape(-1, 3)
+    return Layout(np.zeros((0, 6), dtype=np.int32), np.zeros((0, 5), dtype=np.int32), nodes,
+                  np.full(num_nodes, -1, dtype=np.int32), np.array(list(edges), dtype=np.int32).reshape(-1, 2),
+                  np.array(list(edges.values()), dtype=np.float64))
+
+
+def current_edges(graph: RoutingGraph) -> Dict[Edge, float]:
+    return {(u, v): weight for u, neighbors in enumerate(graph.adjacency) for v, weight in neighbors.items() if u < v}
+
+
+def rebuild(graph: RoutingGraph) -> RoutingGraph:
+    """Build a graph from scratch over the current edges of another one."""
+    edges = current_edges(graph)
+    nodes = np.array([(node_id, x, y) for node_id, (x, y) in zip(graph.node_ids, graph.positions.tolist())],
+                     dtype=np.int32).reshape(-1, 3)
+    layout = Layout(np.zeros((0, 6), dtype=np.int32), np.zeros((0, 5), dtype=np.int32), nodes,
+                    np.full(len(nodes), -1, dtype=np.int32), np.array(list(edges), dtype=np.int32).reshape(-1, 2),
+                    np.array(list(edges.values()), dtype=np.float64))
+    return RoutingGraph.from_layout(layout).build()
+
+
+def compare(graph: RoutingGraph, fresh: RoutingGraph) -> Optional[str]:
+    """Return why the repaired matrices disagree with a fresh build, or None when they agree.
+    Distances must match; predecessors may differ between equally short paths, so each must close a shortest path
+    over an existing edge instead."""
+    finite = np.isfinite(fresh.dist)
+    if not np.array_equal(finite, np.isfinite(graph.dist)):
+        return "reachability differs"
+    if not np.allclose(graph.dist[finite], fresh.dist[finite], rtol=0, atol=DISTANCE_EPSILON):
+        return f"distances differ by up to {np.abs(graph.dist[finite] - fresh.dist[finite]).max():g}"
+    if not np.allclose(graph.dist, graph.dist.T, rtol=0, atol=DISTANCE_EPSILON, equal_nan=True):
+        return "distance matrix is not symmetric"
+    n = len(graph.node_ids)
+    for source, target in zip(*np.nonzero(finite)):
+        predecessor = int(graph.pred[source, target])
+        if source == target:
+            continue
+        weight = graph.adjacency[predecessor].get(int(target)) if predecessor != NO_PREDECESSOR else None
+        if weight is None or abs(graph.dist[source, predecessor] + weight - graph.dist[source, target]) > 1e-6:
+            return f"predecessor of {target} from {source} is {predecessor}, not on a shortest path"
+    unreachable = ~finite & ~np.eye(n, dtype=bool)
+    if (graph.pred[unreachable] != NO_PREDECESSOR).any():
+        return "unreachable nodes have a predecessor"
+    return None
+
+
+def run_seed(num_nodes: int, operations: int, seed: int) -> Tuple[int, Optional[str]]:
+    """Apply random changes to one graph, checking it after each; returns the changes applied and the first error.
+    The edges a caller set with add_edge and remove_edge are tracked on the side: removing every obstacle at the end
+    must restore exactly those."""
+    rng = random.Random(seed)
+    graph = RoutingGraph.from_layout(random_layout(num_nodes, rng)).build()
+    expected = current_edges(graph)
+    obstacles: List[Rectangle] = []
+    for step in range(operations):
+        operation = rng.choice(OPERATIONS)
+        u, v = sorted(rng.sample(range(num_nodes), 2))
+        if operation == REMOVE_EDGE and expected:
+            u, v = rng.choice(list(expected))  # Blocked edges included
+            graph.remove_edge(graph.node_ids[u], graph.node_ids[v])
+            del expected[(u, v)]
+        elif operation == REWEIGHT_EDGE and expected:
+            u, v = rng.choice(list(expected))
+            weight = float(rng.randint(1, 2 * PLANE_SIZE))
+            graph.add_edge(graph.node_ids[u], graph.node_ids[v], weight)
+            expected[(u, v)] = weight
+        elif operation == ADD_OBSTACLE and len(obstacles) < MAX_OBSTACLES:
+            x, y = rng.randrange(PLANE_SIZE), rng.randrange(PLANE_SIZE)
+            obstacle = Rectangle(x, y, rng.randint(1, PLANE_SIZE // 4), rng.randint(1, PLANE_SIZE // 4))
+            graph.add_obstacle(obstacle)
+            obstacles.append(obstacle)
+        elif operation == REMOVE_OBSTACLE and obstacles:
+            graph.remove_obstacle(obstacles.pop(rng.randrange(len(obstacles))))
+        else:
+            graph.add_edge(graph.node_ids[u], graph.node_ids[v])
+            expected[(u, v)] = float(np.abs(graph.positions[u] - graph.positions[v]).sum())
+        error = compare(graph, rebuild(graph))
+        if error is not None:
+            return step + 1, f"after {operation} {u}-{v}: {error}"
+    for obstacle in obstacles:
+        graph.remove_obstacle(obstacle)
+    if current_edges(graph) != expected:
+        return operations, "removing the obstacles did not restore the edges set by add_edge and remove_edge"
+    return operations, compare(graph, rebuild(graph))
+
+
+def main_cli(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Check incremental routing repairs against full rebuilds.')
+    parser.add_argument('--nodes', type=int, nargs='+', default=list(DEFAULT_NODE_COUNTS), help='Graph sizes')
+    parser.add_argument('--operations', type=int, default=DEFAULT_OPERATIONS, help='Random changes per graph')
+    parser.add_argument('--seeds', type=int, default=DEFAULT_SEEDS, help='Random graphs per size')
+    parser.add_argument('--seed', type=int, default=0, help='First seed')
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for num_nodes, seed in itertools.product(args.nodes, range(args.seed, args.seed + args.seeds)):
+        applied, error = run_seed(num_nodes, args.operations, seed)
+        status = 'ok' if error is None else f"FAILED {error}"
+        print(f"nodes={num_nodes:<5} seed={seed:<4} changes={applied:<5} {status}")
+        failures += error is not None
+    print(f"\n{failures} of {len(args.nodes) * args.seeds} graphs failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,77 @@
+import math
+import os
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+from src.file_utils import PDF_EXTENSION
+from src.geometry import Rectangle
+from src.rectangle_detection import AREA_FACTOR
+
+DEFAULT_PAGE_SIZE = (11.69, 8.27)  # Inches, A4 landscape
+DEFAULT_DPI = 150
+DEFAULT_SHELVES = 20
+DEFAULT_AISLE_RATIO = 4.0  # Aisles must be long enough for the line generator to connect shelves across them
+DEFAULT_NOISE = 0.001
+DEFAULT_GRAIN = 0.0  # Even a few levels of per-pixel grain defeat the adaptive threshold on blank paper
+# Shelves are sized relative to the page like the detector expects them, inside its (1, 4) x min area window
+SHELF_AREA_FACTOR = 2.0
+SHELF_ASPECT_RATIO = 1.5
+PAGE_MARGIN_RATIO = 0.05
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+
+
+def generate_floor_plan(page_size=DEFAULT_PAGE_SIZE, dpi=DEFAULT_DPI, shelves=DEFAULT_SHELVES,
+                        aisle_ratio=DEFAULT_AISLE_RATIO, noise=DEFAULT_NOISE, grain=DEFAULT_GRAIN,
+                        seed=0) -> Tuple[np.ndarray, List[Rectangle]]:
+    """Render a synthetic warehouse floor plan and return it as a BGR image with its ground-truth shelves.
+
+    Shelves are outlined rectangles on a grid separated by aisles `aisle_ratio` times the shelf size wide, inside an
+    outer wall. `noise` is the fraction of pixels turned into dark or light specks, like dust on a scan, and `grain`
+    the standard deviation of Gaussian sensor noise in intensity levels. The same arguments always produce the same
+    image."""
+    width, height = round(page_size[0] * dpi), round(page_size[1] * dpi)
+    shelf_area = SHELF_AREA_FACTOR * width * height / AREA_FACTOR
+    shelf_h = max(4, round(math.sqrt(shelf_area / SHELF_ASPECT_RATIO)))
+    shelf_w = max(4, round(shelf_h * SHELF_ASPECT_RATIO))
+    gap_x, gap_y = max(2, round(shelf_w * aisle_ratio)), max(2, round(shelf_h * aisle_ratio))
+    margin = round(min(width, height) * PAGE_MARGIN_RATIO)
+    num_cols = (width - 2 * margin + gap_x) // (shelf_w + gap_x)
+    num_rows = (height - 2 * margin + gap_y) // (shelf_h + gap_y)
+    if shelves > num_cols * num_rows:
+        raise ValueError(f"At most {num_cols * num_rows} shelves fit on this page with aisle ratio {aisle_ratio}")
+
+    image = np.full((height, width, 3), WHITE, dtype=np.uint8)
+    thickness = max(1, round(dpi / 75))
+    cv2.rectangle(image, (margin // 2, margin // 2), (width - margin // 2, height - margin // 2), BLACK,
+                  thickness * 3)
+    rects = []
+    for i in range(shelves):
+        row, col = divmod(i, num_cols)
+        x, y = margin + col * (shelf_w + gap_x), margin + row * (shelf_h + gap_y)
+        cv2.rectangle(image, (x, y), (x + shelf_w, y + shelf_h), BLACK, thickness)
+        rect = Rectangle(x, y, shelf_w, shelf_h)
+        rect.id = i
+        rects.append(rect)
+
+    rng = np.random.default_rng(seed)
+    if grain > 0:
+        image = np.clip(image + rng.normal(0, grain, size=(height, width, 1)), 0, 255).astype(np.uint8)
+    if noise > 0:
+        specks = rng.random((height, width)) < noise
+        image[specks] = rng.choice([0, 255], size=(int(specks.sum()), 1)).astype(np.uint8)
+    return image, rects
+
+
+def save_floor_plan(image: np.ndarray, target_file_name: str, dpi=DEFAULT_DPI):
+    """Save a generated plan as PNG (or any OpenCV format), or as a single-page PDF at the given DPI."""
+    os.makedirs(os.path.dirname(target_file_name) or '.', exist_ok=True)
+    if not target_file_name.lower().endswith(PDF_EXTENSION):
+        if not cv2.imwrite(target_file_name, image):
+            raise RuntimeError(f"Failed to write {target_file_name}")
+        return
+    from PIL import Image  # Installed with pdf2image, only PDF inputs need it
+
+    Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)).save(target_file_name, format='PDF', resolution=dpi)
@@ -1,47 +1,180 @@
 import argparse
-import concurrent.futures
-from typing import Tuple, List
+import contextlib
+import functools
+import os
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
 import cv2.typing
 
+from src.batch_manifest import BatchManifest
 from src.config_generator import generate_configs
-from src.file_utils import load_images, save_result_images, save_result_shapes
-from src.image_pipeline import process_image
-from src.utils import create_clean_output_directory, TextColor
-
-
-def process_images(images_with_names: List[Tuple[cv2.typing.MatLike, str]], output_dir: str, max_images: int):
-    """Process a list of images, generate configurations, and save results."""
-    configs = generate_configs()
-
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        futures = [executor.submit(process_image, img_with_name, configs) for img_with_name in images_with_names]
+from src.config_profiles import PROFILE_FILE, ProfileStore, source_signature
+from src.file_utils import DEFAULT_OUTPUT_FILE, DEFAULT_PDF_PAGES, iter_images, parse_pages, save_result_images, \
+    save_result_layout, save_result_shapes
+from src.image_pipeline import PIPELINE_VERSION, ProcessedImage, is_partial, iter_processed_images
+from src.instrumentation import TRACE_FILE, Recorder, export_chrome_trace, recording, summarize
+from src.rendering import NATIVE_RENDERER, RENDERERS
+from src.scheduler import BACKENDS, PROCESS_BACKEND, TaskScheduler
+from src.shared_images import resolve_image
+from src.utils import create_clean_output_directory, Icon, TextColor
+
+
+def process_images(images_with_names: Iterable[Tuple[cv2.typing.MatLike, str]], output_dir: str, max_images: int,
+                   max_pending: Optional[int] = None, backend=PROCESS_BACKEND, renderer=NATIVE_RENDERER,
+                   trace=False, time_budget: Optional[float] = None, manifest: Optional[BatchManifest] = None,
+                   clean=False, profiles: Optional[ProfileStore] = None):
+    """Process a stream of images, generate configurations, and save each result as soon as it completes.
+    With `trace`, per-stage timings are written as a Chrome trace and summarized at the end.
+    With `time_budget` in seconds, images still processing when it runs out keep the best result so far.
+    Outputs of earlier runs are kept, and complete results are recorded in the manifest when one is given;
+    `clean` empties the output folders first. The overview image covers only the images processed by this run.
+    With `profiles`, each image gets the configs that worked best for its source, and its best config is learned."""
+    if profiles is not None:
+        configs = _ProfiledConfigs(profiles)
+        images_with_names = configs.select(images_with_names)
+    else:
+        configs = generate_configs()
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+
+    for folder in ('images', 'shapes', 'layouts'):
+        if clean:
+            create_clean_output_directory(f'{output_dir}/{folder}')
+        else:
+            os.makedirs(f'{output_dir}/{folder}', exist_ok=True)
+
+    recorder = Recorder()
+    with recording(recorder) if trace else contextlib.nullcontext():
+        num_processed, num_partial = _process_and_save(images_with_names, output_dir, max_images, configs,
+                                                       max_pending, backend, renderer, recorder, deadline, manifest)
+
+    if trace:
+        trace_file = f'{output_dir}/{TRACE_FILE}'
+        export_chrome_trace(recorder.records, trace_file)
+        print(f"\n{summarize(recorder.records)}\n\nTrace written to {TextColor.CYAN}{trace_file}{TextColor.RESET}")
+    partial_label = f", {num_partial} partial after the time budget" if num_partial else ''
+    skipped_label = f", {manifest.skipped} unchanged inputs skipped" if manifest and manifest.skipped else ''
+    print(f"\n{TextColor.GREEN}All tasks are completed!{TextColor.RESET} "
+          f"({num_processed}/{num_processed}{partial_label}{skipped_label})")
 
-    create_clean_output_directory(f'{output_dir}/images')
-    create_clean_output_directory(f'{output_dir}/shapes')
 
+def _process_and_save(images_with_names: Iterable[Tuple[cv2.typing.MatLike, str]], output_dir: str, max_images: int,
+                      configs: Union[List[dict], '_ProfiledConfigs'], max_pending: Optional[int], backend: str,
+                      renderer: str, recorder: Recorder, deadline: Optional[float] = None,
+                      manifest: Optional[BatchManifest] = None) -> Tuple[int, int]:
     best_responses = []
-    for future in concurrent.futures.as_completed(futures):
-        filename, results = future.result()
-        save_result_shapes(results[0].rects + results[0].lines + results[0].nodes,
-                           target_file_name=f'{output_dir}/shapes/{filename}')
-        save_result_images(results, max_images=max_images, target_file_name=f'{output_dir}/images/{filename}')
-        best_responses.append(results[0])
-    if len(best_responses) <= 1:
-        return
+    num_partial = 0
+    # One pool runs every (image, config) task; at most `max_pending` images are decoded and in flight at once
+    scheduler = TaskScheduler(max_pending_images=max_pending, backend=backend)
+    failed = configs.forget if isinstance(configs, _ProfiledConfigs) else None
+    for filename, results in iter_processed_images(images_with_names, configs, scheduler=scheduler,
+                                                   deadline=deadline, failed=failed):
+        for result in results:
+            recorder.extend(result.records)
+        image_configs = configs(filename) if callable(configs) else configs
+        partial = is_partial(results, image_configs)
+        if partial:
+            num_partial += 1
+            print(f"{Icon.DONE} [Process] Partial result for {TextColor.YELLOW}{filename}{TextColor.RESET}, "
+                  f"{len(results)}/{len(image_configs)} configs finished within the time budget")
+        outputs = [
+            save_result_shapes(results[0].rects + results[0].lines + results[0].nodes,
+                               target_file_name=f'{output_dir}/shapes/{filename}'),
+            save_result_layout(results[0].rects, results[0].lines, results[0].nodes,
+                               target_file_name=f'{output_dir}/layouts/{filename}'),
+            save_result_images(results, max_images=max_images, target_file_name=f'{output_dir}/images/{filename}',
+                               renderer=renderer),
+        ]
+        # Partial results are redone by the next run, only complete ones are recorded as current or learned from
+        if manifest is not None and not partial:
+            details = configs.details(filename) if isinstance(configs, _ProfiledConfigs) else {}
+            manifest.record(filename, outputs, **details)
+        if isinstance(configs, _ProfiledConfigs):
+            configs.learn(filename, results, partial)
+        for result in results[1:]:
+            result.release()
+        best_responses.append(results[0])  # Keeps its payload for the overall preview
+
+    num_processed = len(best_responses)
+    overview_file = f'{output_dir}/images/{DEFAULT_OUTPUT_FILE}'
+    if num_processed > 1:
         # Sort overall best results based on the number of rectangles detected
-    best_responses.sort(key=lambda x: x.num_rects, reverse=True)
-    save_result_images(best_responses, max_images=len(best_responses),
-                       target_file_name=f'{output_dir}/images/output.png')
-
-    print(f"\n{TextColor.GREEN}All tasks are completed!{TextColor.RESET} "
-          f"({len(images_with_names)}/{len(images_with_names)})")
-
-
-def process_from_directory(input_dir: str, output_dir: str, max_images: int):
-    """Process images from a directory."""
-    images_with_names = load_images(input_dir)
-    process_images(images_with_names, output_dir, max_images)
+        best_responses.sort(key=lambda x: x.num_rects, reverse=True)
+        save_result_images(best_responses, max_images=len(best_responses), target_file_name=overview_file,
+                           renderer=renderer)
+        print(f"{Icon.DONE} [Save] Overview of the {num_processed} images processed by this run written to "
+              f"{TextColor.CYAN}{overview_file}{TextColor.RESET}")
+    elif os.path.exists(overview_file):
+        # Left by an earlier run, it would pass for an overview of this one
+        os.remove(overview_file)
+    for result in best_responses:
+        result.release()
+    return num_processed, num_partial
+
+
+class _ProfiledConfigs:
+    def __init__(self, profiles: ProfileStore):
+        """Initialize the per-image choice of configs from the profile store, see generate_configs."""
+        self.profiles = profiles
+        self.selected: Dict[str, Tuple[dict, List[dict]]] = {}  # Image name -> source signature, configs
+
+    def __call__(self, filename: str) -> List[dict]:
+        return self.selected[filename][1]
+
+    def select(self, images_with_names: Iterable[Tuple[cv2.typing.MatLike, str]]
+               ) -> Iterator[Tuple[cv2.typing.MatLike, str]]:
+        """Pick the configs of every image as it is taken from the input."""
+        for image, filename in images_with_names:
+            signature = source_signature(resolve_image(image))
+            configs = generate_configs(signature=signature, profiles=self.profiles)
+            source = 'a known source, trying' if self.profiles.match(signature) else 'an unknown source, sweeping'
+            print(f"{Icon.DETECT} [Profiles] {TextColor.YELLOW}{filename}{TextColor.RESET} is from {source} "
+                  f"{len(configs)} configs")
+            self.selected[filename] = signature, configs
+            yield image, filename
+
+    def details(self, filename: str) -> dict:
+        """Return what the outputs of an image depend on besides its content, for the batch manifest."""
+        signature, configs = self.selected[filename]
+        return {'signature': signature, 'steps': [config['steps'] for config in configs]}
+
+    def forget(self, filename: str):
+        """Drop the choice for an image whose processing failed, it never reaches learn."""
+        self.selected.pop(filename, None)
+
+    def learn(self, filename: str, results: List[ProcessedImage], partial: bool):
+        """Record the config of the best result as a win for the image's source, unless the sweep was cut short."""
+        signature, _ = self.selected.pop(filename)
+        if not partial:
+            self.profiles.record(signature, results[0].steps)
+
+
+def process_from_directory(input_dir: str, output_dir: str, max_images: int,
+                           pages: Optional[Sequence[int]] = DEFAULT_PDF_PAGES, backend=PROCESS_BACKEND,
+                           renderer=NATIVE_RENDERER, trace=False, time_budget: Optional[float] = None,
+                           clean=False, profile_file: Optional[str] = None, num_files: Optional[int] = None):
+    """Process images from a directory, skipping inputs whose outputs from an earlier run are still current.
+    With a `profile_file`, configs are picked per input from the profiles of its source and learned from its results.
+    `num_files` limits the files loaded, skipped ones not counted, so every run moves on through the folder."""
+    profiles = None if profile_file is None else ProfileStore(profile_file)
+    # Profiled runs pick other configs, their outputs are not current for plain runs and the other way around
+    profiled = {} if profiles is None else {
+        'profiles': True, 'still_current': functools.partial(_profiled_outputs_current, profiles)}
+    manifest = BatchManifest(output_dir, generate_configs(), PIPELINE_VERSION, max_images=max_images,
+                             renderer=renderer, **profiled)
+    # Inputs are checked lazily, once `clean` has emptied the output folders, so it forces every input to be redone
+    images_with_names = iter_images(input_dir, num_files, pages=pages, skip=manifest.is_current)
+    process_images(images_with_names, output_dir, max_images, backend=backend, renderer=renderer, trace=trace,
+                   time_budget=time_budget, manifest=manifest, clean=clean, profiles=profiles)
+
+
+def _profiled_outputs_current(profiles: ProfileStore, entry: dict) -> bool:
+    """Tell whether a profiled input already ran every config its profile picks now; what the store learned since
+    may have ranked a config it never tried."""
+    if 'signature' not in entry:
+        return False
+    steps = entry.get('steps', [])
+    return all(config['steps'] in steps for config in generate_configs(signature=entry['signature'], profiles=profiles))
 
 
 def process_from_file(file_path: str, output_dir: str):
@@ -60,6 +193,23 @@ if __name__ == '__main__':
                         help='Maximum number of images to process')
     parser.add_argument('-f', '--file_path', type=str, default=None,
                         help='Path to the input image file')
+    parser.add_argument('-p', '--pages', type=parse_pages, default=list(DEFAULT_PDF_PAGES),
+                        help="PDF pages to process, e.g. '1', '1-3,5' or 'all'")
+    parser.add_argument('-b', '--backend', type=str, default=PROCESS_BACKEND, choices=BACKENDS,
+                        help='Execution backend for the image processing tasks')
+    parser.add_argument('-r', '--renderer', type=str, default=NATIVE_RENDERER, choices=RENDERERS,
+                        help='Renderer for the result preview images')
+    parser.add_argument('-t', '--trace', action='store_true',
+                        help='Record per-stage timings, write a Chrome trace and print a summary')
+    parser.add_argument('-c', '--clean', action='store_true',
+                        help='Empty the output folders and reprocess every input instead of resuming')
+    parser.add_argument('-d', '--time_budget', type=float, default=None,
+                        help='Seconds for the whole run; images still processing then keep their best result so far')
+    parser.add_argument('-n', '--num_files', type=int, default=None,
+                        help='Maximum number of input files to load, not counting unchanged ones skipped (default all)')
+    parser.add_argument('-l', '--profiles', type=str, nargs='?', const=PROFILE_FILE, default=None,
+                        help='Pick configs per input from the learned profiles of its source in this store, sweeping '
+                             f'every config for unknown sources and learning from the results (default {PROFILE_FILE})')
 
     args = parser.parse_args()
 
@@ -69,7 +219,9 @@ if __name__ == '__main__':
     if args.file_path:
         process_from_file(args.file_path, args.output_dir)
     elif args.input_dir:
-        process_from_directory(args.input_dir, args.output_dir, args.max_images)
+        process_from_directory(args.input_dir, args.output_dir, args.max_images, args.pages, args.backend,
+                               args.renderer, args.trace, args.time_budget, args.clean, args.profiles,
+                               args.num_files)
     else:
         # Default behavior if no arguments are provided
         print("No input provided. Running with default parameters.")
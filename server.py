@@ -1,93 +1,332 @@
+import io
+import math
 import os
-import shutil
-import uuid
+import time
+from typing import List, Optional, Tuple
 
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask, request, jsonify, send_from_directory, url_for
+from flask import Flask, Response, g, request, jsonify, send_from_directory, url_for
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 
+from src.admission import AdmissionController, OverloadedError, RequestTooLargeError, estimate_request_cost
 from src.config_generator import generate_configs
-from src.file_utils import load_images, save_result_images, save_result_shapes
-from src.image_pipeline import process_image
-from src.utils import create_clean_output_directory
+from src.file_utils import decode_image, encode_result_images, encode_result_layout, format_result_shapes, \
+    probe_image_size
+from src.image_pipeline import PIPELINE_VERSION, is_partial, process_image
+from src.graph_cache import GraphCache
+from src.incremental import FULL_REPROCESS_SHARE, changed_tiles, tile_fingerprints, update_layout
+from src.instrumentation import Recorder, recording, stage
+from src.jobs import JOB_DONE, JOB_FAILED, Job, JobQueue, QueueFullError
+from src.layout_io import LAYOUT_EXTENSION, Layout
+from src.metrics import CONTENT_TYPE, REGISTRY, Counter, Gauge, Histogram
+from src.result_cache import ResultCache
+from src.routing import ROUTING_EXTENSION, RoutingGraph
+from src.scheduler import HYBRID_BACKEND, TaskScheduler
 
 app = Flask(__name__)
 
-UPLOAD_FOLDER = 'uploads'
 PROCESSED_FOLDER = 'processed'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
+# Small uploads run in threads, only heavy configs pay for process spawn and pickling
+PROCESSING_BACKEND = HYBRID_BACKEND
+JOB_WORKERS = 2  # Jobs share the machine, each one already parallelizes over its configs
+MAX_QUEUED_JOBS = 64
+JOB_RETENTION_SECONDS = 24 * 60 * 60
+CACHE_MAX_BYTES = 5 * 1024 ** 3
+CACHE_MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+GRAPH_CACHE_MAX_BYTES = 1024 ** 3  # Distance matrices of recently queried layouts kept in memory
+RESULT_URL_SUFFIX = '_url'  # Result entries naming files, answered as download URLs
+UPLOAD_SIZE_BUCKETS = tuple(4 ** i * 16 * 1024 for i in range(8))  # 16 KB to 256 MB
+MAX_UPLOAD_BYTES = 64 * 1024 ** 2  # Larger bodies are refused while being read, before they reach a handler
+PROCESSING_MEMORY_BUDGET = 4 * 1024 ** 3  # Estimated peak memory of all running jobs together
+MAX_TIME_BUDGET_SECONDS = 600
+MAX_BACKLOG_SECONDS = 120  # Estimated processing time of queued and running jobs beyond which uploads are refused
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
 
-# Ensure upload and processed folders exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Ensure the processed folder exists, uploads are never written to disk
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 
 scheduler = BackgroundScheduler()
 
+# Metrics, collected in-process and served in the Prometheus text format by /metrics
+HTTP_REQUESTS = Counter('layroad_http_requests', 'HTTP requests by endpoint, method and status code',
+                        ['endpoint', 'method', 'status'])
+HTTP_LATENCY = Histogram('layroad_http_request_duration_seconds', 'HTTP request latency by endpoint', ['endpoint'])
+UPLOAD_BYTES = Histogram('layroad_upload_bytes', 'Size of uploaded files', buckets=UPLOAD_SIZE_BUCKETS)
+CACHE_LOOKUPS = Counter('layroad_result_cache_lookups', 'Result cache lookups of uploads by outcome', ['result'])
+JOBS_FINISHED = Counter('layroad_jobs_finished', 'Finished processing jobs by status', ['status'])
+STAGE_DURATION = Histogram('layroad_stage_duration_seconds', 'Wall time of pipeline stages', ['stage'])
+JOBS_IN_FLIGHT = Gauge('layroad_jobs_in_flight', 'Jobs queued or running')
+PIPELINE_WORKERS = Gauge('layroad_pipeline_workers', 'Size of the processing pool')
+PIPELINE_ACTIVE_TASKS = Gauge('layroad_pipeline_active_tasks', 'Config tasks submitted to the processing pool')
+PROCESSED_FOLDER_BYTES = Gauge('layroad_processed_folder_bytes', 'Disk usage of the result cache')
+GRAPH_CACHE_BYTES = Gauge('layroad_graph_cache_bytes', 'Memory held by cached routing graphs')
+UPLOADS_REJECTED = Counter('layroad_uploads_rejected', 'Uploads refused by admission control by reason', ['reason'])
+ADMITTED_MEMORY_BYTES = Gauge('layroad_admitted_memory_bytes', 'Estimated memory held by running jobs')
+BACKLOG_SECONDS = Gauge('layroad_backlog_seconds', 'Estimated processing time of queued and running jobs')
+
 
 def allowed_file(filename: str):
     """Check if the file is an allowed type."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def cleanup_directory(directory: str):
-    """Remove all files in the specified directory."""
-    for filename in os.listdir(directory):
-        file_path = os.path.join(directory, filename)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except Exception as e:
-            print(f'Failed to delete {file_path}. Reason: {e}')
-
-
 def start_cleanup_task():
-    """Start the background scheduler to periodically clean up directories."""
-    scheduler.add_job(func=lambda: cleanup_directory(UPLOAD_FOLDER), trigger="interval", hours=24)
-    scheduler.add_job(func=lambda: cleanup_directory(PROCESSED_FOLDER), trigger="interval", hours=24)
+    """Start the background scheduler to periodically evict cached results and forget old jobs."""
+    scheduler.add_job(func=result_cache.evict, trigger="interval", hours=1)
+    scheduler.add_job(func=lambda: job_queue.prune(JOB_RETENTION_SECONDS), trigger="interval", hours=1)
     scheduler.start()
 
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response: Response) -> Response:
+    """Count every request and observe its latency, labelled by route pattern rather than by URL."""
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if 'request_start' in g:
+        HTTP_LATENCY.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(_):
+    UPLOADS_REJECTED.inc(reason='upload_size')
+    return jsonify(error=f"Upload exceeds {MAX_UPLOAD_BYTES // 1024 ** 2} MB"), 413
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Endpoint to expose server metrics in the Prometheus text format."""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
 @app.route('/process', methods=['POST'])
 def process():
-    """Endpoint to handle file upload and processing."""
-    if 'file' not in request.files:
-        return jsonify(error="No file part"), 400
+    """Endpoint to handle file upload; processing runs as a background job unless the result is cached.
+    An optional `time_budget` in seconds bounds the job, which then returns the best result found in time."""
+    try:
+        time_budget = _parse_time_budget(request.values.get('time_budget'))
+        filename, data = _read_upload()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    # Results are addressed by content, identical uploads share one job and one cache entry
+    configs = generate_configs()
+    job_id = ResultCache.key(data, configs, PIPELINE_VERSION)
+    # A complete result answers every request; budgeted results may be partial, so they get entries of their own
+    cached = result_cache.get(job_id)
+    if cached is None and time_budget is not None:
+        job_id = f"{job_id}-{time_budget:g}s"
+        cached = result_cache.get(job_id)
+    CACHE_LOOKUPS.inc(result='miss' if cached is None else 'hit')
+    if cached is not None:
+        return jsonify(message="File already processed", **_status_response(job_id, JOB_DONE, cached)), 200
+
+    deadline = None if time_budget is None else time.monotonic() + time_budget  # Queueing counts too
+    return _submit_job(filename, data, job_id, configs, deadline=deadline)
 
+
+@app.route('/layouts/<layout_id>/revisions', methods=['POST'])
+def layout_revision(layout_id: str):
+    """Endpoint to handle the upload of a revised version of a processed layout's image.
+    Only the tiles that changed are reprocessed and merged into the layout, unchanged shapes keep their ids.
+    The revision becomes a layout of its own, with a job id to poll like any upload."""
+    try:
+        filename, data = _read_upload()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    layout = _load_layout(layout_id)
+    if layout is None:
+        return jsonify(error="Layout not found"), 404
+    if layout.fingerprints is None or layout.steps is None:
+        return jsonify(error="Layout has no tile fingerprints to compare against, upload the revision to "
+                             "/process instead"), 409
+
+    configs = [{'steps': layout.steps}]
+    job_id = ResultCache.key(data, configs, f"{PIPELINE_VERSION}+{layout_id}")
+    cached = result_cache.get(job_id)
+    CACHE_LOOKUPS.inc(result='miss' if cached is None else 'hit')
+    if cached is not None:
+        return jsonify(message="Revision already processed", **_status_response(job_id, JOB_DONE, cached)), 200
+    # Admitted at the cost of a full run, changed tiles are only known once the upload is decoded
+    return _submit_job(filename, data, job_id, configs, base_layout_id=layout_id)
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id: str):
+    """Endpoint to report the status of a job and, once done, the download URLs of its results."""
+    job = job_queue.get(job_id)
+    if job is not None:
+        return jsonify({**job.to_dict(), **_status_response(job.id, job.status, job.result)}), 200
+    cached = result_cache.get(job_id)
+    if cached is not None:
+        return jsonify(_status_response(job_id, JOB_DONE, cached)), 200
+    return jsonify(error="Job not found"), 404
+
+
+def _read_upload() -> Tuple[str, bytes]:
+    """Return the name and content of the uploaded file, raising ValueError when it is missing or not allowed."""
+    if 'file' not in request.files:
+        raise ValueError("No file part")
     file = request.files['file']
     if file.filename == '':
-        return jsonify(error="No selected file"), 400
+        raise ValueError("No selected file")
+    if not allowed_file(file.filename):
+        raise ValueError("File type not allowed")
+    data = file.read()
+    UPLOAD_BYTES.observe(len(data))
+    return secure_filename(file.filename), data
 
-    create_clean_output_directory(UPLOAD_FOLDER)
 
-    if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
+def _submit_job(filename: str, data: bytes, job_id: str, configs: List[dict], deadline: Optional[float] = None,
+                base_layout_id: Optional[str] = None):
+    """Admit an upload against the processing budget and queue its job."""
+    # Uploads are sized from their headers and admitted against the processing budget before being queued
+    try:
+        width, height = probe_image_size(data, filename)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    cost = estimate_request_cost(width, height, configs)
+    try:
+        admission.admit(cost)
+    except RequestTooLargeError as e:
+        UPLOADS_REJECTED.inc(reason='too_large')
+        return jsonify(error=str(e)), 413
+    except OverloadedError as e:
+        UPLOADS_REJECTED.inc(reason='overloaded')
+        return _retry_later(str(e), e.retry_after)
 
-        # Generate a unique identifier for this request
-        unique_id = str(uuid.uuid4())
-        processed_folder = os.path.join(app.config['PROCESSED_FOLDER'], unique_id)
-        os.makedirs(processed_folder, exist_ok=True)
+    job = Job(filename, data, output_dir=result_cache.entry_dir(job_id), job_id=job_id, cost=cost,
+              deadline=deadline, base_layout_id=base_layout_id)
+    try:
+        # Returns the in-progress job instead when the identical upload is already running
+        submitted = job_queue.submit(job)
+    except QueueFullError as e:
+        admission.cancel(cost)
+        UPLOADS_REJECTED.inc(reason='queue_full')
+        return _retry_later(str(e), math.ceil(admission.backlog_seconds()))
+    if submitted is not job:
+        admission.cancel(cost)
+    return jsonify(
+        message="File accepted for processing",
+        job_id=submitted.id,
+        status_url=url_for('job_status', job_id=submitted.id, _external=True)
+    ), 202
 
-        # Process the file
-        try:
-            create_clean_output_directory(processed_folder)
-            image_url, shapes_url = _do_process(processed_folder, unique_id)
-            return jsonify(
-                message="File processed successfully",
-                image_url=image_url,
-                shapes_url=shapes_url
-            ), 200
-        except Exception as e:
-            shutil.rmtree(processed_folder)
-            return jsonify(error=str(e)), 500
 
-    return jsonify(error="File type not allowed"), 400
+def _parse_time_budget(value: Optional[str]) -> Optional[float]:
+    if value is None or value == '':
+        return None
+    try:
+        time_budget = float(value)
+    except ValueError:
+        time_budget = math.nan
+    if not 0 < time_budget <= MAX_TIME_BUDGET_SECONDS:
+        raise ValueError(f"time_budget must be a number of seconds between 0 and {MAX_TIME_BUDGET_SECONDS}")
+    return time_budget
+
+
+def _retry_later(error: str, retry_after: int) -> Response:
+    response = jsonify(error=error)
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, retry_after))
+    return response
+
+
+def _status_response(job_id: str, status: str, result: dict) -> dict:
+    response = {'job_id': job_id, 'status': status}
+    for name, value in result.items():
+        if name.endswith(RESULT_URL_SUFFIX):
+            value = url_for('download', unique_id=job_id, filename=value, _external=True)
+        response[name] = value
+    return response
+
+
+@app.route('/layouts/<layout_id>/distance', methods=['GET'])
+def layout_distance(layout_id: str):
+    """Endpoint to return the shortest distance and path between two rectangles of a processed layout."""
+    try:
+        from_id, to_id = int(request.args['from']), int(request.args['to'])
+    except (KeyError, ValueError):
+        return jsonify(error="Query parameters 'from' and 'to' must be rectangle ids"), 400
+    graph = graph_cache.get(layout_id, lambda: _load_routing_graph(layout_id))
+    if graph is None:
+        return jsonify(error="Layout not found"), 404
+    try:
+        from_node, to_node = graph.terminal_node(from_id), graph.terminal_node(to_id)
+    except KeyError as e:
+        return jsonify(error=e.args[0]), 404
+    path = graph.path(from_node, to_node)
+    if not path:
+        return jsonify(error=f"No path between rectangles {from_id} and {to_id}"), 422
+    return jsonify(layout_id=layout_id, distance=graph.distance(from_node, to_node),
+                   path=_path_points(graph, path)), 200
+
+
+@app.route('/layouts/<layout_id>/route', methods=['POST'])
+def layout_route(layout_id: str):
+    """Endpoint to plan the shortest tour over a pick list of rectangles of a processed layout.
+    The tour starts and ends at the first rectangle of the list."""
+    body = request.get_json(silent=True)
+    stops = body.get('stops') if isinstance(body, dict) else None
+    if not isinstance(stops, list) or not stops or not all(type(stop) is int for stop in stops):
+        return jsonify(error="Body must be a JSON object with a non-empty 'stops' list of rectangle ids"), 400
+    graph = graph_cache.get(layout_id, lambda: _load_routing_graph(layout_id))
+    if graph is None:
+        return jsonify(error="Layout not found"), 404
+    try:
+        order, distance, path = graph.route(stops)
+    except KeyError as e:
+        return jsonify(error=e.args[0]), 404
+    if not path:
+        return jsonify(error="Some rectangles of the pick list cannot be reached from each other"), 422
+    return jsonify(layout_id=layout_id, order=order, distance=distance, path=_path_points(graph, path)), 200
+
+
+def _load_routing_graph(layout_id: str) -> Optional[RoutingGraph]:
+    """Load the routing graph of a cached layout with the tables stored by its job, or return None when the layout
+    is unknown. Entries stored without tables are built on the spot."""
+    result = result_cache.get(layout_id)
+    if result is None or 'layout_url' not in result:
+        return None
+    entry_dir = result_cache.entry_dir(layout_id)
+    graph = RoutingGraph.from_layout(Layout.load(os.path.join(entry_dir, result['layout_url'])))
+    try:
+        return graph.load_tables(os.path.join(entry_dir, _routing_filename(result['layout_url'])))
+    except (OSError, ValueError):
+        return graph.build()
+
+
+def _encode_routing_tables(rects: list, lines: list, nodes: list) -> Tuple[bytes, RoutingGraph]:
+    """Build the routing graph of a finished layout, so no query has to wait for its all-pairs matrices."""
+    with stage('routing'):
+        graph = RoutingGraph.from_layout(Layout.from_shapes(rects, lines, nodes)).build()
+        buffer = io.BytesIO()
+        graph.save_tables(buffer)
+    return buffer.getvalue(), graph
+
+
+def _routing_filename(layout_filename: str) -> str:
+    return f"{layout_filename[:-len(LAYOUT_EXTENSION)]}{ROUTING_EXTENSION}"
+
+
+def _load_layout(layout_id: str) -> Optional[Layout]:
+    result = result_cache.get(layout_id)
+    if result is None or 'layout_url' not in result:
+        return None
+    return Layout.load(os.path.join(result_cache.entry_dir(layout_id), result['layout_url']))
+
+
+def _path_points(graph: RoutingGraph, node_ids: List[int]) -> List[List[int]]:
+    return graph.positions[[graph.index[node_id] for node_id in node_ids]].tolist()
 
 
 @app.route('/processed/<unique_id>/<filename>', methods=['GET'])
@@ -97,35 +336,130 @@ def download(unique_id: str, filename: str):
     return send_from_directory(directory=folder_path, path=filename)
 
 
-def _do_process(processed_folder: str, unique_id: str):
-    images_with_names = load_images(app.config['UPLOAD_FOLDER'], num_files=1)
-    configs = generate_configs()
+def _do_process(job: Job) -> dict:
+    """Process the in-memory upload of a job, publish its results in the cache and return their file names.
+    Stage timings of the job and of its config tasks feed the stage duration histogram."""
+    with recording(Recorder(image=job.filename)) as recorder:
+        try:
+            with admission.running(job.cost):  # Waits until the budget has room for the job's memory
+                if job.base_layout_id is None:
+                    result = _process_upload(job, recorder)
+                else:
+                    result = _process_revision(job)
+        except Exception:
+            JOBS_FINISHED.inc(status=JOB_FAILED)
+            raise
+        finally:
+            for record in recorder.records:
+                STAGE_DURATION.observe(record.wall, stage=record.name)
+    JOBS_FINISHED.inc(status=JOB_DONE)
+    return result
 
-    if len(images_with_names) != 1:
-        raise Exception("Image not loaded")
 
-    filename, results = process_image(images_with_names[0], configs)
+def _process_upload(job: Job, recorder: Recorder) -> dict:
+    data, job.data = job.data, None
+    image_with_name = decode_image(data, job.filename)
+    del data
+    configs = generate_configs()
+    # Fingerprinted for revisions of the image, see _process_revision
+    fingerprints = tile_fingerprints(image_with_name[0])
+
+    filename, results = process_image(image_with_name, configs, scheduler=pipeline_scheduler, deadline=job.deadline)
+    del image_with_name
+    for result in results:
+        recorder.extend(result.records)
     json_filename = f"{filename}.json"
     png_filename = f"{filename}.png"
-    save_result_shapes(results[0].rects + results[0].lines + results[0].nodes,
-                       target_file_name=os.path.join(processed_folder, json_filename))
-    save_result_images(results, max_images=len(results),
-                       target_file_name=os.path.join(processed_folder, png_filename))
-    # Construct the download URL
-    image_url = url_for('download', unique_id=unique_id, filename=png_filename, _external=True)
-    shapes_url = url_for('download', unique_id=unique_id, filename=json_filename, _external=True)
-    return image_url, shapes_url
-
-
-@app.teardown_appcontext
-def shutdown(exception=None):
-    """Shutdown the scheduler."""
+    layout_filename = f"{filename}{LAYOUT_EXTENSION}"
+    # Outputs are encoded in memory and written once, straight into the cache entry
+    files = {
+        json_filename: format_result_shapes(results[0].rects + results[0].lines + results[0].nodes).encode(),
+        layout_filename: encode_result_layout(results[0].rects, results[0].lines, results[0].nodes, fingerprints,
+                                              results[0].steps),
+    }
+    files[_routing_filename(layout_filename)], graph = _encode_routing_tables(results[0].rects, results[0].lines,
+                                                                              results[0].nodes)
+    with stage('render'):
+        files[png_filename] = encode_result_images(results, max_images=len(results))
+    for result in results:
+        result.release()
+    result = {'image_url': png_filename, 'shapes_url': json_filename, 'layout_url': layout_filename,
+              'partial': is_partial(results, configs)}
+    with stage('save'):
+        result_cache.store(job.id, files, result)
+    graph_cache.put(job.id, graph)
+    return result
+
+
+def _process_revision(job: Job) -> dict:
+    """Reprocess the tiles of a revised upload that changed since its base layout and publish the merged layout.
+    Revisions differing in most tiles, or in size, are processed in full with the base layout's config."""
+    data, job.data = job.data, None
+    image, filename = decode_image(data, job.filename)
+    del data
+    base = _load_layout(job.base_layout_id)
+    if base is None:
+        raise ValueError(f"Layout {job.base_layout_id} expired before its revision was processed")
+    fingerprints = tile_fingerprints(image)
+    try:
+        changed = changed_tiles(base.fingerprints, fingerprints)
+    except ValueError:
+        changed = None
+    if changed is not None and changed.mean() <= FULL_REPROCESS_SHARE:
+        with stage('incremental'):
+            rects, lines, nodes = update_layout(base, image, changed)
+        changed_count = int(changed.sum())
+    else:
+        _, results = process_image((image, filename), [{'steps': base.steps}], scheduler=pipeline_scheduler)
+        rects, lines, nodes = results[0].rects, results[0].lines, results[0].nodes
+        for result in results:
+            result.release()
+        changed_count = fingerprints.shape[0] * fingerprints.shape[1]
+    del image
+
+    json_filename = f"{filename}.json"
+    layout_filename = f"{filename}{LAYOUT_EXTENSION}"
+    files = {
+        json_filename: format_result_shapes(rects + lines + nodes).encode(),
+        layout_filename: encode_result_layout(rects, lines, nodes, fingerprints, base.steps),
+    }
+    files[_routing_filename(layout_filename)], graph = _encode_routing_tables(rects, lines, nodes)
+    result = {'shapes_url': json_filename, 'layout_url': layout_filename, 'partial': False,
+              'base_layout_id': job.base_layout_id, 'changed_tiles': changed_count,
+              'tiles': fingerprints.shape[0] * fingerprints.shape[1]}
+    with stage('save'):
+        result_cache.store(job.id, files, result)
+    graph_cache.put(job.id, graph)
+    return result
+
+
+result_cache = ResultCache(PROCESSED_FOLDER, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE_SECONDS)
+graph_cache = GraphCache(max_bytes=GRAPH_CACHE_MAX_BYTES)
+admission = AdmissionController(PROCESSING_MEMORY_BUDGET, MAX_BACKLOG_SECONDS, workers=JOB_WORKERS)
+job_queue = JobQueue(_do_process, max_workers=JOB_WORKERS, max_queued=MAX_QUEUED_JOBS)
+# One pool for the lifetime of the server, shared by all jobs, so requests never wait for workers to start
+pipeline_scheduler = TaskScheduler(backend=PROCESSING_BACKEND, persistent=True)
+
+JOBS_IN_FLIGHT.set_function(lambda: len(job_queue.active_jobs()))
+PIPELINE_WORKERS.set_function(lambda: pipeline_scheduler.max_workers)
+PIPELINE_ACTIVE_TASKS.set_function(lambda: pipeline_scheduler.active_tasks)
+PROCESSED_FOLDER_BYTES.set_function(result_cache.disk_usage)
+GRAPH_CACHE_BYTES.set_function(lambda: graph_cache.nbytes)
+ADMITTED_MEMORY_BYTES.set_function(lambda: admission.memory_in_use)
+BACKLOG_SECONDS.set_function(admission.backlog_seconds)
+
+
+def shutdown():
+    """Shutdown the scheduler, the job workers and the processing pool."""
     if scheduler.running:
         scheduler.shutdown()
+    job_queue.shutdown()
+    pipeline_scheduler.shutdown()
 
 
 if __name__ == '__main__':
     start_cleanup_task()
+    pipeline_scheduler.warm_up()
     try:
         app.run(debug=True)
     finally:
@@ -0,0 +1,99 @@
+import contextlib
+import math
+import threading
+import time
+from typing import Iterator, List
+
+from .scheduler import estimate_cost
+
+INPUT_BYTES_PER_PIXEL = 4  # BGR original and its grayscale copy, shared by every config of a page
+WORKING_BYTES_PER_PIXEL = 3  # Processed image, edges and contour buffers of one running config
+DEFAULT_THROUGHPUT = 50_000_000  # Work units per second per worker, assumed until jobs have been measured
+THROUGHPUT_SMOOTHING = 0.2  # Weight of the latest job in the moving average
+MIN_RETRY_AFTER_SECONDS = 1
+MAX_RETRY_AFTER_SECONDS = 300
+
+
+class RequestCost:
+    def __init__(self, memory: int, work: int):
+        """Initialize the estimated peak memory in bytes and CPU work (pixels processed) of a request."""
+        self.memory = memory
+        self.work = work
+
+    def __repr__(self):
+        return f"RequestCost(memory={self.memory / 1024 ** 2:.0f} MB, work={self.work})"
+
+
+class RequestTooLargeError(Exception):
+    """Raised when a request alone needs more memory than the whole budget."""
+
+
+class OverloadedError(Exception):
+    def __init__(self, message: str, retry_after: int):
+        """Raised when admitting a request would exceed the backlog, retry_after is in seconds."""
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_request_cost(width: int, height: int, configs: List[dict], pages=1) -> RequestCost:
+    """Estimate a request from its pixel count, page count and the upscale steps of its configs.
+    Pages are processed one after another and the configs of a page all at once, so memory is bounded by one page
+    and work grows with every page."""
+    pixels = width * height
+    work = sum(estimate_cost(pixels, config) for config in configs)
+    return RequestCost(pixels * INPUT_BYTES_PER_PIXEL + work * WORKING_BYTES_PER_PIXEL, work * pages)
+
+
+class AdmissionController:
+    def __init__(self, memory_budget: int, max_backlog_seconds: float, workers: int):
+        """Initialize admission against a memory budget shared by running requests and a CPU backlog shared by
+        waiting and running ones, expressed as the seconds `workers` jobs need to work through it."""
+        self.memory_budget = memory_budget
+        self.max_backlog_seconds = max_backlog_seconds
+        self.workers = workers
+        self.memory_in_use = 0
+        self.backlog = 0  # Work of admitted requests that have not finished yet
+        self.throughput = DEFAULT_THROUGHPUT
+        self.condition = threading.Condition()
+
+    def admit(self, cost: RequestCost):
+        """Reserve backlog for a request about to be queued.
+        Raises RequestTooLargeError when it could never run, OverloadedError when the backlog is full.
+        A request is always admitted into an empty backlog, so large requests are slow rather than refused."""
+        if cost.memory > self.memory_budget:
+            raise RequestTooLargeError(f"Request needs about {cost.memory / 1024 ** 2:.0f} MB, more than the "
+                                       f"{self.memory_budget / 1024 ** 2:.0f} MB processing budget")
+        with self.condition:
+            excess = self.backlog_seconds(self.backlog + cost.work) - self.max_backlog_seconds
+            if self.backlog and excess > 0:
+                retry_after = min(MAX_RETRY_AFTER_SECONDS, max(MIN_RETRY_AFTER_SECONDS, math.ceil(excess)))
+                raise OverloadedError("Server is busy, retry later", retry_after)
+            self.backlog += cost.work
+
+    def cancel(self, cost: RequestCost):
+        """Return the backlog of an admitted request that was not queued after all."""
+        with self.condition:
+            self.backlog -= cost.work
+
+    @contextlib.contextmanager
+    def running(self, cost: RequestCost) -> Iterator[None]:
+        """Hold the memory of an admitted request while it runs, waiting until enough of the budget is free.
+        Its backlog is released and the throughput estimate updated when it finishes."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.memory_in_use + cost.memory <= self.memory_budget)
+            self.memory_in_use += cost.memory
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.condition:
+                self.memory_in_use -= cost.memory
+                self.backlog -= cost.work
+                if elapsed > 0 and cost.work:
+                    self.throughput += THROUGHPUT_SMOOTHING * (cost.work / elapsed - self.throughput)
+                self.condition.notify_all()
+
+    def backlog_seconds(self, work=None) -> float:
+        """Estimate the seconds needed to work through the given work, the current backlog by default."""
+        return (self.backlog if work is None else work) / (self.throughput * self.workers)
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Callable, Dict, List, Optional
+
+from .raster_cache import file_content_hash
+from .utils import Icon, TextColor
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_FORMAT_VERSION = 1
+
+
+class BatchManifest:
+    def __init__(self, output_dir: str, configs: List[dict], version: str,
+                 still_current: Optional[Callable[[dict], bool]] = None, **options):
+        """Initialize the record of inputs already processed into output_dir, continuing the one of an earlier run.
+
+        Inputs are keyed by their content hash and page, the config set, the pipeline version and any other options
+        that change the outputs, so an input is skipped only when all of them match and its outputs still exist.
+        Outputs depending on state outside the key are checked by `still_current`, given the recorded entry."""
+        self.output_dir = output_dir
+        self.still_current = still_current
+        self.path = os.path.join(output_dir, MANIFEST_FILE)
+        self.fingerprint = hashlib.sha256(json.dumps({'configs': configs, 'version': version, **options},
+                                                     sort_keys=True).encode()).hexdigest()
+        self.entries: Dict[str, dict] = self._load()
+        self.pending: Dict[str, str] = {}  # Input name -> key, for inputs being processed in this run
+        self.skipped = 0
+
+    def key(self, file_path: str, page: Optional[int]) -> str:
+        stat = os.stat(file_path)
+        content = file_content_hash(file_path, stat.st_size, stat.st_mtime_ns)
+        return hashlib.sha256(f"{content}:{page or 1}:{self.fingerprint}".encode()).hexdigest()
+
+    def is_current(self, file_path: str, page: Optional[int], name: str) -> bool:
+        """Tell whether the outputs of an input are up to date; otherwise remember its key for record."""
+        key = self.key(file_path, page)
+        entry = self.entries.get(name)
+        if entry is not None and entry['key'] == key and all(
+                os.path.exists(os.path.join(self.output_dir, output)) for output in entry['outputs']) and (
+                self.still_current is None or self.still_current(entry)):
+            self.skipped += 1
+            print(f"{Icon.DONE} [Import] Skipping unchanged input {TextColor.YELLOW}{name}{TextColor.RESET}")
+            return True
+        self.pending[name] = key
+        return False
+
+    def record(self, name: str, outputs: List[str], **details):
+        """Mark an input as done with the output files it produced and any details for `still_current`, saving the
+        manifest right away so an interrupted run resumes after the last finished input."""
+        self.entries[name] = {'key': self.pending.pop(name),
+                              'outputs': [os.path.relpath(output, self.output_dir) for output in outputs], **details}
+        self.save()
+
+    def save(self):
+        """Write the manifest atomically, a crash never leaves a truncated file behind."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.output_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump({'version': MANIFEST_FORMAT_VERSION, 'entries': self.entries}, file, indent=1)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _load(self) -> Dict[str, dict]:
+        """Read the manifest of an earlier run; a missing, unreadable or newer one starts from scratch."""
+        try:
+            with open(self.path) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_FORMAT_VERSION:
+            return {}
+        return manifest.get('entries', {})
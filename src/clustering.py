@@ -1,14 +1,18 @@
 from typing import List, Any
 
 import numpy as np
-from kneed import KneeLocator
-from sklearn.cluster import KMeans
 
 from .geometry import Rectangle
 
 RANDOM_SEED = 42
 
 
+def warm_up():
+    """Import the clustering backends ahead of the first clustering call."""
+    import kneed  # noqa: F401
+    import sklearn.cluster  # noqa: F401
+
+
 def cluster_rectangles(rects: List[Rectangle], mode='size') -> List[Rectangle]:
     """Cluster rectangles by size or distance."""
     if not rects or len(rects) <= 1:
@@ -26,6 +30,7 @@ def cluster_rectangles(rects: List[Rectangle], mode='size') -> List[Rectangle]:
 
 def _cluster_by_size(rects: List[Rectangle]) -> List[Rectangle]:
     """Cluster rectangles by their size."""
+    from sklearn.cluster import KMeans  # Heavy import, deferred until clustering is actually needed
     sizes = np.array([rect.w * rect.h for rect in rects]).reshape(-1, 1)
     num_clusters = _determine_optimal_clusters(sizes)
     num_clusters = min(len(sizes), num_clusters)
@@ -36,6 +41,7 @@ def _cluster_by_size(rects: List[Rectangle]) -> List[Rectangle]:
 
 def _cluster_by_distance(rects: List[Rectangle]) -> List[Rectangle]:
     """Cluster rectangles by their proximity."""
+    from sklearn.cluster import KMeans
     centers = np.array([(rect.x + rect.w / 2, rect.y + rect.h / 2) for rect in rects])
     num_clusters = _determine_optimal_clusters(centers)
     num_clusters = min(len(centers), num_clusters)
@@ -46,6 +52,8 @@ def _cluster_by_distance(rects: List[Rectangle]) -> List[Rectangle]:
 
 def _determine_optimal_clusters(data: np.ndarray[Any, np.dtype], max_clusters=15, min_clusters=3) -> int:
     """Determine the optimal number of clusters using the elbow method."""
+    from kneed import KneeLocator
+    from sklearn.cluster import KMeans
     distortions = []
     K = range(1, min(len(data), max_clusters) + 1)  # Ensure the range does not exceed the number of samples
     for k in K:
@@ -1,6 +1,7 @@
 import itertools
-from typing import List
+from typing import List, Optional
 
+from .config_profiles import DEFAULT_RANKED_CONFIGS, ProfileStore
 from .image_processing import ENHANCE_CONTRAST, BLUR, EDGE_DETECTION, THRESHOLD, UPSCALE
 
 # Constants
@@ -12,8 +13,14 @@ FAVORITE_CONFIGS = [
 ]
 
 
-def generate_configs(use_favorites=True) -> List[dict]:
-    """Generate image processing configurations."""
+def generate_configs(use_favorites=True, signature: Optional[dict] = None, profiles: Optional[ProfileStore] = None,
+                     limit=DEFAULT_RANKED_CONFIGS) -> List[dict]:
+    """Generate image processing configurations.
+    With a profile store and the source signature of an image, propose the configs that won most often for its
+    source, best first, and sweep every combinatorial configuration for unknown sources."""
+    if profiles is not None and signature is not None:
+        ranked = profiles.ranked_steps(signature, limit)
+        return [{'steps': steps} for steps in (ranked or _get_combinatorial_configs())]
     if use_favorites:  # Use favorite configurations
         return [{'steps': config} for config in [FAVORITE_CONFIGS[2]]]
     else:  # Generate combinatorial configurations
@@ -0,0 +1,107 @@
+import json
+import math
+import os
+import tempfile
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+from .utils import Icon, TextColor
+
+PROFILE_FILE = 'config_profiles.json'
+PROFILE_FORMAT_VERSION = 1
+DEFAULT_RANKED_CONFIGS = 3  # Configs proposed for a known source, the ones that won most often
+SIGNATURE_SIZE = 512  # Longest side of the thumbnail signatures are computed from
+HISTOGRAM_BINS = 8
+EDGE_THRESHOLDS = (50, 150)
+# A signature matches a profile when every component is within its tolerance
+PIXELS_TOLERANCE = 0.6  # log2 of the pixel count, about 1.5x
+ASPECT_TOLERANCE = 0.1
+HISTOGRAM_TOLERANCE = 0.25  # L1 distance of the normalized histograms
+EDGE_DENSITY_TOLERANCE = 0.5  # Relative to the profile's edge density
+
+
+def source_signature(image: cv2.typing.MatLike) -> dict:
+    """Return a cheap signature of the source an image comes from: its resolution and aspect ratio, a coarse
+    intensity histogram and its edge density, all taken from a thumbnail in a few milliseconds."""
+    height, width = image.shape[:2]
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    scale = min(1.0, SIGNATURE_SIZE / max(width, height))
+    thumbnail = cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    histogram = np.bincount(thumbnail.ravel() // (256 // HISTOGRAM_BINS), minlength=HISTOGRAM_BINS) / thumbnail.size
+    edges = cv2.Canny(thumbnail, *EDGE_THRESHOLDS)
+    return {'pixels': math.log2(width * height), 'aspect': width / height,
+            'histogram': [round(value, 4) for value in histogram.tolist()],
+            'edge_density': round(float(np.count_nonzero(edges)) / edges.size, 5)}
+
+
+def signature_distance(a: dict, b: dict) -> float:
+    """Return the largest component difference of two signatures relative to its tolerance; they match below 1."""
+    return max(abs(a['pixels'] - b['pixels']) / PIXELS_TOLERANCE,
+               abs(a['aspect'] - b['aspect']) / ASPECT_TOLERANCE,
+               sum(abs(x - y) for x, y in zip(a['histogram'], b['histogram'])) / HISTOGRAM_TOLERANCE,
+               abs(a['edge_density'] - b['edge_density']) / (EDGE_DENSITY_TOLERANCE * max(b['edge_density'], 1e-4)))
+
+
+class ProfileStore:
+    def __init__(self, path=PROFILE_FILE):
+        """Initialize the store of config profiles at path, continuing the one of earlier runs.
+        A profile is the signature of a source with the number of times each step sequence gave its best result."""
+        self.path = path
+        self.profiles: List[dict] = self._load()
+
+    def match(self, signature: dict) -> Optional[dict]:
+        """Return the profile closest to a signature, or None for an unknown source."""
+        best = min(self.profiles, key=lambda profile: signature_distance(signature, profile['signature']),
+                   default=None)
+        return best if best is not None and signature_distance(signature, best['signature']) <= 1 else None
+
+    def ranked_steps(self, signature: dict, limit=DEFAULT_RANKED_CONFIGS) -> List[List[str]]:
+        """Return the step sequences that won most often for the source of a signature, best first.
+        Empty for unknown sources."""
+        profile = self.match(signature)
+        if profile is None:
+            return []
+        ranked = sorted(profile['wins'].items(), key=lambda item: (-item[1], item[0]))
+        return [steps.split(',') for steps, _ in ranked[:limit]]
+
+    def record(self, signature: dict, steps: List[str]):
+        """Count a win for the step sequence that gave the best result of an image, adding a profile for a new
+        source, and save the store right away."""
+        profile = self.match(signature)
+        if profile is None:
+            profile = {'signature': signature, 'runs': 0, 'wins': {}}
+            self.profiles.append(profile)
+            print(f"{Icon.DONE} [Profiles] Added a profile for a new source, {len(self.profiles)} known")
+        key = ','.join(steps)
+        profile['runs'] += 1
+        profile['wins'][key] = profile['wins'].get(key, 0) + 1
+        self.save()
+
+    def save(self):
+        """Write the store atomically, a crash never leaves a truncated file behind."""
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump({'version': PROFILE_FORMAT_VERSION, 'profiles': self.profiles}, file, indent=1)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _load(self) -> List[dict]:
+        """Read the store of earlier runs; a missing, unreadable or newer one starts empty."""
+        try:
+            with open(self.path) as file:
+                store = json.load(file)
+        except (OSError, ValueError):
+            return []
+        if not isinstance(store, dict) or store.get('version') != PROFILE_FORMAT_VERSION:
+            print(f"{Icon.ERROR} [Profiles] Ignoring incompatible profile store "
+                  f"{TextColor.YELLOW}{self.path}{TextColor.RESET}")
+            return []
+        return store.get('profiles', [])
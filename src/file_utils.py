@@ -1,18 +1,31 @@
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import io
 import os
-from typing import List, Tuple
+import re
+import struct
+import uuid
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 import cv2
-import matplotlib.pyplot as plt
 import numpy as np
-from pdf2image import convert_from_path
 
-from .geometry import Rectangle, Line, Shape, Node
+from .geometry import Line, Node, Rectangle, Shape
 from .image_pipeline import ProcessedImage
+from .instrumentation import stage
+from .layout_io import LAYOUT_EXTENSION, Layout
+from .raster_cache import RASTER_CACHE_DIR, RasterCache
+from .rendering import DEFAULT_TILE_SIZE, NATIVE_RENDERER, RENDERERS, draw_objects, \
+    encode_image, render_result_grid
 from .utils import add_homebrew_path, Icon, TextColor
 
 INPUT_DPI = 500
 OUTPUT_DPI = 1000
 DEFAULT_NUM_FILES = 3
+DEFAULT_PREFETCH = 2
+DEFAULT_PDF_PAGES = (1,)
 DEFAULT_OUTPUT_FILE = 'output.png'
 #
 PNG_EXTENSION = '.png'
@@ -21,51 +34,201 @@ JPEG_EXTENSION = '.jpeg'
 JPG_EXTENSION = '.jpg'
 JSON_EXTENSION = '.json'
 IMAGE_EXTENSIONS = (PNG_EXTENSION, JPG_EXTENSION, JPEG_EXTENSION)
-#
-COLOR_RECTANGLE = (255, 49, 49)
-COLOR_LINE = (170, 255, 0)
-COLOR_TEXT = (0, 0, 0)
-FILL_THICKNESS = -1
-LINE_THICKNESS = 3
-TRAVEL_NODE_COLOR = (255, 255, 255)
-TRAVEL_NODE_RADIUS = 15
-TERMINAL_NODE_COLOR = (0, 150, 255)
-TERMINAL_NODE_RADIUS = 45
-
-
-def load_images(folder_path='assets', num_files=DEFAULT_NUM_FILES) -> List[Tuple[cv2.typing.MatLike, str]]:
+# Headers read to size uploads before decoding them
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SOI = b'\xff\xd8'
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+PDF_MEDIA_BOX = re.compile(rb'/MediaBox\s*\[\s*([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)\s*\]')
+PDF_POINTS_PER_INCH = 72
+A4_POINTS = (595.0, 842.0)
+
+
+def load_images(folder_path='assets', num_files=DEFAULT_NUM_FILES,
+                pages: Optional[Sequence[int]] = DEFAULT_PDF_PAGES) -> List[Tuple[cv2.typing.MatLike, str]]:
     """Load a limited number of images from the assets folder."""
+    return list(iter_images(folder_path, num_files, pages=pages))
+
+
+def iter_images(folder_path='assets', num_files: Optional[int] = DEFAULT_NUM_FILES, prefetch=DEFAULT_PREFETCH,
+                pages: Optional[Sequence[int]] = DEFAULT_PDF_PAGES,
+                cache_dir: Optional[str] = RASTER_CACHE_DIR,
+                skip: Optional[Callable[[str, Optional[int], str], bool]] = None
+                ) -> Iterator[Tuple[cv2.typing.MatLike, str]]:
+    """Lazily load images from a folder, decoding up to `prefetch` inputs ahead in background threads.
+    Each requested PDF page is a separate input; `pages=None` loads every page.
+    Inputs for which `skip(file_path, page, name)` is true are never loaded and do not count towards `num_files`,
+    the number of files loaded from; `num_files=None` loads every file."""
     add_homebrew_path()
-    images_with_names = []
-    file_count = 0
+    cache = RasterCache(cache_dir) if cache_dir else None
+    loaded_files = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=prefetch) as executor:
+        pending = collections.deque()
+        for file_path, page, name in _iter_input_pages(_iter_input_files(folder_path), pages):
+            if skip is not None and skip(file_path, page, name):
+                continue
+            if file_path not in loaded_files:
+                if num_files is not None and len(loaded_files) >= num_files:
+                    break
+                loaded_files.add(file_path)
+            # Each load runs in a copy of the caller's context, so its stage reaches the caller's recorder
+            pending.append(executor.submit(contextvars.copy_context().run, load_image, file_path, page, name, cache))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _iter_input_files(folder_path: str) -> Iterator[str]:
+    """Yield paths of supported input files in the folder."""
     for filename in os.listdir(folder_path):
-        print(f"{Icon.START} [Import] Loading image file {TextColor.YELLOW}{filename}{TextColor.RESET} ...")
-        if file_count >= num_files:
-            break
-        if filename.lower().endswith(PDF_EXTENSION):
-            try:
-                pages = convert_from_path(os.path.join(folder_path, filename), dpi=INPUT_DPI)
-                image = np.array(pages[0])
-                image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-                images_with_names.append((image, filename))
-                file_count += 1
-                print(f"{Icon.DONE} [Import] Loaded image file {TextColor.YELLOW}{filename}{TextColor.RESET}")
-            except Exception as e:
-                raise RuntimeError(f"{Icon.ERROR} [Import] Failed to load PDF file. Error: {e}")
-        elif filename.lower().endswith(IMAGE_EXTENSIONS):
-            image = cv2.imread(os.path.join(folder_path, filename))
+        if filename.lower().endswith((PDF_EXTENSION,) + IMAGE_EXTENSIONS):
+            yield os.path.join(folder_path, filename)
+        else:
+            print(f"{Icon.ERROR} [Import] Not a valid file {TextColor.YELLOW}{filename}{TextColor.RESET}")
+
+
+def _iter_input_pages(file_paths: Iterable[str],
+                      pages: Optional[Sequence[int]]) -> Iterator[Tuple[str, Optional[int], str]]:
+    """Expand PDF files into (path, page, name) inputs; images pass through with no page."""
+    for file_path in file_paths:
+        filename = os.path.basename(file_path)
+        if not filename.lower().endswith(PDF_EXTENSION):
+            yield file_path, None, filename
+            continue
+        page_numbers = _resolve_pdf_pages(file_path, pages)
+        stem, extension = os.path.splitext(filename)
+        for page in page_numbers:
+            name = filename if len(page_numbers) == 1 else f"{stem}_p{page}{extension}"
+            yield file_path, page, name
+
+
+def _resolve_pdf_pages(file_path: str, pages: Optional[Sequence[int]]) -> List[int]:
+    """Return the requested page numbers that exist in the PDF."""
+    if pages is not None and max(pages, default=1) <= 1:
+        return sorted(set(pages))  # First page always exists, no need to query the page count
+    from pdf2image import pdfinfo_from_path  # Deferred, only PDF inputs need it
+
+    try:
+        page_count = pdfinfo_from_path(file_path)['Pages']
+    except Exception as e:
+        raise RuntimeError(f"{Icon.ERROR} [Import] Failed to read PDF info. Error: {e}")
+    if pages is None:
+        return list(range(1, page_count + 1))
+    return sorted(page for page in set(pages) if 1 <= page <= page_count)
+
+
+def parse_pages(spec: str) -> Optional[List[int]]:
+    """Parse a page selection such as '1', '1-3,5' or 'all' into 1-based page numbers (None for all)."""
+    if spec.strip().lower() == 'all':
+        return None
+    pages = set()
+    for part in spec.split(','):
+        start, _, end = part.strip().partition('-')
+        pages.update(range(int(start), int(end or start) + 1))
+    if not pages or min(pages) < 1:
+        raise ValueError(f"Invalid page selection: {spec}")
+    return sorted(pages)
+
+
+def load_image(file_path: str, page: Optional[int] = None, name: Optional[str] = None,
+               cache: Optional[RasterCache] = None) -> Tuple[cv2.typing.MatLike, str]:
+    """Load a single image or a single page of a PDF file."""
+    filename = name or os.path.basename(file_path)
+    print(f"{Icon.START} [Import] Loading image file {TextColor.YELLOW}{filename}{TextColor.RESET} ...")
+    with stage('load', image=filename):
+        if file_path.lower().endswith(PDF_EXTENSION):
+            image = load_pdf_page(file_path, page or 1, cache=cache)
+        else:
+            image = cv2.imread(file_path)
             if image is None:
                 raise FileNotFoundError(f"{Icon.ERROR} [Import] Image not found: {filename}")
-            images_with_names.append((image, filename))
-            file_count += 1
-            print(f"{Icon.DONE} [Import] Loaded image file {TextColor.YELLOW}{filename}{TextColor.RESET}")
+    print(f"{Icon.DONE} [Import] Loaded image file {TextColor.YELLOW}{filename}{TextColor.RESET}")
+    return image, filename
+
+
+def decode_image(data: bytes, filename: str, page=1) -> Tuple[cv2.typing.MatLike, str]:
+    """Decode an image or a single PDF page from bytes already in memory, such as an upload."""
+    print(f"{Icon.START} [Import] Decoding image file {TextColor.YELLOW}{filename}{TextColor.RESET} ...")
+    with stage('load', image=filename):
+        if filename.lower().endswith(PDF_EXTENSION):
+            image = decode_pdf_page(data, page)
         else:
-            print(f"{Icon.ERROR} [Import] Not a valid file {TextColor.YELLOW}{filename}{TextColor.RESET}")
-    return images_with_names
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError(f"{Icon.ERROR} [Import] Not a valid image: {filename}")
+    print(f"{Icon.DONE} [Import] Decoded image file {TextColor.YELLOW}{filename}{TextColor.RESET}")
+    return image, filename
+
+
+def probe_image_size(data: bytes, filename: str, dpi=INPUT_DPI) -> Tuple[int, int]:
+    """Return the (width, height) an in-memory upload decodes to, read from its header without decoding it.
+    PDF pages are measured by their largest MediaBox at the given DPI, or assumed A4 when none can be read.
+    Raises ValueError for data that is not an image."""
+    if filename.lower().endswith(PDF_EXTENSION):
+        boxes = [tuple(float(value) for value in match) for match in PDF_MEDIA_BOX.findall(data)]
+        width, height = max(((x2 - x1, y2 - y1) for x1, y1, x2, y2 in boxes),
+                            key=lambda size: abs(size[0] * size[1]), default=A4_POINTS)
+        return round(abs(width) * dpi / PDF_POINTS_PER_INCH), round(abs(height) * dpi / PDF_POINTS_PER_INCH)
+    if data[:8] == PNG_SIGNATURE and len(data) >= 24:
+        width, height = struct.unpack('>II', data[16:24])
+        return width, height
+    if data[:2] == JPEG_SOI:
+        size = _probe_jpeg_size(data)
+        if size is not None:
+            return size
+    # Other formats are decoded at an eighth of their size, a fraction of the cost of a full decode
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        raise ValueError(f"{Icon.ERROR} [Import] Not a valid image: {filename}")
+    return image.shape[1] * 8, image.shape[0] * 8
+
+
+def _probe_jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """Read the frame size from the first start-of-frame segment of a JPEG."""
+    offset = 2
+    while offset + 9 <= len(data) and data[offset] == 0xFF:
+        marker = data[offset + 1]
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + struct.unpack('>H', data[offset + 2:offset + 4])[0]
+    return None
 
 
-def save_result_images(results: List[ProcessedImage], max_images: int, target_file_name: str):
-    """Save a plot of the processed images as a PNG file."""
+def decode_pdf_page(data: bytes, page: int, dpi=INPUT_DPI) -> np.ndarray:
+    """Rasterise only the requested page of an in-memory PDF."""
+    add_homebrew_path()
+    from pdf2image import convert_from_bytes
+
+    try:
+        rendered = convert_from_bytes(data, dpi=dpi, first_page=page, last_page=page, thread_count=1)
+        return cv2.cvtColor(np.array(rendered[0]), cv2.COLOR_RGB2BGR)
+    except Exception as e:
+        raise RuntimeError(f"{Icon.ERROR} [Import] Failed to load PDF file. Error: {e}")
+
+
+def load_pdf_page(file_path: str, page: int, dpi=INPUT_DPI, cache: Optional[RasterCache] = None) -> np.ndarray:
+    """Rasterise only the requested PDF page, reusing a cached raster when one exists."""
+    key = cache.key(file_path, page, dpi) if cache else None
+    if cache:
+        image = cache.get(key)
+        if image is not None:
+            return image
+    from pdf2image import convert_from_path
+
+    try:
+        rendered = convert_from_path(file_path, dpi=dpi, first_page=page, last_page=page, thread_count=1)
+        image = cv2.cvtColor(np.array(rendered[0]), cv2.COLOR_RGB2BGR)
+    except Exception as e:
+        raise RuntimeError(f"{Icon.ERROR} [Import] Failed to load PDF file. Error: {e}")
+    if cache:
+        cache.put(key, image)
+    return image
+
+
+def save_result_images(results: List[ProcessedImage], max_images: int, target_file_name: str,
+                       renderer=NATIVE_RENDERER, tile_size=DEFAULT_TILE_SIZE) -> Optional[str]:
+    """Save a grid of the processed images as a PNG (or JPEG) file and return its path."""
     filtered_results = results[:max_images]
     if target_file_name.lower().endswith(PDF_EXTENSION):
         output_filename = target_file_name.replace(PDF_EXTENSION, PNG_EXTENSION)
@@ -76,7 +239,32 @@ def save_result_images(results: List[ProcessedImage], max_images: int, target_fi
     num_images = len(results)
     if num_images == 0:
         print(f"{Icon.ERROR} [Save] No results to save. Skipping...")
-        return
+        return None
+    if renderer not in RENDERERS:
+        raise ValueError(f"Invalid renderer. Choose one of {', '.join(RENDERERS)}.")
+    with stage('render', image=os.path.basename(output_filename)), atomic_output(output_filename) as tmp_filename:
+        if renderer == NATIVE_RENDERER:
+            with open(tmp_filename, 'wb') as file:
+                file.write(encode_result_images(filtered_results, max_images,
+                                                os.path.splitext(output_filename)[1] or PNG_EXTENSION, tile_size))
+        else:
+            _plot_result_images(filtered_results, num_images, max_images, tmp_filename)
+    print(f"{Icon.DONE} [Save] Saved {len(filtered_results)} results ->"
+          f" {TextColor.CYAN}{output_filename}{TextColor.RESET}")
+    return output_filename
+
+
+def encode_result_images(results: List[ProcessedImage], max_images: int, extension=PNG_EXTENSION,
+                         tile_size=DEFAULT_TILE_SIZE) -> bytes:
+    """Render the grid of the top results and return it as encoded PNG (or JPEG) bytes."""
+    return encode_image(render_result_grid(results, max_images, tile_size), extension)
+
+
+def _plot_result_images(filtered_results: List[ProcessedImage], num_images: int, max_images: int,
+                        output_filename: str):
+    """Plot the results with matplotlib at OUTPUT_DPI, slow but kept for publication-quality figures."""
+    import matplotlib.pyplot as plt  # Optional dependency, only needed by this renderer
+
     num_cols = int(np.ceil(np.sqrt(max_images)))
     num_rows = int(np.ceil(num_images / num_cols))
     plt.figure(figsize=(num_cols * 5, num_rows * 5), dpi=OUTPUT_DPI)
@@ -84,7 +272,7 @@ def save_result_images(results: List[ProcessedImage], max_images: int, target_fi
 
     for i, result in enumerate(filtered_results):
         overlay = cv2.cvtColor(result.edge_img, cv2.COLOR_BGR2RGB)
-        overlay = _draw_objects(overlay, result.rects, result.lines, result.nodes)
+        overlay = draw_objects(overlay, result.rects, result.lines, result.nodes)
         plt.subplot(num_rows, num_cols, i + 1)
         plt.imshow(overlay)
         plt.title(result.label, fontsize=font_size)
@@ -94,49 +282,65 @@ def save_result_images(results: List[ProcessedImage], max_images: int, target_fi
     plt.subplots_adjust(hspace=0.3, wspace=0.3)  # Adjust the horizontal and vertical padding
     plt.savefig(output_filename)
     plt.close()
-    print(f"{Icon.DONE} [Save] Saved {len(filtered_results)} results ->"
-          f" {TextColor.CYAN}{output_filename}{TextColor.RESET}")
 
 
-def _draw_objects(overlay: cv2.typing.MatLike, rects: List[Rectangle], lines: List[Line], nodes: List[Node]):
-    """Draw rectangles and lines on the image."""
-    for rect in rects:
-        # draw rectangle
-        cv2.rectangle(overlay, (rect.x, rect.y), (rect.x + rect.w, rect.y + rect.h), COLOR_RECTANGLE, LINE_THICKNESS)
-        # draw text in the center of rectangle
-        text = str(rect.id)
-        # Calculate font scale based on rectangle dimensions
-        font_scale = min(rect.w, rect.h) / 75  # sweet spot
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        text_size = cv2.getTextSize(text, font, font_scale, LINE_THICKNESS)[0]
-        center_x = rect.x + rect.w // 2
-        center_y = rect.y + rect.h // 2
-        text_x = center_x - text_size[0] // 2
-        text_y = center_y + text_size[1] // 2
-        # Write index number at the center of the rectangle
-        cv2.putText(overlay, text, (text_x, text_y), font, font_scale, COLOR_TEXT, LINE_THICKNESS,
-                    lineType=cv2.LINE_AA)
-    #
-    for line in lines:
-        cv2.line(overlay, (line.start.x, line.start.y), (line.end.x, line.end.y), COLOR_LINE, LINE_THICKNESS)
-    #
-    for node in nodes:
-        color = TRAVEL_NODE_COLOR if not node.connection else TERMINAL_NODE_COLOR
-        radius = TRAVEL_NODE_RADIUS if not node.connection else TERMINAL_NODE_RADIUS
-        cv2.circle(overlay, (node.pos.x, node.pos.y), radius, color, FILL_THICKNESS)
-    return overlay
-
-
-def save_result_shapes(shapes: List[Shape], target_file_name: str):
+def save_result_shapes(shapes: List[Shape], target_file_name: str) -> str:
     if target_file_name.lower().endswith(PDF_EXTENSION):
         output_filename = target_file_name.replace(PDF_EXTENSION, JSON_EXTENSION)
     else:
         output_filename = target_file_name
     print(f"{Icon.START} [Save] Saving {len(shapes)} shapes -> "
           f"{TextColor.YELLOW}{output_filename}{TextColor.RESET} ...")
-    with open(output_filename, 'w') as file:
-        for shape in shapes:
-            json_str = shape.to_json()
-            file.write(json_str + '\n')
+    with stage('save_shapes', image=os.path.basename(output_filename)), \
+            atomic_output(output_filename) as tmp_filename, open(tmp_filename, 'w') as file:
+        file.write(format_result_shapes(shapes))
     print(f"{Icon.DONE} [Save] Saved {len(shapes)} shapes ->"
           f" {TextColor.CYAN}{output_filename}{TextColor.RESET}")
+    return output_filename
+
+
+@contextlib.contextmanager
+def atomic_output(target_file_name: str) -> Iterator[str]:
+    """Yield a temporary path next to the target, with the same extension, that replaces the target once written.
+    Readers and interrupted runs never see a partially written output."""
+    directory, basename = os.path.split(target_file_name)
+    # Named rather than created with mkstemp, so the output gets the usual permissions instead of owner-only ones
+    tmp_path = os.path.join(directory, f'.{basename}.{uuid.uuid4().hex}{os.path.splitext(basename)[1]}')
+    try:
+        yield tmp_path
+        os.replace(tmp_path, target_file_name)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def format_result_shapes(shapes: List[Shape]) -> str:
+    """Return the JSONL export of the shapes, one shape per line."""
+    return ''.join(shape.to_json() + '\n' for shape in shapes)
+
+
+def save_result_layout(rects: List[Rectangle], lines: List[Line], nodes: List[Node], target_file_name: str,
+                       fingerprints: Optional[np.ndarray] = None, steps: Optional[List[str]] = None) -> str:
+    """Save detected geometry in the binary layout format next to the JSONL export and return its path."""
+    output_filename = os.path.splitext(target_file_name)[0] + LAYOUT_EXTENSION
+    print(f"{Icon.START} [Save] Saving layout -> {TextColor.YELLOW}{output_filename}{TextColor.RESET} ...")
+    with stage('save_layout', image=os.path.basename(output_filename)):
+        Layout.from_shapes(rects, lines, nodes, fingerprints, steps).save(output_filename)
+    print(f"{Icon.DONE} [Save] Saved layout with {len(rects)} rectangles, {len(lines)} lines and {len(nodes)} nodes ->"
+          f" {TextColor.CYAN}{output_filename}{TextColor.RESET}")
+    return output_filename
+
+
+def encode_result_layout(rects: List[Rectangle], lines: List[Line], nodes: List[Node],
+                         fingerprints: Optional[np.ndarray] = None, steps: Optional[List[str]] = None) -> bytes:
+    """Return detected geometry in the binary layout format as bytes.
+    Tile fingerprints of the source image and the config steps let revisions of it be reprocessed incrementally."""
+    buffer = io.BytesIO()
+    Layout.from_shapes(rects, lines, nodes, fingerprints, steps).save(buffer)
+    return buffer.getvalue()
+
+
+def load_result_layout(file_path: str) -> Layout:
+    """Load a layout saved by save_result_layout."""
+    return Layout.load(file_path)
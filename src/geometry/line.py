@@ -1,3 +1,4 @@
+import itertools
 import json
 from typing import Optional
 
@@ -6,12 +7,11 @@ from .shape import Shape
 
 
 class Line(Shape):
-    _id_counter = 1
+    _ids = itertools.count(1)  # next() on a count is atomic, configs run concurrently in threads
 
     def __init__(self, start: Point, end: Point):
         super().__init__(start, end.x - start.x, end.y - start.y)
-        self.id = Line._id_counter
-        Line._id_counter += 1
+        self.id = next(Line._ids)
         self.start = start
         self.end = end
 
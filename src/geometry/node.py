@@ -1,3 +1,4 @@
+import itertools
 import json
 
 from .point import Point
@@ -5,12 +6,11 @@ from .shape import Shape
 
 
 class Node(Shape):
-    _id_counter = 1
+    _ids = itertools.count(1)  # next() on a count is atomic, configs run concurrently in threads
 
     def __init__(self, point: Point):
         super().__init__(point, 0, 0)
-        self.id = Node._id_counter
-        Node._id_counter += 1
+        self.id = next(Node._ids)
         self.links = {}  # Dictionary of connected node id and distance
         self.connection = None
 
@@ -1,3 +1,4 @@
+import itertools
 import json
 
 from .point import Point
@@ -5,13 +6,12 @@ from .shape import Shape
 
 
 class Rectangle(Shape):
-    _id_counter = 1
+    _ids = itertools.count(1)  # next() on a count is atomic, configs run concurrently in threads
 
     def __init__(self, x: int, y: int, w: int, h: int):
         """Initialize a Rectangle with given attributes."""
         super().__init__(Point(x, y), w, h)
-        self.id = Rectangle._id_counter
-        Rectangle._id_counter += 1
+        self.id = next(Rectangle._ids)
         self.x = x
         self.y = y
         self.w = w
@@ -0,0 +1,48 @@
+import collections
+import threading
+from typing import Callable, Optional
+
+from .routing import RoutingGraph
+from .utils import Icon, TextColor
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+
+class GraphCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        """Initialize an in-memory LRU of built routing graphs, bounded by the memory of their matrices."""
+        self.max_bytes = max_bytes
+        self.graphs: 'collections.OrderedDict[str, RoutingGraph]' = collections.OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str, load: Callable[[], Optional[RoutingGraph]]) -> Optional[RoutingGraph]:
+        """Return the graph stored under the key, building it with `load` on a miss.
+        Returns None when the loader has nothing to build from."""
+        with self.lock:
+            graph = self.graphs.get(key)
+            if graph is not None:
+                self.graphs.move_to_end(key)
+                return graph
+        # Built outside the lock so queries against other layouts are never blocked by a build
+        graph = load()
+        if graph is None:
+            return None
+        return self.put(key, graph)
+
+    def put(self, key: str, graph: RoutingGraph) -> RoutingGraph:
+        """Store a built graph under the key, unless one is stored already, and return the stored graph."""
+        with self.lock:
+            if key not in self.graphs:
+                self.graphs[key] = graph
+                self.nbytes += graph.nbytes
+                self._evict()
+            return self.graphs[key]
+
+    def _evict(self):
+        """Drop least recently used graphs until under max_bytes, always keeping the newest one."""
+        while self.nbytes > self.max_bytes and len(self.graphs) > 1:
+            key, graph = self.graphs.popitem(last=False)
+            self.nbytes -= graph.nbytes
+            print(f"{Icon.DONE} [Routing] Evicted graph {TextColor.YELLOW}{key}{TextColor.RESET} "
+                  f"({graph.nbytes / 1024 ** 2:.1f} MB)")
@@ -0,0 +1,87 @@
+from typing import Dict, List
+
+from .geometry import Node
+
+SNAP_TOLERANCE = 5  # Nodes this close on both axes are one place, in original image pixels
+
+
+class GraphSimplifier:
+    def __init__(self, nodes: List[Node], upscale_factor: int):
+        """Initialize with the nodes generated for a layout and the upscale factor of their coordinates."""
+        self.nodes: Dict[int, Node] = {node.id: node for node in nodes}
+        self.tolerance = SNAP_TOLERANCE * upscale_factor
+
+    def simplify(self) -> List[Node]:
+        """Return a smaller graph with the same routes between terminal nodes.
+
+        Nodes within the snap tolerance of each other are merged, travel nodes leading nowhere are dropped and
+        travel nodes merely passing a straight line through are contracted into one longer link. Terminal nodes are
+        always kept, and corners too, so paths can still be drawn as straight segments between their nodes."""
+        count = len(self.nodes)
+        self._snap_nodes()
+        self._drop_stubs()
+        self._contract_chains()
+        print(f"[GraphSimplifier] Reduced {count} nodes to {len(self.nodes)}")
+        return list(self.nodes.values())
+
+    def _snap_nodes(self):
+        """Merge clusters of almost coincident nodes, as near-duplicate lines create, into one node each.
+        A cluster keeps the position of its terminal node, or of its first node, and never merges two terminals."""
+        cells: Dict[tuple, List[Node]] = {}
+        for node in sorted(self.nodes.values(), key=lambda n: (n.connection is None, n.id)):
+            cell = (node.pos.x // (self.tolerance + 1), node.pos.y // (self.tolerance + 1))
+            target = self._snap_target(node, cells, cell)
+            if target is None:
+                cells.setdefault(cell, []).append(node)
+            else:
+                self._merge(node, target)
+
+    def _snap_target(self, node: Node, cells: Dict[tuple, List[Node]], cell: tuple):
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for other in cells.get((cell[0] + dx, cell[1] + dy), ()):
+                    if (abs(other.pos.x - node.pos.x) <= self.tolerance and
+                            abs(other.pos.y - node.pos.y) <= self.tolerance and
+                            not (node.connection and other.connection)):
+                        return other
+        return None
+
+    def _merge(self, node: Node, target: Node):
+        """Move the links of a node over to target and remove the node."""
+        del self.nodes[node.id]
+        for other_id in node.links:
+            other = self.nodes.get(other_id)
+            if other is None:
+                continue
+            del other.links[node.id]
+            if other is not target:
+                distance = target.distance(other)
+                target.links[other.id] = other.links[target.id] = min(distance, target.links.get(other.id, distance))
+        target.links.pop(node.id, None)
+
+    def _drop_stubs(self):
+        """Remove travel nodes with at most one link, repeatedly, so dead-end chains disappear completely."""
+        pending = list(self.nodes.values())
+        while pending:
+            node = pending.pop()
+            if node.id not in self.nodes or node.connection or len(node.links) > 1:
+                continue
+            del self.nodes[node.id]
+            for other_id in node.links:
+                other = self.nodes[other_id]
+                del other.links[node.id]
+                pending.append(other)
+
+    def _contract_chains(self):
+        """Replace travel nodes with two links on one straight line by a direct link of the same length."""
+        for node in list(self.nodes.values()):
+            if node.connection or len(node.links) != 2:
+                continue
+            (a_id, a_distance), (b_id, b_distance) = node.links.items()
+            a, b = self.nodes[a_id], self.nodes[b_id]
+            if not (a.pos.x == node.pos.x == b.pos.x or a.pos.y == node.pos.y == b.pos.y):
+                continue
+            del self.nodes[node.id]
+            del a.links[node.id], b.links[node.id]
+            distance = min(a_distance + b_distance, a.links.get(b_id, a_distance + b_distance))
+            a.links[b_id] = b.links[a_id] = distance
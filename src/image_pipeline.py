@@ -1,30 +1,58 @@
-import concurrent.futures
-from typing import List, Tuple
+import tempfile
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 
 import cv2
 
 from .geometry import Line, Node, Rectangle
+from .graph_simplifier import GraphSimplifier
+from .instrumentation import Recorder, StageRecord, recording, stage
 from .line_generator import LineGenerator
 from .node_generator import NodeGenerator
 from .rectangle_detection import RectangleDetector
+from .scheduler import PROCESS_BACKEND, TaskScheduler
+from .shared_images import ImageSource, SharedImage, resolve_image
 from .utils import Icon, TextColor
 
+PIPELINE_VERSION = '2'  # Bump whenever a change alters results, it invalidates cached results
+# Rendering payloads go to disk, they are read back only for results that get rendered
+SPILL_DIR = tempfile.gettempdir()
+
 
 class ProcessedImage:
-    def __init__(self, original_img: cv2.typing.MatLike, edge_img: cv2.typing.MatLike, label: str,
-                 rects: List[Rectangle], lines: List[Line], nodes: List[Node], upscale_factor: int):
-        """Initialize the processed image with results."""
-        self.original_img = original_img
-        self.edge_img = edge_img
+    def __init__(self, edge_img: ImageSource, label: str, rects: List[Rectangle], lines: List[Line],
+                 nodes: List[Node], upscale_factor: int, records: Optional[List[StageRecord]] = None,
+                 steps: Optional[List[str]] = None):
+        """Initialize the processed image with results, the steps of its config and the stage records of the run
+        that produced it."""
+        self._edge_img = edge_img
         self.label = label
         self.rects = rects
         self.lines = lines
         self.nodes = nodes
         self.upscale_factor = upscale_factor
+        self.steps = steps
+        self.records = records or []
         # self.upscaled_rects = self._scale_rectangles(rects, upscale_factor)
 
         self.num_rects = len(rects)
 
+    @property
+    def edge_img(self) -> cv2.typing.MatLike:
+        """Return the edge image, mapping it from its spill file on first use."""
+        return resolve_image(self._edge_img)
+
+    def spill(self) -> 'ProcessedImage':
+        """Move the edge image out of the result so only geometry and metrics travel between processes."""
+        if not isinstance(self._edge_img, SharedImage):
+            self._edge_img = SharedImage.create(self._edge_img, directory=SPILL_DIR)
+        return self
+
+    def release(self):
+        """Drop the rendering payload once the result no longer needs to be rendered."""
+        if isinstance(self._edge_img, SharedImage):
+            self._edge_img.release()
+        self._edge_img = None
+
     @staticmethod
     def _scale_rectangles(rects: List[Rectangle], upscale_factor: int) -> List[Rectangle]:
         """Update rectangles for scaling."""
@@ -41,19 +69,35 @@ class ProcessedImage:
         return updated
 
 
-def _process_single_config(filename: str, original_img: cv2.typing.MatLike, gray_img: cv2.typing.MatLike,
-                           config) -> ProcessedImage:
-    """Process a single image configuration."""
+def _process_single_config(filename: str, original_source: ImageSource, gray_source: ImageSource,
+                           config, spill=True) -> ProcessedImage:
+    """Process a single image configuration, recording its stages on the result."""
+    with recording(Recorder(image=filename, config='->'.join(config['steps']))) as recorder:
+        with stage('process'):
+            result = _run_single_config(filename, original_source, gray_source, config)
+    result.records = recorder.records
+    # Results crossing a process boundary leave their rendering payload behind in a spill file
+    return result.spill() if spill else result
+
+
+def _run_single_config(filename: str, original_source: ImageSource, gray_source: ImageSource,
+                       config) -> ProcessedImage:
+    original_img = resolve_image(original_source)
+    gray_img = resolve_image(gray_source)
     print(f"{Icon.START} [Process] Started processing image {TextColor.YELLOW}{filename}{TextColor.RESET} "
           f"with config {config} ...")
     detector = RectangleDetector(gray_img, original_img, config)
     edge_img, rects, upscale_factor = detector.detect()
     print(f"{Icon.DETECT} [Detection] {TextColor.GREEN}Detected {len(rects)} rectangles{TextColor.RESET} "
           f"for image {TextColor.YELLOW}{filename}{TextColor.RESET} with config {config}")
-    lines = LineGenerator(edge_img, rects, upscale_factor).generate()
+    with stage('lines'):
+        lines = LineGenerator(edge_img, rects, upscale_factor).generate()
     print(f"{Icon.DETECT} [Detection] {TextColor.GREEN}Detected {len(lines)} lines{TextColor.RESET} "
           f"for image {TextColor.YELLOW}{filename}{TextColor.RESET} with config {config}")
-    nodes = NodeGenerator(rects, lines).generate()
+    with stage('nodes'):
+        nodes = NodeGenerator(rects, lines).generate()
+    with stage('simplify_graph'):
+        nodes = GraphSimplifier(nodes, upscale_factor).simplify()
     print(f"{Icon.DETECT} [Detection] {TextColor.GREEN}Detected {len(nodes)} nodes{TextColor.RESET} "
           f"for image {TextColor.YELLOW}{filename}{TextColor.RESET} with config {config}")
 
@@ -81,20 +125,34 @@ def _process_single_config(filename: str, original_img: cv2.typing.MatLike, gray
 
     print(f"{Icon.DONE} [Process] Finished processing image {TextColor.YELLOW}{filename}{TextColor.RESET} "
           f"with config {config}")
-    return ProcessedImage(original_img, edge_img, label, rects, lines, nodes, upscale_factor)
+    return ProcessedImage(edge_img, label, rects, lines, nodes, upscale_factor, steps=config['steps'])
 
 
-def process_image(image_file: Tuple[cv2.typing.MatLike, str], configs) -> Tuple[str, List[ProcessedImage]]:
+def process_image(image_file: Tuple[ImageSource, str], configs, backend=PROCESS_BACKEND,
+                  scheduler: Optional[TaskScheduler] = None,
+                  deadline: Optional[float] = None) -> Tuple[str, List[ProcessedImage]]:
     """Process a single image with all configurations in parallel."""
-    original_img, filename = image_file
-    gray_img = cv2.cvtColor(original_img, cv2.COLOR_BGR2GRAY)
-
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        futures = [executor.submit(_process_single_config, filename, original_img, gray_img, config) for config in
-                   configs]
-        results = [future.result() for future in concurrent.futures.as_completed(futures)]
-
-    # Sort results based on the number of rectangles detected
-    results.sort(key=lambda x: x.num_rects, reverse=True)
-
-    return filename, results
+    for result in iter_processed_images([image_file], configs, backend, scheduler, deadline):
+        return result
+    raise RuntimeError(f"{Icon.ERROR} [Process] Failed processing image {image_file[1]}")
+
+
+def iter_processed_images(images_with_names: Iterable[Tuple[ImageSource, str]], configs, backend=PROCESS_BACKEND,
+                          scheduler: Optional[TaskScheduler] = None,
+                          deadline: Optional[float] = None,
+                          failed: Optional[Callable[[str], None]] = None) -> Iterator[Tuple[str, List[ProcessedImage]]]:
+    """Process a stream of images with all configurations in one shared pool, yielding each finished image.
+    Configs are shared by all images or picked per image, see TaskScheduler.run.
+    Past the `time.monotonic()` deadline images are yielded with the results available so far, see is_partial.
+    Images whose processing failed are not yielded, `failed` is called with their file name instead."""
+    scheduler = scheduler or TaskScheduler(backend=backend)
+    for filename, results in scheduler.run(_process_single_config, images_with_names, configs, deadline,
+                                           discard=ProcessedImage.release, failed=failed):
+        # Sort results based on the number of rectangles detected
+        results.sort(key=lambda x: x.num_rects, reverse=True)
+        yield filename, results
+
+
+def is_partial(results: List[ProcessedImage], configs) -> bool:
+    """Tell whether a deadline cut the processing of an image short, leaving results for only some configs."""
+    return len(results) < len(configs)
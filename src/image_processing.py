@@ -1,3 +1,6 @@
+import functools
+import threading
+
 import cv2
 import numpy as np
 
@@ -13,15 +16,34 @@ CLAHE_TILE_GRID_SIZE = (5, 5)
 BLUR_KERNEL_SIZE = (5, 5)
 THRESHOLD_MAX_VALUE = 255
 
+_thread_state = threading.local()
+
 
 def enhance_contrast(image: cv2.typing.MatLike) -> cv2.typing.MatLike:
     """Enhance contrast using multiple techniques."""
-    clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID_SIZE)
-    enhanced_image = clahe.apply(image)
+    enhanced_image = _get_clahe().apply(image)
     enhanced_image = cv2.equalizeHist(enhanced_image)
+    return cv2.LUT(enhanced_image, _get_gamma_table())
+
+
+def warm_up():
+    """Build the CLAHE object and gamma lookup table ahead of the first image."""
+    _get_clahe()
+    _get_gamma_table()
+
+
+def _get_clahe() -> cv2.CLAHE:
+    """Return this thread's CLAHE object; instances keep internal buffers and are not shared across threads."""
+    clahe = getattr(_thread_state, 'clahe', None)
+    if clahe is None:
+        clahe = _thread_state.clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID_SIZE)
+    return clahe
+
+
+@functools.lru_cache(maxsize=None)
+def _get_gamma_table() -> np.ndarray:
     inv_gamma = 1.0 / GAMMA
-    table = np.array([(i / 255.0) ** inv_gamma * 255 for i in np.arange(0, 256)]).astype("uint8")
-    return cv2.LUT(enhanced_image, table)
+    return np.array([(i / 255.0) ** inv_gamma * 255 for i in np.arange(0, 256)]).astype("uint8")
 
 
 def adaptive_threshold(image: cv2.typing.MatLike) -> cv2.typing.MatLike:
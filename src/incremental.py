@@ -0,0 +1,260 @@
+import math
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .geometry import Line, Node, Point, Rectangle, Shape
+from .graph_simplifier import GraphSimplifier
+from .image_processing import UPSCALE
+from .instrumentation import stage
+from .layout_io import Layout
+from .line_generator import LINE_DISCONTINUITY, LineGenerator
+from .node_generator import NodeGenerator
+from .rectangle_detection import AREA_FACTOR, RectangleDetector
+from .utils import Icon, TextColor
+
+TILE_SIZE = 128  # Pixels of the original image per fingerprinted tile
+FINGERPRINT_CELLS = 8  # Each tile is summarized by the mean intensity of an 8x8 grid of cells
+CHANGE_THRESHOLD = 16  # Intensity difference of a cell that marks its tile as changed, above scanner noise
+DEFAULT_MARGIN = 192  # Pixels around changed tiles reprocessed too, so shapes there see their neighbours
+MATCH_IOU = 0.5  # Overlap above which a shape detected again is taken to be the previous one
+FULL_REPROCESS_SHARE = 0.5  # Share of changed tiles beyond which processing the whole image is cheaper
+
+
+def tile_fingerprints(image: cv2.typing.MatLike, tile_size=TILE_SIZE) -> np.ndarray:
+    """Return a perceptual fingerprint of every tile of an image as a (rows, cols, 8, 8) uint8 array.
+    Cells are area averages, so specks and sensor grain barely move them while moved or added shapes do."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    height, width = gray.shape
+    rows, cols = math.ceil(height / tile_size), math.ceil(width / tile_size)
+    padded = cv2.copyMakeBorder(gray, 0, rows * tile_size - height, 0, cols * tile_size - width,
+                                cv2.BORDER_REPLICATE)
+    cells = cv2.resize(padded, (cols * FINGERPRINT_CELLS, rows * FINGERPRINT_CELLS), interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(
+        cells.reshape(rows, FINGERPRINT_CELLS, cols, FINGERPRINT_CELLS).transpose(0, 2, 1, 3))
+
+
+def changed_tiles(previous: np.ndarray, current: np.ndarray) -> np.ndarray:
+    """Return a (rows, cols) mask of the tiles whose fingerprints differ between two versions of an image.
+    Raises ValueError when the versions do not have the same tile grid."""
+    if previous.shape != current.shape:
+        raise ValueError(f"Revision has {current.shape[1]}x{current.shape[0]} tiles, the previous version "
+                         f"{previous.shape[1]}x{previous.shape[0]}")
+    difference = np.abs(previous.astype(np.int16) - current.astype(np.int16))
+    return difference.max(axis=(2, 3)) > CHANGE_THRESHOLD
+
+
+def changed_regions(changed: np.ndarray, image_shape: Tuple[int, ...], tile_size=TILE_SIZE,
+                    margin=DEFAULT_MARGIN) -> List[Tuple[int, int, int, int]]:
+    """Return (x, y, w, h) boxes of the original image covering groups of changed tiles plus a margin.
+    Overlapping boxes are merged, so every pixel is reprocessed at most once."""
+    height, width = image_shape[:2]
+    count, _, stats, _ = cv2.connectedComponentsWithStats(changed.astype(np.uint8), connectivity=8)
+    boxes = []
+    for col, row, cols, rows, _ in stats[1:count].tolist():
+        boxes.append((max(0, col * tile_size - margin), max(0, row * tile_size - margin),
+                      min(width, (col + cols) * tile_size + margin), min(height, (row + rows) * tile_size + margin)))
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [(x1, y1, x2 - x1, y2 - y1) for x1, y1, x2, y2 in boxes]
+
+
+def update_layout(layout: Layout, image: cv2.typing.MatLike, changed: np.ndarray, tile_size=TILE_SIZE,
+                  margin=DEFAULT_MARGIN) -> Tuple[List[Rectangle], List[Line], List[Node]]:
+    """Reprocess the changed tiles of a revised image and merge the results into the layout of its previous version.
+
+    Rectangles and lines are detected again only in the changed regions plus a margin, with the config the layout
+    was made with. Shapes away from changed tiles are kept as they were, shapes detected again where they were keep
+    their ids, and new ones get ids above the previous ones. Nodes are rebuilt from the merged geometry and keep
+    their ids where position and connection are unchanged."""
+    rects, lines, nodes = layout.to_shapes()
+    config = {'steps': layout.steps}
+    factor = 2 ** layout.steps.count(UPSCALE)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    height, width = gray.shape
+    min_area = round(width * height / AREA_FACTOR)  # Of the whole image, crops must not lower the bar
+    dirty = _DirtyTiles(changed, tile_size * factor)
+
+    replaced = [rect for rect in rects if dirty.touches(rect)]
+    kept_rects = [rect for rect in rects if not dirty.touches(rect)]
+    kept_lines = [line for line in lines if not dirty.touches(line)]
+    # Lines crossing changed tiles may run far beyond the regions, they are kept while the way stays clear
+    crossing_lines = [line for line in lines if dirty.touches(line)]
+    next_rect_id = max((rect.id for rect in rects), default=-1) + 1
+    next_line_id = max((line.id for line in lines), default=0) + 1
+    new_lines = []
+    for x, y, w, h in changed_regions(changed, gray.shape, tile_size, margin):
+        box = _inner_box((x * factor, y * factor, (x + w) * factor, (y + h) * factor),
+                         (width * factor, height * factor))
+        with stage('incremental_detection'):
+            detector = RectangleDetector(gray[y:y + h, x:x + w], image[y:y + h, x:x + w], config, min_area=min_area)
+            edge_img, found = detector.find_rectangles()
+        crossing_lines = [line for line in crossing_lines
+                          if _is_clear(line, edge_img, x * factor, y * factor, LINE_DISCONTINUITY * factor)]
+        found = [_translated(rect, x * factor, y * factor) for rect in found]
+        found = [rect for rect in _within_sizes(found, rects) if _is_inside(rect, box) and dirty.touches(rect)]
+        for rect in found:
+            previous = _best_match(rect, replaced)
+            if previous is not None:
+                replaced.remove(previous)
+                kept_rects.append(previous)
+            elif _best_match(rect, kept_rects) is None:
+                rect.id = next_rect_id
+                next_rect_id += 1
+                rect.set_cluster(_nearest_cluster(rect, kept_rects))
+                kept_rects.append(rect)
+        # Lines are generated between the rectangles of the region, only those crossing changed tiles are new
+        region_rects = [_translated(rect, -x * factor, -y * factor) for rect in kept_rects if _is_inside(rect, box)]
+        with stage('incremental_lines'):
+            region_lines = LineGenerator(edge_img, region_rects, factor).generate()
+        new_lines += [line for line in (_translated_line(line, x * factor, y * factor) for line in region_lines)
+                      if dirty.touches(line)]
+
+    # Lines found again are not duplicated
+    kept_lines = _drop_unanchored(kept_lines + crossing_lines, kept_rects, rects, lines)
+    for line in new_lines:
+        if not any(line == other or line.is_nested_within(other) for other in kept_lines):
+            line.id = next_line_id
+            next_line_id += 1
+            kept_lines.append(line)
+    with stage('incremental_nodes'):
+        new_nodes = GraphSimplifier(NodeGenerator(kept_rects, kept_lines).generate(), factor).simplify()
+    print(f"{Icon.DETECT} [Incremental] {TextColor.GREEN}Reprocessed {int(changed.sum())} of {changed.size} tiles"
+          f"{TextColor.RESET}, {len(replaced)} rectangles removed, {len(kept_rects) - len(rects) + len(replaced)} "
+          f"added")
+    return kept_rects, kept_lines, _renumber_nodes(new_nodes, nodes)
+
+
+class _DirtyTiles:
+    def __init__(self, changed: np.ndarray, tile_size: int):
+        """Initialize the lookup of changed tiles, tile_size in layout coordinates."""
+        self.changed = changed
+        self.tile_size = tile_size
+
+    def touches(self, shape: Shape) -> bool:
+        """Tell whether the bounds of a shape overlap any changed tile."""
+        x1, x2, y1, y2 = shape.bounds()
+        cols = sorted((x1 // self.tile_size, x2 // self.tile_size))
+        rows = sorted((y1 // self.tile_size, y2 // self.tile_size))
+        return bool(self.changed[max(0, rows[0]):rows[1] + 1, max(0, cols[0]):cols[1] + 1].any())
+
+
+def _inner_box(box: Tuple[int, int, int, int], size: Tuple[int, int]) -> Tuple[float, float, float, float]:
+    """Open the sides of a region lying on the image border; shapes there are not cut by the crop."""
+    x1, y1, x2, y2 = box
+    width, height = size
+    return (-math.inf if x1 == 0 else x1, -math.inf if y1 == 0 else y1,
+            math.inf if x2 == width else x2, math.inf if y2 == height else y2)
+
+
+def _is_inside(rect: Rectangle, box: Tuple[float, float, float, float]) -> bool:
+    """Tell whether a rectangle lies strictly inside a region, so the crop did not cut it."""
+    return box[0] < rect.x and box[1] < rect.y and rect.x + rect.w < box[2] and rect.y + rect.h < box[3]
+
+
+def _translated(rect: Rectangle, dx: int, dy: int) -> Rectangle:
+    moved = Rectangle(rect.x + dx, rect.y + dy, rect.w, rect.h)
+    moved.id = rect.id
+    moved.set_cluster(rect.cluster)
+    return moved
+
+
+def _translated_line(line: Line, dx: int, dy: int) -> Line:
+    return Line(Point(line.start.x + dx, line.start.y + dy), Point(line.end.x + dx, line.end.y + dy))
+
+
+def _within_sizes(found: List[Rectangle], rects: List[Rectangle]) -> List[Rectangle]:
+    """Drop found rectangles outside the size distribution of the whole layout.
+    A crop holds too few rectangles for the detector's own outlier removal to be meaningful."""
+    if len(rects) < 2:
+        return found
+    sizes = np.array([rect.size() for rect in rects])
+    low, high = sizes.mean() - 2 * sizes.std(), sizes.mean() + 2 * sizes.std()
+    return [rect for rect in found if low <= rect.size() <= high]
+
+
+def _iou(a: Rectangle, b: Rectangle) -> float:
+    overlap_w = min(a.x + a.w, b.x + b.w) - max(a.x, b.x)
+    overlap_h = min(a.y + a.h, b.y + b.h) - max(a.y, b.y)
+    if overlap_w <= 0 or overlap_h <= 0:
+        return 0.0
+    overlap = overlap_w * overlap_h
+    return overlap / (a.size() + b.size() - overlap)
+
+
+def _best_match(rect: Rectangle, candidates: List[Rectangle]) -> Optional[Rectangle]:
+    best = max(candidates, key=lambda other: _iou(rect, other), default=None)
+    return best if best is not None and _iou(rect, best) >= MATCH_IOU else None
+
+
+def _nearest_cluster(rect: Rectangle, rects: List[Rectangle]) -> int:
+    """Put a new rectangle into the cluster of the closest existing one."""
+    center = rect.center()
+    nearest = min(rects, key=lambda other: (other.center().x - center.x) ** 2 + (other.center().y - center.y) ** 2,
+                  default=None)
+    return 0 if nearest is None or nearest.cluster is None else nearest.cluster
+
+
+def _is_clear(line: Line, edge_img: cv2.typing.MatLike, dx: int, dy: int, trim: int) -> bool:
+    """Tell whether the part of a line inside a region crosses no edges, leaving out the outlines at its ends."""
+    (x1, y1), (x2, y2) = sorted(((line.start.x - dx, line.start.y - dy), (line.end.x - dx, line.end.y - dy)))
+    height, width = edge_img.shape[:2]
+    if x1 == x2:
+        if not 0 <= x1 < width:
+            return True
+        segment = edge_img[max(0, y1 + trim):max(0, min(height, y2 - trim + 1)), x1]
+    else:
+        if not 0 <= y1 < height:
+            return True
+        segment = edge_img[y1, max(0, x1 + trim):max(0, min(width, x2 - trim + 1))]
+    return not (segment == 255).any()
+
+
+def _is_anchored(point: Point, line: Line, rects: List[Rectangle], lines: List[Line]) -> bool:
+    """Tell whether a line end lies in a rectangle or on another line, as generated lines always start."""
+    return (any(rect.contains(point) for rect in rects) or
+            any(other is not line and other.is_point_on_line(point) for other in lines))
+
+
+def _drop_unanchored(lines: List[Line], rects: List[Rectangle], previous_rects: List[Rectangle],
+                     previous_lines: List[Line]) -> List[Line]:
+    """Drop lines whose ends lost the rectangle or line they were anchored at, until no more are dropped.
+    Lines anchored at a dropped line go with it."""
+    anchored = [line for line in lines if _is_anchored(line.start, line, previous_rects, previous_lines) and
+                _is_anchored(line.end, line, previous_rects, previous_lines)]
+    while True:
+        remaining = [line for line in lines if line not in anchored or (
+                _is_anchored(line.start, line, rects, lines) and _is_anchored(line.end, line, rects, lines))]
+        if len(remaining) == len(lines):
+            return lines
+        lines = remaining
+
+
+def _renumber_nodes(nodes: List[Node], previous: List[Node]) -> List[Node]:
+    """Give rebuilt nodes the ids of previous nodes at the same position with the same connection,
+    and the others ids above them, rewriting the links to match."""
+    previous_ids: Dict[Tuple[int, int, Optional[str]], int] = {
+        (node.pos.x, node.pos.y, node.connection): node.id for node in previous}
+    next_id = max(previous_ids.values(), default=0) + 1
+    id_map = {}
+    for node in sorted(nodes, key=lambda n: (n.pos.x, n.pos.y)):
+        node_id = previous_ids.get((node.pos.x, node.pos.y, node.connection))
+        if node_id is None:
+            node_id, next_id = next_id, next_id + 1
+        id_map[node.id] = node_id
+    for node in nodes:
+        node.id = id_map[node.id]
+        node.links = {id_map[other_id]: distance for other_id, distance in node.links.items()}
+    return nodes
@@ -0,0 +1,133 @@
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, peak RSS is reported as unknown there
+    resource = None
+
+# ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+STATM_FILE = '/proc/self/statm'  # Current memory of the process in pages, Linux only
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+TRACE_FILE = 'trace.json'
+
+
+class StageRecord:
+    def __init__(self, name: str, tags: Dict[str, str], start: float, wall: float, cpu: float,
+                 rss_delta: Optional[int], pid: int, thread_id: int):
+        """Timings of one stage run: wall and CPU seconds, and the change of the process RSS in bytes over it.
+        Stages running concurrently in one process share its RSS, so their deltas include each other's."""
+        self.name = name
+        self.tags = tags
+        self.start = start
+        self.wall = wall
+        self.cpu = cpu
+        self.rss_delta = rss_delta
+        self.pid = pid
+        self.thread_id = thread_id
+
+    def __repr__(self):
+        return f"StageRecord({self.name}, wall={self.wall * 1000:.1f} ms, cpu={self.cpu * 1000:.1f} ms, {self.tags})"
+
+
+class Recorder:
+    def __init__(self, **tags: str):
+        """Collect stage records, adding the given tags (such as image and config) to each of them."""
+        self.tags = tags
+        self.records: List[StageRecord] = []
+        self.lock = threading.Lock()
+
+    def add(self, record: StageRecord):
+        with self.lock:
+            self.records.append(record)
+
+    def extend(self, records: Iterable[StageRecord]):
+        with self.lock:
+            self.records.extend(records)
+
+
+_current_recorder: contextvars.ContextVar[Optional[Recorder]] = contextvars.ContextVar('recorder', default=None)
+
+
+@contextlib.contextmanager
+def recording(recorder: Recorder) -> Iterator[Recorder]:
+    """Send the stages run in the current context to the recorder."""
+    token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_recorder.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name: str, **tags: str) -> Iterator[None]:
+    """Measure a stage for the active recorder; without one this costs a single context variable lookup."""
+    recorder = _current_recorder.get()
+    if recorder is None:
+        yield
+        return
+    start = time.time()
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()  # Per thread, so concurrent tasks in one process are not mixed up
+    rss_start = current_rss()
+    try:
+        yield
+    finally:
+        rss_end = current_rss()
+        rss_delta = None if rss_start is None or rss_end is None else rss_end - rss_start
+        recorder.add(StageRecord(name, {**recorder.tags, **tags}, start, time.perf_counter() - wall_start,
+                                 time.thread_time() - cpu_start, rss_delta, os.getpid(), threading.get_ident()))
+
+
+def current_rss() -> Optional[int]:
+    """Return the current resident set size of this process in bytes, or None where it cannot be measured."""
+    try:
+        with open(STATM_FILE) as file:
+            return int(file.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss() -> Optional[int]:
+    """Return the peak resident set size over the lifetime of this process in bytes, or None where it cannot be
+    measured. It never goes down, so it describes whole runs rather than single stages, see current_rss."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+
+
+def export_chrome_trace(records: Iterable[StageRecord], target_file_name: str):
+    """Write the records as Chrome trace events, viewable in chrome://tracing or Perfetto."""
+    events = []
+    for record in records:
+        args = {**record.tags, 'cpu_ms': round(record.cpu * 1000, 3)}
+        if record.rss_delta is not None:
+            args['rss_delta_mb'] = round(record.rss_delta / 1024 ** 2, 1)
+        events.append({'name': record.name, 'cat': 'stage', 'ph': 'X', 'ts': record.start * 1e6,
+                       'dur': record.wall * 1e6, 'pid': record.pid, 'tid': record.thread_id, 'args': args})
+    with open(target_file_name, 'w') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+def summarize(records: Iterable[StageRecord]) -> str:
+    """Format a table of count, total and mean wall time, CPU time and the largest RSS growth per stage."""
+    stages: Dict[str, List[StageRecord]] = {}
+    for record in records:
+        stages.setdefault(record.name, []).append(record)
+    header = f"{'Stage':<24} {'Count':>6} {'Wall (s)':>10} {'Mean (ms)':>10} {'CPU (s)':>10} {'RSS +max (MB)':>14}"
+    rows = [header, '-' * len(header)]
+    for name, stage_records in sorted(stages.items(), key=lambda item: -sum(r.wall for r in item[1])):
+        wall = sum(record.wall for record in stage_records)
+        cpu = sum(record.cpu for record in stage_records)
+        rss = [record.rss_delta for record in stage_records if record.rss_delta is not None]
+        growth = f"{max(rss) / 1024 ** 2:.1f}" if rss else '-'
+        rows.append(f"{name:<24} {len(stage_records):>6} {wall:>10.3f} {wall / len(stage_records) * 1000:>10.1f} "
+                    f"{cpu:>10.3f} {growth:>14}")
+    return '\n'.join(rows)
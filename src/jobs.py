@@ -0,0 +1,115 @@
+import concurrent.futures
+import threading
+import time
+import traceback
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from .admission import RequestCost
+from .utils import Icon, TextColor
+
+# Job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+#
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_MAX_QUEUED_JOBS = 64
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Job:
+    def __init__(self, filename: str, data: Optional[bytes], output_dir: str, job_id: Optional[str] = None,
+                 cost: Optional[RequestCost] = None, deadline: Optional[float] = None,
+                 base_layout_id: Optional[str] = None):
+        """Initialize a processing job for an upload held in memory, its output directory and estimated cost.
+        Past the `time.monotonic()` deadline the job settles for the best result found so far.
+        Revisions of a processed layout name it as their base, only what changed since it is reprocessed."""
+        self.id = job_id or str(uuid.uuid4())
+        self.filename = filename
+        self.cost = cost
+        self.deadline = deadline
+        self.base_layout_id = base_layout_id
+        self.data = data  # Dropped by the worker once decoded, finished jobs stay around for status queries
+        self.output_dir = output_dir
+        self.status = JOB_QUEUED
+        self.error = None
+        self.result: dict = {}  # Result name -> file name inside output_dir, and whether it is partial
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def is_finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    def to_dict(self) -> dict:
+        """Return a JSON-serializable status report."""
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobQueue:
+    def __init__(self, worker: Callable[[Job], dict], max_workers=DEFAULT_JOB_WORKERS,
+                 max_queued=DEFAULT_MAX_QUEUED_JOBS):
+        """Initialize a bounded queue running jobs on a fixed pool of worker threads."""
+        self.worker = worker
+        self.max_queued = max_queued
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                              thread_name_prefix='job-worker')
+        self.jobs: Dict[str, Job] = {}
+        self.lock = threading.Lock()
+
+    def submit(self, job: Job) -> Job:
+        """Queue a job and return it, or return the in-progress job with the same id instead of queueing a duplicate.
+        Raises QueueFullError when too many jobs are waiting or running."""
+        with self.lock:
+            existing = self.jobs.get(job.id)
+            if existing is not None and not existing.is_finished():
+                return existing
+            if len(self.active_jobs()) >= self.max_queued:
+                raise QueueFullError(f"Job queue is full ({self.max_queued} jobs)")
+            self.jobs[job.id] = job
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def active_jobs(self) -> List[Job]:
+        return [job for job in list(self.jobs.values()) if not job.is_finished()]
+
+    def prune(self, max_age: float):
+        """Forget finished jobs older than max_age seconds."""
+        cutoff = time.time() - max_age
+        with self.lock:
+            for job_id in [job.id for job in self.jobs.values() if job.is_finished() and job.finished_at < cutoff]:
+                del self.jobs[job_id]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Job):
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        print(f"{Icon.START} [Job] Started job {TextColor.YELLOW}{job.id}{TextColor.RESET} ...")
+        try:
+            job.result = self.worker(job)
+            job.status = JOB_DONE
+            print(f"{Icon.DONE} [Job] Finished job {TextColor.YELLOW}{job.id}{TextColor.RESET}")
+        except Exception as e:
+            job.error = str(e)
+            job.status = JOB_FAILED
+            print(f"{Icon.ERROR} [Job] Failed job {TextColor.YELLOW}{job.id}{TextColor.RESET}. Error: {e}")
+            traceback.print_exc()
+        finally:
+            job.finished_at = time.time()
@@ -0,0 +1,122 @@
+import os
+import tempfile
+from typing import BinaryIO, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .geometry import Line, Node, Point, Rectangle
+
+LAYOUT_FORMAT = 'layroad-layout'
+LAYOUT_FORMAT_VERSION = 1
+LAYOUT_EXTENSION = '.npz'
+NO_CLUSTER = -1
+NO_CONNECTION = -1
+RECTANGLE_PREFIX = 'R'
+
+
+class Layout:
+    def __init__(self, rects: np.ndarray, lines: np.ndarray, nodes: np.ndarray, node_connections: np.ndarray,
+                 edges: np.ndarray, edge_weights: np.ndarray, fingerprints: Optional[np.ndarray] = None,
+                 steps: Optional[List[str]] = None):
+        """Columnar view of a layout.
+
+        rects: (N, 6) int32 id, x, y, w, h, cluster; lines: (M, 5) int32 id, x1, y1, x2, y2;
+        nodes: (K, 3) int32 id, x, y; node_connections: (K,) int32 connected rectangle id;
+        edges: (E, 2) int32 node id pairs; edge_weights: (E,) float64 link distances.
+        Optional, for reprocessing revisions of the source image: fingerprints: (rows, cols, 8, 8) uint8 tile
+        fingerprints of the source image, see incremental.tile_fingerprints; steps: the config steps used."""
+        self.rects = rects
+        self.lines = lines
+        self.nodes = nodes
+        self.node_connections = node_connections
+        self.edges = edges
+        self.edge_weights = edge_weights
+        self.fingerprints = fingerprints
+        self.steps = steps
+
+    @classmethod
+    def from_shapes(cls, rects: List[Rectangle], lines: List[Line], nodes: List[Node],
+                    fingerprints: Optional[np.ndarray] = None, steps: Optional[List[str]] = None) -> 'Layout':
+        """Build the columnar view of detected geometry."""
+        rect_rows = [(rect.id, rect.x, rect.y, rect.w, rect.h, NO_CLUSTER if rect.cluster is None else rect.cluster)
+                     for rect in rects]
+        line_rows = [(line.id, line.start.x, line.start.y, line.end.x, line.end.y) for line in lines]
+        node_rows = [(node.id, node.pos.x, node.pos.y) for node in nodes]
+        connections = [_connected_rect_id(node.connection) for node in nodes]
+        node_ids = {node.id for node in nodes}
+        edges = {}
+        for node in nodes:
+            for other_id, distance in node.links.items():
+                if other_id in node_ids:
+                    edges.setdefault((min(node.id, other_id), max(node.id, other_id)), distance)
+        return cls(np.array(rect_rows, dtype=np.int32).reshape(-1, 6),
+                   np.array(line_rows, dtype=np.int32).reshape(-1, 5),
+                   np.array(node_rows, dtype=np.int32).reshape(-1, 3),
+                   np.array(connections, dtype=np.int32),
+                   np.array(list(edges.keys()), dtype=np.int32).reshape(-1, 2),
+                   np.array(list(edges.values()), dtype=np.float64), fingerprints, steps)
+
+    def to_shapes(self) -> Tuple[List[Rectangle], List[Line], List[Node]]:
+        """Rebuild geometry objects with their original ids, links and connections."""
+        rects = []
+        for rect_id, x, y, w, h, cluster in self.rects.tolist():
+            rect = Rectangle(x, y, w, h)
+            rect.id = rect_id
+            rect.set_cluster(None if cluster == NO_CLUSTER else cluster)
+            rects.append(rect)
+        lines = []
+        for line_id, x1, y1, x2, y2 in self.lines.tolist():
+            line = Line(Point(x1, y1), Point(x2, y2))
+            line.id = line_id
+            lines.append(line)
+        nodes = {}
+        for (node_id, x, y), connection in zip(self.nodes.tolist(), self.node_connections.tolist()):
+            node = Node(Point(x, y))
+            node.id = node_id
+            if connection != NO_CONNECTION:
+                node.connection = f"{RECTANGLE_PREFIX}{connection}"
+            nodes[node_id] = node
+        for (u, v), weight in zip(self.edges.tolist(), self.edge_weights.tolist()):
+            nodes[u].links[v] = weight
+            nodes[v].links[u] = weight
+        return rects, lines, list(nodes.values())
+
+    def save(self, target: Union[str, BinaryIO]):
+        """Write the layout as an uncompressed .npz; paths are replaced atomically."""
+        arrays = dict(format=np.array(LAYOUT_FORMAT), version=np.array(LAYOUT_FORMAT_VERSION), rects=self.rects,
+                      lines=self.lines, nodes=self.nodes, node_connections=self.node_connections, edges=self.edges,
+                      edge_weights=self.edge_weights)
+        if self.fingerprints is not None:
+            arrays['fingerprints'] = self.fingerprints
+        if self.steps is not None:
+            arrays['steps'] = np.array(self.steps, dtype=str)
+        if not isinstance(target, str):
+            np.savez(target, **arrays)
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                np.savez(file, **arrays)
+            os.replace(tmp_path, target)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, source: Union[str, BinaryIO]) -> 'Layout':
+        """Read a layout written by save, rejecting unknown formats and newer versions."""
+        with np.load(source, allow_pickle=False) as data:
+            if 'format' not in data or str(data['format']) != LAYOUT_FORMAT:
+                raise ValueError("Not a layout file")
+            version = int(data['version'])
+            if version > LAYOUT_FORMAT_VERSION:
+                raise ValueError(f"Unsupported layout version {version}, expected <= {LAYOUT_FORMAT_VERSION}")
+            return cls(data['rects'], data['lines'], data['nodes'], data['node_connections'], data['edges'],
+                       data['edge_weights'], data['fingerprints'] if 'fingerprints' in data else None,
+                       data['steps'].tolist() if 'steps' in data else None)
+
+
+def _connected_rect_id(connection: str) -> int:
+    if connection and connection.startswith(RECTANGLE_PREFIX):
+        return int(connection[len(RECTANGLE_PREFIX):])
+    return NO_CONNECTION
@@ -0,0 +1,164 @@
+import bisect
+import math
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+class Registry:
+    def __init__(self):
+        """Initialize a collection of metrics rendered together in the Prometheus text format."""
+        self.metrics: List['_Metric'] = []
+        self.lock = threading.Lock()
+
+    def register(self, metric: '_Metric'):
+        with self.lock:
+            if any(existing.name == metric.name for existing in self.metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics.append(metric)
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric(ABC):
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format(self, suffix: str, key: LabelValues, value: float, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        labels = ','.join(f'{name}="{_escape(label)}"' for name, label in pairs)
+        return f"{self.name}{suffix}{{{labels}}} {_format_value(value)}" if labels else \
+            f"{self.name}{suffix} {_format_value(value)}"
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Return the sample lines of the metric in the Prometheus text format."""
+        pass
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=REGISTRY):
+        """Initialize a monotonically increasing count, exposed as `<name>_total` like every counter family."""
+        super().__init__(name if name.endswith('_total') else f'{name}_total', documentation, labelnames, registry)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount=1.0, **labels: str):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = dict(self.values)
+        return [self._format('', key, value) for key, value in sorted(values.items())]
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=REGISTRY):
+        """Initialize a value that can go up and down, either set directly or read from a function on render."""
+        super().__init__(name, documentation, labelnames, registry)
+        self.values: Dict[LabelValues, float] = {}
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1.0, **labels: str):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value of an unlabelled gauge from the function each time metrics are rendered."""
+        if self.labelnames:
+            raise ValueError("Only unlabelled gauges can be read from a function")
+        self.function = function
+
+    def samples(self) -> List[str]:
+        if self.function is not None:
+            return [self._format('', (), self.function())]
+        with self.lock:
+            values = dict(self.values)
+        return [self._format('', key, value) for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS,
+                 registry=REGISTRY):
+        """Initialize a distribution of observations counted into cumulative buckets."""
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[LabelValues, Tuple[List[int], float]] = {}  # Label values -> (bucket counts, sum)
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)  # Buckets are inclusive upper bounds
+        with self.lock:
+            counts, total = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(self._format('_bucket', key, cumulative, (('le', _format_value(bound)),)))
+            lines.append(self._format('_sum', key, total))
+            lines.append(self._format('_count', key, cumulative))
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
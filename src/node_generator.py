@@ -8,6 +8,7 @@ class NodeGenerator:
         self.rects = rects
         self.lines = lines
         self.nodes = set()
+        self.terminal_nodes = {}  # Rectangle id -> terminal node, shared by every line ending at the rectangle
 
     def generate(self):
         self._find_intersections()
@@ -43,19 +44,25 @@ class NodeGenerator:
         if not start_connected and line_nodes:
             for rect in self.rects:
                 if rect.contains(line.start):
-                    terminal_node = Node(rect.center())
+                    terminal_node = self._get_terminal_node(rect)
                     terminal_node.add_link(line_nodes[0])
-                    terminal_node.set_connection(rect)
                     line_nodes[0].add_link(terminal_node)
-                    self.nodes.add(terminal_node)
                     break
 
         if not end_connected and line_nodes:
             for rect in self.rects:
                 if rect.contains(line.end):
-                    terminal_node = Node(rect.center())
+                    terminal_node = self._get_terminal_node(rect)
                     terminal_node.add_link(line_nodes[-1])
-                    terminal_node.set_connection(rect)
                     line_nodes[-1].add_link(terminal_node)
-                    self.nodes.add(terminal_node)
                     break
+
+    def _get_terminal_node(self, rect: Rectangle) -> Node:
+        """Return the terminal node of a rectangle, creating it on first use."""
+        terminal_node = self.terminal_nodes.get(rect.id)
+        if terminal_node is None:
+            terminal_node = Node(rect.center())
+            terminal_node.set_connection(rect)
+            self.terminal_nodes[rect.id] = terminal_node
+            self.nodes.add(terminal_node)
+        return terminal_node
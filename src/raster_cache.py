@@ -0,0 +1,102 @@
+import functools
+import hashlib
+import os
+import tempfile
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from .utils import Icon, TextColor
+
+RASTER_CACHE_DIR = '.cache/rasters'
+RASTER_EXTENSION = '.png'
+DEFAULT_MAX_BYTES = 1024 ** 3
+PNG_COMPRESSION = 1  # Rendered pages are mostly blank, the fastest level already shrinks them tenfold
+HASH_CHUNK_SIZE = 1 << 20
+
+
+class RasterCache:
+    def __init__(self, directory: str = RASTER_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        """Initialize an on-disk cache of rendered page rasters, stored as lossless PNG and evicted least recently
+        used first once they take more than max_bytes."""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, file_path: str, page: int, dpi: int) -> str:
+        """Build the cache key of a rendered page from the file content hash, page and DPI."""
+        stat = os.stat(file_path)
+        return f"{file_content_hash(file_path, stat.st_size, stat.st_mtime_ns)}_p{page}_{dpi}"
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return the cached raster for the key and mark it as recently used, or None on a miss."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        # Unreadable entries are misses, they are rewritten on the next put
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            return None
+        try:
+            os.utime(path)
+        except OSError:  # Evicted while reading
+            pass
+        return image
+
+    def put(self, key: str, image: np.ndarray):
+        """Store a raster atomically so concurrent readers never see a partial file, then evict down to max_bytes."""
+        ok, encoded = cv2.imencode(RASTER_EXTENSION, image, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
+        if not ok:
+            raise ValueError(f"Cannot encode raster {key}")
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(encoded.tobytes())
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used rasters until under max_bytes.
+        Entries of older formats are never read again, so they are the first to go."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:  # Evicted by a concurrent put
+                continue
+            # Ordered by format, then by last use
+            entries.append((entry.name.endswith(RASTER_EXTENSION), stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total_bytes = sum(size for _, _, size, _ in entries)
+        evicted = 0
+        for _, _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= size
+            evicted += 1
+        if evicted:
+            print(f"{Icon.DONE} [Cache] Evicted {evicted} rasters, "
+                  f"{TextColor.CYAN}{total_bytes / 1024 ** 2:.1f} MB{TextColor.RESET} in use")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{RASTER_EXTENSION}")
+
+
+@functools.lru_cache(maxsize=256)
+def file_content_hash(file_path: str, size: int, mtime_ns: int) -> str:
+    """Return the SHA-256 of a file; size and mtime only invalidate the memoized value."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional, Tuple
 
 import cv2
 import numpy as np
@@ -7,6 +7,7 @@ from .clustering import cluster_rectangles
 from .geometry import Rectangle
 from .image_processing import ENHANCE_CONTRAST, BLUR, THRESHOLD, UPSCALE, enhance_contrast, blur, adaptive_threshold, \
     upscale
+from .instrumentation import stage
 
 # Constants
 AREA_FACTOR = 9600
@@ -14,45 +15,57 @@ CONTOUR_APPROX_EPSILON = 0.01
 
 
 class RectangleDetector:
-    def __init__(self, gray_img: cv2.typing.MatLike, original_img: cv2.typing.MatLike, config):
-        """Initialize the RectangleDetector class."""
+    def __init__(self, gray_img: cv2.typing.MatLike, original_img: cv2.typing.MatLike, config,
+                 min_area: Optional[int] = None):
+        """Initialize the RectangleDetector class.
+        The minimum rectangle area defaults to a share of the image; crops of a larger plan pass the plan's own."""
         self.gray_img = gray_img
         self.original_img = original_img
         self.edge_img = None
         self.config = config
         self.upscale_factor = 1
         height, width = self.original_img.shape[:2]
-        self.min_area = round(width * height / AREA_FACTOR)
+        self.min_area = round(width * height / AREA_FACTOR) if min_area is None else min_area
         self.cluster_mode = 'distance'
 
     def detect(self):
         """Process the image to detect and cluster rectangles."""
-        processed_img = self._apply_steps()
-        self.edge_img = self._detect_edges(processed_img)
-        rects = self._find_rects(self.edge_img)
-        rects = self._remove_outliers(rects)
-        rects = self._remove_nested_rectangles(rects)
-        if len(rects) > 1:
-            rects = cluster_rectangles(rects, self.cluster_mode)
-        else:
-            for rect in rects:
-                rect.set_cluster(0)
+        _, rects = self.find_rectangles()
+        with stage('clustering'):
+            if len(rects) > 1:
+                rects = cluster_rectangles(rects, self.cluster_mode)
+            else:
+                for rect in rects:
+                    rect.set_cluster(0)
         rects = self.renumber_rectangles(rects)
         return self.edge_img, rects, self.upscale_factor
 
+    def find_rectangles(self) -> Tuple[cv2.typing.MatLike, List[Rectangle]]:
+        """Process the image and return its edge image and the filtered rectangles, not yet clustered or numbered."""
+        processed_img = self._apply_steps()
+        with stage('edge_detection'):
+            self.edge_img = self._detect_edges(processed_img)
+        with stage('contours'):
+            rects = self._find_rects(self.edge_img)
+        with stage('filter_rects'):
+            rects = self._remove_outliers(rects)
+            rects = self._remove_nested_rectangles(rects)
+        return self.edge_img, rects
+
     def _apply_steps(self):
         """Apply configured processing steps to the grayscale image."""
         img = self.gray_img
         for step in self.config['steps']:
-            if step == ENHANCE_CONTRAST:
-                img = enhance_contrast(img)
-            elif step == BLUR:
-                img = blur(img, self.config.get('blur_kernel_size', (5, 5)))
-            elif step == THRESHOLD:
-                img = adaptive_threshold(img)
-            elif step == UPSCALE:
-                img = upscale(img, 2)
-                self.upscale_factor *= 2
+            with stage(f'preprocess:{step}'):
+                if step == ENHANCE_CONTRAST:
+                    img = enhance_contrast(img)
+                elif step == BLUR:
+                    img = blur(img, self.config.get('blur_kernel_size', (5, 5)))
+                elif step == THRESHOLD:
+                    img = adaptive_threshold(img)
+                elif step == UPSCALE:
+                    img = upscale(img, 2)
+                    self.upscale_factor *= 2
         return img
 
     @staticmethod
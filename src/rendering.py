@@ -0,0 +1,125 @@
+from typing import List
+
+import cv2
+import numpy as np
+
+from .geometry import Line, Node, Rectangle
+
+# Renderers
+NATIVE_RENDERER = 'native'
+MATPLOTLIB_RENDERER = 'matplotlib'
+RENDERERS = (NATIVE_RENDERER, MATPLOTLIB_RENDERER)
+#
+COLOR_RECTANGLE = (255, 49, 49)  # Colors are RGB, overlays are converted to BGR only when encoded
+COLOR_LINE = (170, 255, 0)
+COLOR_TEXT = (0, 0, 0)
+COLOR_BACKGROUND = (255, 255, 255)
+FILL_THICKNESS = -1
+LINE_THICKNESS = 3
+TRAVEL_NODE_COLOR = (255, 255, 255)
+TRAVEL_NODE_RADIUS = 15
+TERMINAL_NODE_COLOR = (0, 150, 255)
+TERMINAL_NODE_RADIUS = 45
+#
+DEFAULT_TILE_SIZE = 1600  # Longest side of a single result tile in the output grid
+TILE_PADDING = 24
+LABEL_FONT = cv2.FONT_HERSHEY_SIMPLEX
+LABEL_FONT_SCALE_PER_PIXEL = 0.0006
+MIN_ID_FONT_SCALE = 0.25  # Rectangle ids smaller than this are unreadable and skipped
+PNG_COMPRESSION = 1  # Fastest zlib level, edge overlays are mostly flat and compress well anyway
+JPEG_QUALITY = 90
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+
+def render_result_grid(results: list, max_images: int, tile_size=DEFAULT_TILE_SIZE) -> np.ndarray:
+    """Compose overlays of the top results into a labelled grid, returned as an RGB image."""
+    filtered_results = results[:max_images]
+    num_cols = int(np.ceil(np.sqrt(max_images)))
+    num_rows = int(np.ceil(len(filtered_results) / num_cols))
+    tiles = [_render_tile(result.edge_img, result.rects, result.lines, result.nodes, tile_size)
+             for result in filtered_results]
+    labels = [_label_lines(result.label) for result in filtered_results]
+
+    font_scale = max(tile_size * LABEL_FONT_SCALE_PER_PIXEL, 0.4)
+    font_thickness = max(1, round(font_scale * 2))
+    line_height = cv2.getTextSize('Ag', LABEL_FONT, font_scale, font_thickness)[0][1] * 2
+    label_height = line_height * max(len(lines) for lines in labels) + TILE_PADDING
+    cell_width = max(tile.shape[1] for tile in tiles) + TILE_PADDING
+    cell_height = max(tile.shape[0] for tile in tiles) + label_height + TILE_PADDING
+
+    canvas = np.full((num_rows * cell_height, num_cols * cell_width, 3), COLOR_BACKGROUND, dtype=np.uint8)
+    for i, (tile, lines) in enumerate(zip(tiles, labels)):
+        top = (i // num_cols) * cell_height + TILE_PADDING // 2
+        left = (i % num_cols) * cell_width + TILE_PADDING // 2
+        for j, text in enumerate(lines):
+            cv2.putText(canvas, text, (left, top + line_height * (j + 1)), LABEL_FONT, font_scale, COLOR_TEXT,
+                        font_thickness, lineType=cv2.LINE_AA)
+        top += label_height
+        canvas[top:top + tile.shape[0], left:left + tile.shape[1]] = tile
+    return canvas
+
+
+def _render_tile(edge_img: cv2.typing.MatLike, rects: List[Rectangle], lines: List[Line], nodes: List[Node],
+                 tile_size: int) -> np.ndarray:
+    """Downsample an edge image to the tile size first, then draw the scaled geometry on top of it."""
+    height, width = edge_img.shape[:2]
+    scale = min(1.0, tile_size / max(height, width))
+    if scale < 1.0:
+        tile_dims = (max(1, round(width * scale)), max(1, round(height * scale)))
+        edge_img = cv2.resize(edge_img, tile_dims, interpolation=cv2.INTER_AREA)
+    overlay = cv2.cvtColor(edge_img, cv2.COLOR_GRAY2RGB) if edge_img.ndim == 2 else edge_img.copy()
+    return draw_objects(overlay, rects, lines, nodes, scale)
+
+
+def draw_objects(overlay: cv2.typing.MatLike, rects: List[Rectangle], lines: List[Line], nodes: List[Node],
+                 scale=1.0) -> cv2.typing.MatLike:
+    """Draw rectangles and lines on the image, with geometry coordinates multiplied by scale."""
+    thickness = max(1, round(LINE_THICKNESS * min(1.0, scale * 4)))
+
+    def point(x, y):
+        return round(x * scale), round(y * scale)
+
+    for rect in rects:
+        # draw rectangle
+        cv2.rectangle(overlay, point(rect.x, rect.y), point(rect.x + rect.w, rect.y + rect.h), COLOR_RECTANGLE,
+                      thickness)
+        # draw text in the center of rectangle
+        text = str(rect.id)
+        # Calculate font scale based on rectangle dimensions
+        font_scale = min(rect.w, rect.h) * scale / 75  # sweet spot
+        if font_scale < MIN_ID_FONT_SCALE:
+            continue
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        text_size = cv2.getTextSize(text, font, font_scale, thickness)[0]
+        center_x, center_y = point(rect.x + rect.w // 2, rect.y + rect.h // 2)
+        text_x = center_x - text_size[0] // 2
+        text_y = center_y + text_size[1] // 2
+        # Write index number at the center of the rectangle
+        cv2.putText(overlay, text, (text_x, text_y), font, font_scale, COLOR_TEXT, thickness, lineType=cv2.LINE_AA)
+    #
+    for line in lines:
+        cv2.line(overlay, point(line.start.x, line.start.y), point(line.end.x, line.end.y), COLOR_LINE, thickness)
+    #
+    for node in nodes:
+        color = TRAVEL_NODE_COLOR if not node.connection else TERMINAL_NODE_COLOR
+        radius = TRAVEL_NODE_RADIUS if not node.connection else TERMINAL_NODE_RADIUS
+        cv2.circle(overlay, point(node.pos.x, node.pos.y), max(1, round(radius * scale)), color, FILL_THICKNESS)
+    return overlay
+
+
+def _label_lines(label: str) -> List[str]:
+    """Split a result label into lines the Hershey fonts can draw."""
+    return label.replace('²', '^2').encode('ascii', 'replace').decode('ascii').split('\n')
+
+
+def encode_image(image: np.ndarray, extension: str) -> bytes:
+    """Encode an RGB image as PNG or JPEG using fast encoder settings."""
+    bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    if extension.lower() in JPEG_EXTENSIONS:
+        params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    success, buffer = cv2.imencode(extension, bgr, params)
+    if not success:
+        raise RuntimeError(f"Failed to encode image as {extension}")
+    return buffer.tobytes()
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from .utils import Icon, TextColor
+
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+MANIFEST_FILE = 'result.json'
+STAGING_DIR = '.staging'
+
+
+class ResultCache:
+    def __init__(self, root: str, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        """Initialize a content-addressed store of processing results with size- and age-based eviction."""
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(os.path.join(root, STAGING_DIR), exist_ok=True)
+
+    @staticmethod
+    def key(data: bytes, configs: List[dict], version: str) -> str:
+        """Build the cache key from the uploaded bytes, the config list and the pipeline version."""
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps(configs, sort_keys=True).encode())
+        digest.update(version.encode())
+        return digest.hexdigest()
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        """Return the result file names of a cached entry and mark it as recently used, or None on a miss."""
+        manifest_path = os.path.join(self.entry_dir(key), MANIFEST_FILE)
+        try:
+            with open(manifest_path) as file:
+                result = json.load(file)
+            os.utime(manifest_path)
+        except (OSError, ValueError):
+            return None
+        return result
+
+    def staging_dir(self) -> str:
+        """Create a private directory to write results into before they are committed."""
+        path = os.path.join(self.root, STAGING_DIR, str(uuid.uuid4()))
+        os.makedirs(path)
+        return path
+
+    def store(self, key: str, files: Dict[str, bytes], result: Dict[str, str]):
+        """Write in-memory result files and publish them under the key in one step."""
+        staging_dir = self.staging_dir()
+        try:
+            for filename, data in files.items():
+                with open(os.path.join(staging_dir, filename), 'wb') as file:
+                    file.write(data)
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        self.commit(key, staging_dir, result)
+
+    def commit(self, key: str, staging_dir: str, result: Dict[str, str]):
+        """Publish a staged result under its key; readers never see a partially written entry."""
+        with open(os.path.join(staging_dir, MANIFEST_FILE), 'w') as file:
+            json.dump(result, file)
+        try:
+            os.replace(staging_dir, self.entry_dir(key))
+        except OSError:  # Another writer committed the same content first
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def disk_usage(self) -> int:
+        """Return the bytes used by committed entries and staging folders."""
+        total = 0
+        for root in (self.root, os.path.join(self.root, STAGING_DIR)):
+            for entry in os.scandir(root):
+                if entry.is_dir() and entry.name != STAGING_DIR:
+                    try:
+                        total += _directory_size(entry.path)
+                    except OSError:  # Evicted or committed while scanning
+                        pass
+        return total
+
+    def evict(self):
+        """Remove entries older than max_age, then least recently used entries until under max_bytes."""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                last_used = os.path.getmtime(os.path.join(path, MANIFEST_FILE))
+            except OSError:
+                last_used = os.path.getmtime(path)
+            entries.append((last_used, _directory_size(path), path))
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        evicted = 0
+        for last_used, size, path in entries:
+            if now - last_used <= self.max_age and total_bytes <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total_bytes -= size
+            evicted += 1
+        # Staging folders left behind by crashed jobs
+        staging_root = os.path.join(self.root, STAGING_DIR)
+        for name in os.listdir(staging_root):
+            path = os.path.join(staging_root, name)
+            if now - os.path.getmtime(path) > self.max_age:
+                shutil.rmtree(path, ignore_errors=True)
+        print(f"{Icon.DONE} [Cache] Evicted {evicted} entries, "
+              f"{TextColor.CYAN}{total_bytes / 1024 ** 2:.1f} MB{TextColor.RESET} in use")
+
+
+def _directory_size(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
@@ -0,0 +1,304 @@
+import heapq
+import itertools
+from typing import BinaryIO, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from .geometry import Node, Rectangle
+from .layout_io import NO_CONNECTION, RECTANGLE_PREFIX, Layout
+
+NO_PREDECESSOR = -1
+DISTANCE_EPSILON = 1e-9
+EXACT_TOUR_MAX_STOPS = 7  # Stops besides the start, up to 5040 permutations are checked at once
+ROUTING_FORMAT = 'layroad-routing'
+ROUTING_EXTENSION = '.routing.npz'
+
+Edge = Tuple[int, int]
+
+
+class RoutingGraph:
+    def __init__(self, nodes: List[Node]):
+        """Initialize the routing graph from generated nodes and their links."""
+        node_ids = {node.id for node in nodes}
+        edges = [(node.id, other_id, distance) for node in nodes for other_id, distance in node.links.items()
+                 if other_id in node_ids]
+        self._initialize([node.id for node in nodes], [(node.pos.x, node.pos.y) for node in nodes],
+                         [node.connection for node in nodes], edges)
+
+    @classmethod
+    def from_layout(cls, layout: Layout) -> 'RoutingGraph':
+        """Initialize the routing graph straight from a loaded layout's arrays."""
+        graph = cls.__new__(cls)
+        connections = [None if rect_id == NO_CONNECTION else f"{RECTANGLE_PREFIX}{rect_id}"
+                       for rect_id in layout.node_connections.tolist()]
+        edges = [(u, v, weight) for (u, v), weight in zip(layout.edges.tolist(), layout.edge_weights.tolist())]
+        graph._initialize(layout.nodes[:, 0].tolist(), layout.nodes[:, 1:3], connections, edges)
+        return graph
+
+    def _initialize(self, node_ids: List[int], positions, connections: List[Optional[str]],
+                    edges: List[Tuple[int, int, float]]):
+        self.node_ids = node_ids
+        self.index = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.positions = np.array(positions, dtype=np.int64).reshape(-1, 2)
+        self.terminals: Dict[str, List[int]] = {}  # Connected shape identifier -> terminal node indices
+        for i, connection in enumerate(connections):
+            if connection:
+                self.terminals.setdefault(connection, []).append(i)
+        self.adjacency: List[Dict[int, float]] = [{} for _ in node_ids]
+        for from_id, to_id, distance in edges:
+            i, j = self.index[from_id], self.index[to_id]
+            if i != j:
+                self.adjacency[i][j] = distance
+                self.adjacency[j][i] = distance
+        self.obstacles: Dict[int, Tuple[Rectangle, List[Tuple[int, int, float]]]] = {}
+        self.dist = None
+        self.pred = None
+        self.expansions = 0  # Nodes settled by Dijkstra so far, a machine independent measure of routing work
+
+    def build(self) -> 'RoutingGraph':
+        """Compute the all-pairs distance and predecessor matrices from scratch."""
+        n = len(self.node_ids)
+        self.dist = np.full((n, n), np.inf)
+        self.pred = np.full((n, n), NO_PREDECESSOR, dtype=np.int32)
+        for source in range(n):
+            self._run_dijkstra(source)
+        return self
+
+    def save_tables(self, target: Union[str, BinaryIO]):
+        """Write the built distance and predecessor matrices as an uncompressed .npz, with the node ids they index."""
+        np.savez(target, format=np.array(ROUTING_FORMAT), node_ids=np.array(self.node_ids, dtype=np.int32),
+                 dist=self.dist, pred=self.pred)
+
+    def load_tables(self, source: Union[str, BinaryIO]) -> 'RoutingGraph':
+        """Take the matrices written by save_tables for the same nodes instead of building them.
+        Raises ValueError for other files."""
+        with np.load(source, allow_pickle=False) as data:
+            if ('format' not in data or str(data['format']) != ROUTING_FORMAT or
+                    data['node_ids'].tolist() != self.node_ids):
+                raise ValueError("Routing tables of another graph")
+            self.dist, self.pred = data['dist'], data['pred']
+        return self
+
+    def distance(self, from_id: int, to_id: int) -> float:
+        """Return the shortest distance between two nodes."""
+        return float(self.dist[self.index[from_id], self.index[to_id]])
+
+    def path(self, from_id: int, to_id: int) -> List[int]:
+        """Return the node ids on the shortest path between two nodes, or an empty list if unreachable."""
+        source, target = self.index[from_id], self.index[to_id]
+        if not np.isfinite(self.dist[source, target]):
+            return []
+        path = [target]
+        while path[-1] != source:
+            path.append(int(self.pred[source, path[-1]]))
+        return [self.node_ids[i] for i in reversed(path)]
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the matrices and positions."""
+        return sum(array.nbytes for array in (self.dist, self.pred, self.positions) if array is not None)
+
+    def terminal_node(self, rect_id: int) -> int:
+        """Return the id of the node connecting a rectangle to the travel network."""
+        indices = self.terminals.get(f"{RECTANGLE_PREFIX}{rect_id}")
+        if not indices:
+            raise KeyError(f"Rectangle {rect_id} has no terminal node")
+        return self.node_ids[indices[0]]
+
+    def route(self, rect_ids: List[int]) -> Tuple[List[int], float, List[int]]:
+        """Plan the shortest closed tour visiting the rectangles, starting and ending at the first one.
+        Returns the visiting order of rectangle ids, the tour length and the node ids along the tour;
+        the length is infinite when some rectangle is unreachable."""
+        rect_ids = list(dict.fromkeys(rect_ids))
+        node_ids = [self.terminal_node(rect_id) for rect_id in rect_ids]
+        indices = [self.index[node_id] for node_id in node_ids]
+        distances = self.dist[np.ix_(indices, indices)]
+        if not np.isfinite(distances).all():
+            return [], float('inf'), []
+        tour, length = solve_tour(distances)
+        path = [node_ids[0]]
+        for a, b in zip(tour, tour[1:]):
+            path.extend(self.path(node_ids[a], node_ids[b])[1:])
+        return [rect_ids[i] for i in tour], length, path
+
+    def add_edge(self, from_id: int, to_id: int, weight: Optional[float] = None):
+        """Add or shorten an edge and repair the affected matrix entries.
+        An edge blocked by an obstacle is added at once and no longer restored with the obstacle's removal."""
+        u, v = self.index[from_id], self.index[to_id]
+        if u == v:
+            return
+        self._unblock(u, v)
+        if weight is None:
+            weight = float(np.abs(self.positions[u] - self.positions[v]).sum())
+        current = self.adjacency[u].get(v)
+        if current is not None and current <= weight:
+            if current < weight:  # Lengthening is a removal followed by a cheaper insertion
+                self._remove_edges([(u, v)])
+                self._insert_edge(u, v, weight)
+            return
+        self._insert_edge(u, v, weight)
+
+    def remove_edge(self, from_id: int, to_id: int):
+        """Remove an edge and repair the affected matrix entries; an edge blocked by an obstacle stays removed."""
+        u, v = self.index[from_id], self.index[to_id]
+        self._unblock(u, v)
+        if v in self.adjacency[u]:
+            self._remove_edges([(u, v)])
+
+    def add_obstacle(self, rect: Rectangle) -> int:
+        """Block every edge crossing the rectangle and return the number of blocked edges."""
+        if rect.id in self.obstacles:
+            return 0
+        blocked = [(u, v, w) for u, v, w in self._edges() if _segment_intersects_rect(
+            self.positions[u], self.positions[v], rect)]
+        self.obstacles[rect.id] = (rect, blocked)
+        self._remove_edges([(u, v) for u, v, _ in blocked])
+        return len(blocked)
+
+    def remove_obstacle(self, rect: Rectangle) -> int:
+        """Unblock the edges of a previously added obstacle and return the number of restored edges.
+        Edges crossing another obstacle stay blocked by it, edges added or removed since are left as they are."""
+        if rect.id not in self.obstacles:
+            return 0
+        _, blocked = self.obstacles.pop(rect.id)
+        restored = 0
+        for u, v, weight in blocked:
+            other = next((edges for other_rect, edges in self.obstacles.values() if _segment_intersects_rect(
+                self.positions[u], self.positions[v], other_rect)), None)
+            if other is not None:
+                other.append((u, v, weight))
+            else:
+                self._insert_edge(u, v, weight)
+                restored += 1
+        return restored
+
+    def _unblock(self, u: int, v: int):
+        """Forget an edge in the obstacles blocking it, an explicit change of the edge outlives them."""
+        u, v = min(u, v), max(u, v)
+        for _, edges in self.obstacles.values():
+            edges[:] = [edge for edge in edges if edge[:2] != (u, v)]
+
+    def _edges(self) -> Iterable[Tuple[int, int, float]]:
+        for u, neighbors in enumerate(self.adjacency):
+            for v, weight in neighbors.items():
+                if u < v:
+                    yield u, v, weight
+
+    def _run_dijkstra(self, source: int):
+        """Recompute the distance and predecessor rows of a single source."""
+        n = len(self.node_ids)
+        dist = [np.inf] * n
+        pred = [NO_PREDECESSOR] * n
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        expanded = 0
+        while heap:
+            current_distance, u = heapq.heappop(heap)
+            if current_distance > dist[u]:
+                continue
+            expanded += 1
+            for v, weight in self.adjacency[u].items():
+                distance = current_distance + weight
+                if distance < dist[v]:
+                    dist[v] = distance
+                    pred[v] = u
+                    heapq.heappush(heap, (distance, v))
+        self.expansions += expanded
+        self.dist[source] = dist
+        self.dist[:, source] = dist
+        self.pred[source] = pred
+
+    def _insert_edge(self, u: int, v: int, weight: float):
+        """Relax every pair through the new edge; only improved entries are rewritten."""
+        self.adjacency[u][v] = weight
+        self.adjacency[v][u] = weight
+        if self.dist is None:
+            return
+        dist_u, dist_v = self.dist[u].copy(), self.dist[v].copy()
+        pred_u, pred_v = self.pred[u].copy(), self.pred[v].copy()
+        pred_u[u], pred_v[v] = v, u
+        # Undirected graph, so column u equals row u
+        through_uv = dist_u[:, None] + weight + dist_v[None, :]
+        through_vu = dist_v[:, None] + weight + dist_u[None, :]
+        better_uv = (through_uv < self.dist - DISTANCE_EPSILON) & (through_uv <= through_vu)
+        better_vu = (through_vu < self.dist - DISTANCE_EPSILON) & ~better_uv
+        self.dist = np.where(better_uv, through_uv, np.where(better_vu, through_vu, self.dist))
+        self.pred = np.where(better_uv, pred_v[None, :], np.where(better_vu, pred_u[None, :], self.pred))
+
+    def _remove_edges(self, edges: List[Edge]):
+        """Drop edges and rerun Dijkstra only from sources whose shortest-path tree used one of them."""
+        affected: Set[int] = set()
+        for u, v in edges:
+            self.adjacency[u].pop(v, None)
+            self.adjacency[v].pop(u, None)
+            if self.pred is not None:
+                uses_edge = (self.pred[:, v] == u) | (self.pred[:, u] == v)
+                affected.update(np.nonzero(uses_edge)[0].tolist())
+        for source in sorted(affected):
+            self._run_dijkstra(source)
+
+
+def _segment_intersects_rect(start: np.ndarray, end: np.ndarray, rect: Rectangle) -> bool:
+    """Check whether a segment touches a rectangle using Liang-Barsky clipping."""
+    x0, y0 = float(start[0]), float(start[1])
+    dx, dy = float(end[0]) - x0, float(end[1]) - y0
+    t_min, t_max = 0.0, 1.0
+    for p, q in ((-dx, x0 - rect.x), (dx, rect.x + rect.w - x0), (-dy, y0 - rect.y), (dy, rect.y + rect.h - y0)):
+        if p == 0:
+            if q < 0:
+                return False
+            continue
+        t = q / p
+        if p < 0:
+            t_min = max(t_min, t)
+        else:
+            t_max = min(t_max, t)
+        if t_min > t_max:
+            return False
+    return True
+
+
+def solve_tour(distances: np.ndarray) -> Tuple[List[int], float]:
+    """Find a short closed tour over a symmetric distance matrix, starting and ending at index 0.
+    Small instances are solved exactly, larger ones with nearest neighbour followed by 2-opt."""
+    n = len(distances)
+    if n <= 1:
+        return [0] * (n + 1), 0.0
+    if n - 1 <= EXACT_TOUR_MAX_STOPS:
+        permutations = np.array(list(itertools.permutations(range(1, n))))
+        tours = np.hstack([np.zeros((len(permutations), 1), dtype=int), permutations,
+                           np.zeros((len(permutations), 1), dtype=int)])
+        lengths = distances[tours[:, :-1], tours[:, 1:]].sum(axis=1)
+        best = int(np.argmin(lengths))
+        return tours[best].tolist(), float(lengths[best])
+    tour = _two_opt(distances, _nearest_neighbour_tour(distances))
+    return tour, float(distances[tour[:-1], tour[1:]].sum())
+
+
+def _nearest_neighbour_tour(distances: np.ndarray) -> List[int]:
+    unvisited = set(range(1, len(distances)))
+    tour = [0]
+    while unvisited:
+        current = tour[-1]
+        nearest = min(unvisited, key=lambda i: distances[current, i])
+        unvisited.remove(nearest)
+        tour.append(nearest)
+    return tour + [0]
+
+
+def _two_opt(distances: np.ndarray, tour: List[int]) -> List[int]:
+    """Reverse tour segments while that shortens the tour; each pass scores all moves of one edge at once."""
+    tour = np.array(tour)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(tour) - 2):
+            a, b = tour[i - 1], tour[i]
+            c, d = tour[i + 1:-1], tour[i + 2:]
+            # Replacing edges (a, b) and (c, d) with (a, c) and (b, d) reverses tour[i..j]
+            delta = distances[a, c] + distances[b, d] - distances[a, b] - distances[c, d]
+            j = int(np.argmin(delta))
+            if delta[j] < -DISTANCE_EPSILON:
+                tour[i:i + j + 2] = tour[i:i + j + 2][::-1]
+                improved = True
+    return tour.tolist()
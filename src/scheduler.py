@@ -0,0 +1,341 @@
+import concurrent.futures
+import contextlib
+import functools
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import cv2
+
+from . import clustering, image_processing
+from .image_processing import UPSCALE
+from .shared_images import ImageSource, SharedImage, resolve_image
+from .utils import Icon, TextColor
+
+# Execution backends
+PROCESS_BACKEND = 'process'
+THREAD_BACKEND = 'thread'
+HYBRID_BACKEND = 'hybrid'
+BACKENDS = (PROCESS_BACKEND, THREAD_BACKEND, HYBRID_BACKEND)
+#
+DEFAULT_CV2_THREADS = 1  # The pool already uses every core, OpenCV threads on top only oversubscribe
+QUEUED_TASKS_PER_WORKER = 2  # Keeps workers busy while the consumer saves finished images
+HYBRID_THREAD_COST_LIMIT = 32_000_000  # Cheaper tasks run in threads, spawn and pickling would dominate them
+
+# task(filename, original, gray, config, spill) -> result
+Task = Callable[[str, ImageSource, ImageSource, dict, bool], object]
+
+
+class _ImageJob:
+    def __init__(self, filename: str, image: ImageSource, num_tasks: int):
+        """Track an input image and the sources its tasks read from."""
+        self.filename = filename
+        self.image = image
+        self.gray = None
+        self.owned_handles = []
+        original_img = resolve_image(image)
+        self.pixels = original_img.shape[0] * original_img.shape[1]
+        self.remaining = num_tasks
+        self.results = []
+
+    def arrays(self) -> Tuple[cv2.typing.MatLike, cv2.typing.MatLike]:
+        """Return the images for in-process tasks, shared by reference."""
+        original_img = resolve_image(self.image)
+        if self.gray is None:
+            self.gray = cv2.cvtColor(original_img, cv2.COLOR_BGR2GRAY)
+        return original_img, resolve_image(self.gray)
+
+    def handles(self) -> Tuple[SharedImage, SharedImage]:
+        """Return memory-mapped handles for worker processes, sharing the images on first use."""
+        if not isinstance(self.image, SharedImage):
+            self.image = self._share(self.image)
+        if not isinstance(self.gray, SharedImage):
+            self.gray = self._share(self.arrays()[1])
+        return self.image, self.gray
+
+    def _share(self, image: cv2.typing.MatLike) -> SharedImage:
+        handle = SharedImage.create(image)
+        self.owned_handles.append(handle)
+        return handle
+
+    def release(self):
+        for handle in self.owned_handles:
+            handle.release()
+
+
+class TaskScheduler:
+    def __init__(self, max_workers: Optional[int] = None, max_pending_images: Optional[int] = None,
+                 cv2_threads: Optional[int] = None, backend=PROCESS_BACKEND, persistent=False):
+        """Initialize a scheduler running every (image, config) task in one pool sized to the machine.
+
+        The process backend maps images into worker processes, the thread backend shares them by reference
+        (OpenCV releases the GIL), and the hybrid backend sends only expensive tasks to processes. OpenCV is limited
+        to `cv2_threads` threads per worker process, or process-wide for threads when given explicitly.
+
+        A persistent scheduler keeps its pools alive across runs until shutdown, so long-running services pay for
+        worker startup once; otherwise the pools live for a single run."""
+        if backend not in BACKENDS:
+            raise ValueError(f"Invalid backend. Choose one of {', '.join(BACKENDS)}.")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending_images = max_pending_images or self.max_workers
+        self.cv2_threads = cv2_threads
+        self.backend = backend
+        self.active_tasks = 0  # Submitted to a pool and not finished yet, across concurrent runs
+        self._active_lock = threading.Lock()
+        self._stack = contextlib.ExitStack() if persistent else None
+        self._executors = _LazyExecutors(self._stack, self.max_workers, self.cv2_threads) if persistent else None
+
+    def warm_up(self):
+        """Start the pools this backend uses and wait until every worker has its imports and tables ready."""
+        executors = self._executors
+        if executors is None:
+            raise RuntimeError("Only a persistent scheduler can be warmed up")
+        if self.backend != PROCESS_BACKEND:
+            executors.thread()
+            _warm_up_worker()
+        if self.backend != THREAD_BACKEND:
+            # Each submission without an idle worker spawns one, so this starts the whole pool
+            futures = [executors.submit_process(_warm_up_worker) for _ in range(self.max_workers)]
+            concurrent.futures.wait(futures)
+
+    def shutdown(self):
+        """Stop the pools of a persistent scheduler."""
+        if self._stack is not None:
+            self._stack.close()
+
+    def run(self, task: Task, images_with_names: Iterable[Tuple[ImageSource, str]],
+            configs: Union[List[dict], Callable[[str], List[dict]]], deadline: Optional[float] = None,
+            discard: Optional[Callable[[object], None]] = None,
+            failed: Optional[Callable[[str], None]] = None) -> Iterator[Tuple[str, list]]:
+        """Run the task for every image and config, yielding each image's results once all its configs complete.
+        Queued tasks are started most expensive first. `configs` is shared by every image, or a function returning
+        the configs of an image from its file name, called when the image is taken from the input.
+
+        Once the `time.monotonic()` deadline passes, every image is yielded as soon as it has one result, with fewer
+        results than configs. Its queued tasks are dropped, and images without a result keep only their running tasks,
+        or their first config when none is running. Tasks already running in a pool cannot be stopped; their results
+        are passed to `discard` when they finish.
+
+        A task that raises fails its image alone: the error is printed, the image's other tasks are dropped, its
+        results so far are discarded and it is not yielded, while the other images carry on; `failed` is called with
+        its file name. A worker process dying fails the images with tasks in the process pool, and the pool is replaced
+        for the rest."""
+        images = iter(images_with_names)
+        jobs: Dict[int, _ImageJob] = {}
+        queue = []  # Heap of (-cost, sequence, job id, config)
+        running: Dict[concurrent.futures.Future, int] = {}
+        sequence = itertools.count()
+        max_running = self.max_workers * QUEUED_TASKS_PER_WORKER
+        expired = False
+
+        with contextlib.ExitStack() as stack:
+            executors = self._executors or _LazyExecutors(stack, self.max_workers, self.cv2_threads)
+            try:
+                exhausted = False
+                while True:
+                    while not exhausted and len(jobs) < self.max_pending_images:
+                        image_with_name = next(images, None)
+                        if image_with_name is None:
+                            exhausted = True
+                            break
+                        image, filename = image_with_name
+                        image_configs = configs(filename) if callable(configs) else configs
+                        job_id = next(sequence)
+                        jobs[job_id] = job = _ImageJob(filename, image, len(image_configs))
+                        del image, image_with_name
+                        costs = [estimate_cost(job.pixels, config) for config in image_configs]
+                        if self.backend == PROCESS_BACKEND or (
+                                self.backend == HYBRID_BACKEND and max(costs) > HYBRID_THREAD_COST_LIMIT):
+                            job.handles()  # Share up front so the decoded array can be dropped
+                        for cost, config in zip(costs, image_configs):
+                            heapq.heappush(queue, (-cost, next(sequence), job_id, config))
+                    if deadline is not None and time.monotonic() >= deadline:
+                        if not expired:
+                            expired = True
+                            for job_id in [job_id for job_id, job in jobs.items() if job.results]:
+                                yield self._finish_early(jobs.pop(job_id), job_id, running, discard)
+                        queue = self._trim_queue(queue, jobs, running)
+                    while queue and len(running) < max_running:
+                        negative_cost, _, job_id, config = heapq.heappop(queue)
+                        job = jobs[job_id]
+                        if self._runs_in_thread(-negative_cost):
+                            future = executors.thread().submit(task, job.filename, *job.arrays(), config, False)
+                        else:
+                            future = executors.submit_process(task, job.filename, *job.handles(), config, True)
+                        running[future] = job_id
+                        self._track(future)
+                    if not running:
+                        break
+                    timeout = None if expired or deadline is None else max(0.0, deadline - time.monotonic())
+                    done, _ = concurrent.futures.wait(running, timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        job_id = running.pop(future, None)
+                        if job_id is None:  # Detached by an image finished early in this batch
+                            continue
+                        job = jobs[job_id]
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            queue = self._fail_job(jobs.pop(job_id), job_id, e, queue, running, discard)
+                            if failed is not None:
+                                failed(job.filename)
+                            continue
+                        job.results.append(result)
+                        job.remaining -= 1
+                        if job.remaining == 0:
+                            del jobs[job_id]
+                            job.release()
+                            yield job.filename, job.results
+                        elif expired:
+                            yield self._finish_early(jobs.pop(job_id), job_id, running, discard)
+            finally:
+                # Left early, by the consumer or an error: tasks still in the pools must not leak their results
+                for future in list(running):
+                    del running[future]
+                    if not future.cancel() and discard is not None:
+                        future.add_done_callback(functools.partial(_discard_result, discard))
+                for job in jobs.values():
+                    job.release()
+
+    @staticmethod
+    def _finish_early(job: _ImageJob, job_id: int, running: Dict[concurrent.futures.Future, int],
+                      discard: Optional[Callable[[object], None]]) -> Tuple[str, list]:
+        """Detach the tasks of an image still in the pools, cancelling those not started yet."""
+        for future in [future for future, owner in running.items() if owner == job_id]:
+            del running[future]
+            if not future.cancel() and discard is not None:
+                future.add_done_callback(functools.partial(_discard_result, discard))
+        job.release()
+        return job.filename, job.results
+
+    @classmethod
+    def _fail_job(cls, job: _ImageJob, job_id: int, error: Exception, queue: list,
+                  running: Dict[concurrent.futures.Future, int], discard: Optional[Callable[[object], None]]) -> list:
+        """Drop an image whose task raised, with its queued and running tasks and its results so far,
+        and return the queue without it."""
+        print(f"{Icon.ERROR} [Process] Failed processing image {TextColor.YELLOW}{job.filename}{TextColor.RESET}. "
+              f"Error: {error}")
+        cls._finish_early(job, job_id, running, discard)
+        if discard is not None:
+            for result in job.results:
+                discard(result)
+        queue = [entry for entry in queue if entry[2] != job_id]
+        heapq.heapify(queue)
+        return queue
+
+    @staticmethod
+    def _trim_queue(queue: list, jobs: Dict[int, _ImageJob], running: Dict[concurrent.futures.Future, int]) -> list:
+        """Keep the first queued config of images without results or running tasks, and drop every other one."""
+        busy = set(running.values())
+        first: Dict[int, tuple] = {}
+        for entry in queue:
+            job_id = entry[2]
+            if job_id in jobs and job_id not in busy and (job_id not in first or entry[1] < first[job_id][1]):
+                first[job_id] = entry
+        for entry in queue:
+            job = jobs.get(entry[2])
+            if job is not None and first.get(entry[2]) is not entry:
+                job.remaining -= 1
+        trimmed = list(first.values())
+        heapq.heapify(trimmed)
+        return trimmed
+
+    def _track(self, future: concurrent.futures.Future):
+        with self._active_lock:
+            self.active_tasks += 1
+        future.add_done_callback(self._task_done)
+
+    def _task_done(self, _: concurrent.futures.Future):
+        with self._active_lock:
+            self.active_tasks -= 1
+
+    def _runs_in_thread(self, cost: int) -> bool:
+        if self.backend == HYBRID_BACKEND:
+            return cost <= HYBRID_THREAD_COST_LIMIT
+        return self.backend == THREAD_BACKEND
+
+
+class _LazyExecutors:
+    def __init__(self, stack: contextlib.ExitStack, max_workers: int, cv2_threads: Optional[int]):
+        """Create each pool on first use so a thread-only run never spawns processes.
+        A process pool broken by a dying worker is replaced, it would reject every later task."""
+        self.stack = stack
+        self.max_workers = max_workers
+        self.cv2_threads = cv2_threads
+        self._thread = None
+        self._process = None
+        self._lock = threading.Lock()  # Persistent pools are shared by concurrent runs
+        stack.callback(self._shutdown_process)
+
+    def thread(self) -> concurrent.futures.ThreadPoolExecutor:
+        with self._lock:
+            if self._thread is None:
+                if self.cv2_threads is not None:
+                    cv2.setNumThreads(self.cv2_threads)
+                self._thread = self.stack.enter_context(concurrent.futures.ThreadPoolExecutor(self.max_workers))
+            return self._thread
+
+    def process(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self._lock:
+            if self._process is None:
+                cv2_threads = DEFAULT_CV2_THREADS if self.cv2_threads is None else self.cv2_threads
+                self._process = concurrent.futures.ProcessPoolExecutor(
+                    self.max_workers, initializer=_initialize_worker, initargs=(cv2_threads,))
+            return self._process
+
+    def submit_process(self, fn: Callable, *args) -> concurrent.futures.Future:
+        """Submit to the process pool, replacing it first if it broke since the last submission."""
+        pool = self.process()
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            self._replace_process(pool)
+            pool = self.process()
+            future = pool.submit(fn, *args)
+        future.add_done_callback(functools.partial(self._check_process, pool))
+        return future
+
+    def _check_process(self, pool: concurrent.futures.ProcessPoolExecutor, future: concurrent.futures.Future):
+        # Every task in a broken pool fails with it, so the pool is dropped on its first failure
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._replace_process(pool)
+
+    def _replace_process(self, broken: concurrent.futures.ProcessPoolExecutor):
+        with self._lock:
+            if self._process is not broken:  # Already replaced on the failure of another task
+                return
+            self._process = None
+        print(f"{Icon.ERROR} [Process] A worker process died, replacing the process pool")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _shutdown_process(self):
+        with self._lock:
+            pool, self._process = self._process, None
+        if pool is not None:
+            pool.shutdown()
+
+
+def estimate_cost(pixels: int, config: dict) -> int:
+    """Estimate the relative cost of a config; every upscale step quadruples the pixels processed after it."""
+    return pixels * 4 ** config['steps'].count(UPSCALE)
+
+
+def _discard_result(discard: Callable[[object], None], future: concurrent.futures.Future):
+    if not future.cancelled() and future.exception() is None:
+        discard(future.result())
+
+
+def _initialize_worker(cv2_threads: int):
+    """Limit OpenCV's internal threading inside a pool worker and prepare it for its first task."""
+    cv2.setNumThreads(cv2_threads)
+    _warm_up_worker()
+
+
+def _warm_up_worker():
+    """Import the deferred clustering backends and build the image processing tables."""
+    clustering.warm_up()
+    image_processing.warm_up()
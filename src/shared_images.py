@@ -0,0 +1,48 @@
+import contextlib
+import os
+import tempfile
+from typing import Optional, Union
+
+import cv2
+import numpy as np
+
+# tmpfs keeps the mapped pages in RAM on Linux; elsewhere the OS page cache shares them between processes
+SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+SHARED_PREFIX = 'layroad_'
+NPY_EXTENSION = '.npy'
+
+
+class SharedImage:
+    def __init__(self, path: str, shape: tuple, dtype: str):
+        """Lightweight, picklable handle to an image stored in a memory-mapped file."""
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+
+    @classmethod
+    def create(cls, image: np.ndarray, directory: Optional[str] = SHARED_DIR) -> 'SharedImage':
+        """Copy an image into a new memory-mapped file owned by the caller."""
+        fd, path = tempfile.mkstemp(prefix=SHARED_PREFIX, suffix=NPY_EXTENSION, dir=directory)
+        with os.fdopen(fd, 'wb') as file:
+            np.save(file, image)
+        return cls(path, image.shape, image.dtype.str)
+
+    def load(self) -> np.ndarray:
+        """Map the image read-only into the current process without copying it."""
+        return np.load(self.path, mmap_mode='r')
+
+    def release(self):
+        """Remove the backing file; existing mappings stay valid until they are garbage collected."""
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+    def __repr__(self):
+        return f"SharedImage({self.path}, {self.shape}, {self.dtype})"
+
+
+ImageSource = Union[cv2.typing.MatLike, SharedImage]
+
+
+def resolve_image(image: ImageSource) -> cv2.typing.MatLike:
+    """Return the image array for either an in-memory image or a shared image handle."""
+    return image.load() if isinstance(image, SharedImage) else image